@@ -0,0 +1,212 @@
+# archive.py
+# Cold tier for old stationboard rows: Parquet files next to the hot SQLite database
+#
+#     archive/railway=sbb/month=2025-09/station=Zurich/part-20251024T120000-1234.parquet
+#
+# move_to_archive() streams rows older than N days out of sbb_data.db / db_data.db into
+# one Parquet file per (railway, month, station) and run, then deletes them from SQLite
+# in short id-range transactions. raw_json / raw_xml are left out unless keep_raw=True.
+# read_history() answers a station/time-range query from both tiers, reading only the
+# requested columns and the matching partitions of the archive.
+#
+#     python archive.py --db sbb_data.db move --older-than-days 30
+#     python archive.py --db sbb_data.db history Zurich --since 2025-06-01
+
+import argparse
+import os
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from data_access import SBB_DB, read_connection, write_connection
+from raw_store import decompress, is_reference
+
+DEFAULT_ARCHIVE_DIR = "archive"
+RAW_COLUMNS = ("raw_json", "raw_xml")
+# station and month live in the directory names, not in the files
+PARTITIONING = ds.partitioning(
+    pa.schema([("railway", pa.string()), ("month", pa.string()), ("station", pa.string())]),
+    flavor="hive",
+)
+DELETE_CHUNK = 20000  # ids per delete transaction
+READ_CHUNK = 50000    # rows per fetchmany / Parquet row group
+
+
+def railway_of(db_file):
+    """'sbb' for sbb_data.db-style files (raw_json), 'db' for Deutsche Bahn ones (raw_xml)"""
+    with read_connection(db_file) as conn:
+        columns = [r[1] for r in conn.execute("PRAGMA table_info(stationboard)")]
+    return "sbb" if "raw_json" in columns else "db"
+
+
+def arrow_schema(conn, columns):
+    """Parquet schema for stationboard columns (INTEGER -> int64, everything else -> string)"""
+    types = {r[1]: (r[2] or "").upper() for r in conn.execute("PRAGMA table_info(stationboard)")}
+    return pa.schema([(c, pa.int64() if "INT" in types.get(c, "") else pa.string()) for c in columns])
+
+
+class _PartitionWriter:
+    """Writes consecutive rows of one (month, station) into a temp file, renamed on close"""
+
+    def __init__(self, archive_dir, railway, month, station, schema, run_id):
+        self.month = month
+        self.station = station
+        self.dir = os.path.join(archive_dir, f"railway={railway}", f"month={month}",
+                                f"station={quote(station, safe='')}")
+        os.makedirs(self.dir, exist_ok=True)
+        self.path = os.path.join(self.dir, f"part-{run_id}.parquet")
+        self.tmp_path = os.path.join(self.dir, f".part-{run_id}.parquet.tmp")  # ignored by readers
+        self.writer = pq.ParquetWriter(self.tmp_path, schema, compression="zstd")
+        self.schema = schema
+        self.rows = 0
+
+    def write(self, rows):
+        columns = list(zip(*rows))
+        self.writer.write_table(pa.Table.from_arrays(
+            [pa.array(col, type=f.type) for col, f in zip(columns, self.schema)], schema=self.schema))
+        self.rows += len(rows)
+
+    def close(self):
+        self.writer.close()
+        os.replace(self.tmp_path, self.path)
+
+
+def move_to_archive(db_file, archive_dir=DEFAULT_ARCHIVE_DIR, older_than_days=30, keep_raw=False, railway=None):
+    """
+    Move rows with fetched_at older than `older_than_days` into the Parquet archive.
+    Rows are deleted from SQLite only after all their files are complete.
+    Returns the number of rows moved.
+    """
+    railway = railway or railway_of(db_file)
+    cutoff = (datetime.utcnow() - timedelta(days=older_than_days)).isoformat()
+    run_id = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{os.getpid()}"
+
+    conn = write_connection(db_file)
+    all_columns = [r[1] for r in conn.execute("PRAGMA table_info(stationboard)")]
+    # ids are kept so a run interrupted between writing and deleting can't duplicate rows
+    columns = [c for c in all_columns if c != "station" and (keep_raw or c not in RAW_COLUMNS)]
+    schema = arrow_schema(conn, columns)
+    fetched_idx = columns.index("fetched_at")
+    raw_idx = next((i for i, c in enumerate(columns) if c in RAW_COLUMNS), None)
+    # payloads kept in raw_payloads (see raw_store.py) are archived as text
+    has_payloads = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'raw_payloads'").fetchone()
+    resolve = raw_idx is not None and has_payloads is not None
+    payload_join = (f"LEFT JOIN raw_payloads p ON p.hash = substr(s.{columns[raw_idx]}, 5)" if resolve else "")
+
+    # rows added while we run are left for the next run
+    max_id = conn.execute("SELECT MAX(id) FROM stationboard").fetchone()[0] or 0
+    cur = conn.execute(f"""
+        SELECT s.station, {', '.join('s.' + c for c in columns)}{', p.data' if resolve else ''}
+        FROM stationboard s
+        {payload_join}
+        WHERE s.fetched_at < ? AND s.id <= ?
+        ORDER BY s.station, s.fetched_at
+    """, (cutoff, max_id))
+
+    # (station, fetched_at) order: each partition's rows arrive together, one open file at a time
+    writers, writer, pending = [], None, []
+    while True:
+        batch = cur.fetchmany(READ_CHUNK)
+        if not batch:
+            break
+        for row in batch:
+            station, values = row[0] or "", row[1:len(columns) + 1]
+            if resolve and is_reference(values[raw_idx]):
+                values = values[:raw_idx] + (decompress(row[-1]),) + values[raw_idx + 1:]
+            month = values[fetched_idx][:7]
+            if writer is None or (writer.station, writer.month) != (station, month):
+                if pending:
+                    writer.write(pending)
+                    pending = []
+                writer = _PartitionWriter(archive_dir, railway, month, station, schema, run_id)
+                writers.append(writer)
+            pending.append(values)
+            if len(pending) >= READ_CHUNK:
+                writer.write(pending)
+                pending = []
+    if pending:
+        writer.write(pending)
+    for w in writers:
+        w.close()
+    moved = sum(w.rows for w in writers)
+
+    # delete in short transactions so ingest and the dashboard are never blocked for long
+    min_id = conn.execute("SELECT MIN(id) FROM stationboard").fetchone()[0] or 0
+    for lo in range(min_id, max_id + 1, DELETE_CHUNK):
+        conn.execute("DELETE FROM stationboard WHERE id BETWEEN ? AND ? AND fetched_at < ?",
+                     (lo, lo + DELETE_CHUNK - 1, cutoff))
+        conn.commit()
+    print(f"Archived {moved} rows older than {cutoff[:10]} into {len(writers)} files under {archive_dir}")
+    return moved
+
+
+def read_history(station, since=None, until=None, columns=("fetched_at", "train_name", "delay_minutes"),
+                 db_file=SBB_DB, archive_dir=DEFAULT_ARCHIVE_DIR, railway=None):
+    """
+    Rows of `station` with since <= fetched_at < until (ISO strings or None) from the
+    Parquet archive and the SQLite database, as one DataFrame ordered by fetched_at.
+    Only `columns` (plus id, to drop rows present in both tiers) are read from either tier.
+    """
+    wanted = list(columns)
+    columns = wanted if "id" in wanted else ["id"] + wanted
+    frames = []
+
+    railway = railway or railway_of(db_file)
+    root = os.path.join(archive_dir, f"railway={railway}")
+    if os.path.isdir(archive_dir) and os.path.isdir(root):
+        dataset = ds.dataset(archive_dir, format="parquet", partitioning=PARTITIONING)
+        expr = (ds.field("railway") == railway) & (ds.field("station") == station)
+        if since:
+            expr &= (ds.field("month") >= since[:7]) & (ds.field("fetched_at") >= since)
+        if until:
+            expr &= (ds.field("month") <= until[:7]) & (ds.field("fetched_at") < until)
+        frames.append(dataset.to_table(columns=columns, filter=expr).to_pandas())
+
+    sql = f"SELECT {', '.join(columns)} FROM stationboard WHERE station = ?"
+    params = [station]
+    if since:
+        sql += " AND fetched_at >= ?"
+        params.append(since)
+    if until:
+        sql += " AND fetched_at < ?"
+        params.append(until)
+    with read_connection(db_file) as conn:
+        frames.append(pd.read_sql_query(sql, conn, params=params))
+
+    frames = [f for f in frames if not f.empty] or frames[-1:]
+    df = pd.concat(frames, ignore_index=True).drop_duplicates("id")[wanted]
+    if "fetched_at" in df.columns:
+        df = df.sort_values("fetched_at", kind="stable", ignore_index=True)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old stationboard rows to Parquet and query both tiers")
+    parser.add_argument("--db", default=SBB_DB, help="SQLite DB filename")
+    parser.add_argument("--archive-dir", default=DEFAULT_ARCHIVE_DIR, help="Root folder of the Parquet archive")
+    parser.add_argument("--railway", choices=("sbb", "db"), help="Archive partition (default: from the DB's raw column)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_move = sub.add_parser("move", help="Move rows older than N days into the archive")
+    p_move.add_argument("--older-than-days", type=int, default=30)
+    p_move.add_argument("--keep-raw", action="store_true", help="Also archive raw_json/raw_xml payloads")
+    p_hist = sub.add_parser("history", help="Print a station's history from both tiers")
+    p_hist.add_argument("station")
+    p_hist.add_argument("--since", help="ISO date/time, inclusive")
+    p_hist.add_argument("--until", help="ISO date/time, exclusive")
+    args = parser.parse_args()
+
+    if args.command == "move":
+        move_to_archive(args.db, args.archive_dir, args.older_than_days, keep_raw=args.keep_raw, railway=args.railway)
+    else:
+        df = read_history(args.station, since=args.since, until=args.until, db_file=args.db,
+                          archive_dir=args.archive_dir, railway=args.railway)
+        print(df.to_string(max_rows=40))
+        print(f"{len(df)} rows")
+
+
+if __name__ == "__main__":
+    main()
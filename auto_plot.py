@@ -1,63 +1,61 @@
 # auto_plot.py
-import time
+import threading
 import pandas as pd
-import sqlite3
 import matplotlib.pyplot as plt
 
-from ingest_sbb import fetch_station_data  # импорт функции из ingest_sbb.py
+from chart_report import draw_delays
+from data_access import SBB_DB, read_connection, write_connection
+from ingest_sbb import prepare_db
+from poll_scheduler import PollScheduler  # опрос API в фоне, с адаптивным интервалом
+from delta_loader import StationWindow
 
 station_name = "Zurich"  # станция для отслеживания
 fetch_limit = 15         # сколько ближайших рейсов забираем за раз
-update_interval = 300    # 5 минут в секундах
+update_interval = 300    # 5 минут в секундах: как часто перерисовываем график
 
-def fetch_and_store(station_name):
-    """Fetch new data and store in SQLite"""
-    fetch_station_data(station=station_name, limit=fetch_limit)
+# История станции держим в памяти между итерациями и догружаем только новые строки
+history = StationWindow(station_name)
 
 def plot_delays(station_name="Zurich"):
     """Plot train delays from SQLite database (only delayed trains)"""
-    conn = sqlite3.connect("sbb_data.db")
-    df = pd.read_sql_query("""
-        SELECT fetched_at, train_name, delay_minutes, station
-        FROM stationboard
-        WHERE station = ?
-        ORDER BY fetched_at ASC
-    """, conn, params=(station_name,))
-    conn.close()
+    global history
+    if history.station != station_name:
+        history = StationWindow(station_name)
+    with read_connection(SBB_DB) as conn:  # соединение живёт между итерациями
+        new_rows = history.refresh(conn)
+    print(f"Loaded {new_rows} new rows ({len(history.frame)} in memory)")
 
     # Фильтруем только поезда с задержкой
-    df = df[df['delay_minutes'] > 0]
+    df = history.frame
+    df = df[pd.to_numeric(df['delay_minutes'], errors='coerce') > 0]
 
     if df.empty:
         print("No delayed trains to plot.")
         return
 
-    df['fetched_at'] = pd.to_datetime(df['fetched_at'])
-    plt.figure(figsize=(12,6))
-
-    for train in df['train_name'].unique():
-        train_data = df[df['train_name'] == train]
-        plt.plot(train_data['fetched_at'], train_data['delay_minutes'],
-                 marker='o', linestyle='-', label=train)
-        for x, y in zip(train_data['fetched_at'], train_data['delay_minutes']):
-            plt.text(x, y, str(y), fontsize=8, ha='center', va='bottom')
-
-    avg_delay = df['delay_minutes'].mean()
-    plt.title(f"Train Delays Over Time at {station_name} (avg {avg_delay:.1f} min)")
-    plt.xlabel("Time of Fetch")
-    plt.ylabel("Delay (minutes)")
-    plt.grid(True)
-    plt.axhline(0, color='gray', linestyle='--', linewidth=0.8)
-    plt.xticks(rotation=45)
-    plt.legend()
+    # одно окно на всё время работы, перерисовываем его содержимое
+    plt.figure(1, figsize=(12,6))
+    plt.clf()
+
+    # по линии на поезд (один groupby); подписи у каждой точки убраны — значения видны по оси Y
+    avg_delay = history.delayed_mean()
+    draw_delays(plt.gca(), df, station_name,
+                title=f"Train Delays Over Time at {station_name} (avg {avg_delay:.1f} min)")
     plt.tight_layout()
-    plt.show()
-
-# Основной цикл: каждые update_interval секунд обновляем данные и график
-while True:
-    print(f"Fetching new data for {station_name}...")
-    fetch_and_store(station_name)
-    print("Plotting delays...")
-    plot_delays(station_name)
-    print(f"Waiting {update_interval//60} minutes before next update...\n")
-    time.sleep(update_interval)
+
+# Данные забирает планировщик в отдельном потоке (не зависит от окна графика);
+# основной цикл только перерисовывает график. plt.pause не блокирует, в отличие от plt.show.
+prepare_db(write_connection(SBB_DB))  # таблицы нужны графику ещё до первого опроса
+scheduler = PollScheduler([station_name], limit=fetch_limit, db=SBB_DB)
+poller = threading.Thread(target=scheduler.run, name="poller", daemon=True)
+poller.start()
+plt.ion()
+try:
+    while True:
+        print("Plotting delays...")
+        plot_delays(station_name)
+        print(f"Next redraw in {update_interval//60} minutes...\n")
+        plt.pause(update_interval)
+except KeyboardInterrupt:
+    scheduler.stop()
+    poller.join()
@@ -0,0 +1,134 @@
+# bulk_writer.py
+# Batched SQLite writer shared by all ingest scripts
+
+import sqlite3
+import time
+
+# Connection settings for ingest: WAL lets the dashboard read while we write,
+# synchronous=NORMAL is durable in WAL mode and avoids an fsync per commit.
+# auto_vacuum only takes effect in new files (existing ones: retention.py enable-vacuum);
+# it lets retention.py return deleted pages to the OS in small steps instead of a full VACUUM.
+PRAGMAS = (
+    ("auto_vacuum", "INCREMENTAL"),
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("cache_size", -64000),  # negative = KiB, i.e. ~64 MB page cache
+    ("temp_store", "MEMORY"),
+)
+
+DEFAULT_BATCH_SIZE = 5000
+
+
+def tune_connection(conn):
+    """Apply the ingest PRAGMAs to an open connection"""
+    for name, value in PRAGMAS:
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+
+def connect(db_file):
+    """Open a new SQLite connection tuned for bulk writes (scripts share one via data_access.write_connection)"""
+    return tune_connection(sqlite3.connect(db_file))
+
+
+class BulkWriter:
+    """
+    Collect rows for one INSERT statement and write them in batches
+    with executemany, one explicit transaction per batch.
+
+        with BulkWriter(conn, INSERT_SQL) as writer:
+            for row in rows:
+                writer.add(row)
+        writer.report("day 2025-10-24")
+
+    Rows for other statements can ride along with `writer.add(row, sql=OTHER_SQL)`;
+    they are written in the same transaction as the main rows of that batch.
+
+    With `raw_store` (a raw_store.RawStore), the raw payload of each main row is replaced
+    by a content hash reference and stored once in raw_payloads, in the same transaction.
+    """
+
+    def __init__(self, conn, sql, batch_size=DEFAULT_BATCH_SIZE, raw_store=None):
+        self.conn = conn
+        self.sql = sql
+        self.batch_size = batch_size
+        self.raw_store = raw_store
+        if raw_store is not None:
+            raw_store.create_table(conn)
+        self.rows = 0          # rows written so far
+        self.batches = 0       # transactions committed so far
+        self.write_seconds = 0.0
+        self.started = time.perf_counter()
+        self._pending = {sql: []}  # statement -> rows, in first-use order
+        self._pending_count = 0
+
+    def add(self, row, sql=None):
+        if self.raw_store is not None and sql is None:
+            row, payload = self.raw_store.split(row)
+            if payload is not None:
+                self._pending.setdefault(self.raw_store.sql, []).append(payload)
+        self._pending.setdefault(sql or self.sql, []).append(row)
+        self._pending_count += 1
+        if self._pending_count >= self.batch_size:
+            self.flush()
+
+    def add_many(self, rows):
+        for row in rows:
+            self.add(row)
+
+    def flush(self):
+        """Write all pending rows in one transaction (also commits other pending statements on the connection)"""
+        if not self._pending_count:
+            if self.conn.in_transaction:
+                self.conn.commit()
+            return 0
+        pending, count = self._pending, self._pending_count
+        self._pending, self._pending_count = {self.sql: []}, 0
+        t0 = time.perf_counter()
+        conn = self.conn
+        if not conn.in_transaction:
+            conn.execute("BEGIN")
+        try:
+            for sql, batch in pending.items():
+                if batch:
+                    conn.executemany(sql, batch)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            if self.raw_store is not None:
+                self.raw_store.forget()
+            raise
+        if self.raw_store is not None:
+            self.raw_store.commit()
+        self.write_seconds += time.perf_counter() - t0
+        self.rows += count
+        self.batches += 1
+        return count
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            self._pending, self._pending_count = {self.sql: []}, 0
+            if self.raw_store is not None:
+                self.raw_store.forget()  # the dropped rows' payloads were never written
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        elapsed = self.elapsed
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def report(self, label="Bulk write"):
+        print(f"{label}: {self.rows} rows in {self.batches} transactions, "
+              f"{self.elapsed:.2f}s total ({self.rows_per_second:,.0f} rows/s, "
+              f"{self.write_seconds:.2f}s in SQLite)")
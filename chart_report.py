@@ -0,0 +1,193 @@
+# chart_report.py
+# Batch report: one delay chart per station, rendered headless to PNG or SVG
+#
+#     python chart_report.py --db sbb_data.db --out reports --days 7
+#     python chart_report.py --stations "Zurich,Bern" --format svg --workers 4
+#
+# The rows of all stations to render are read with one query (served by the
+# (station, fetched_at, ...) index) and split by station with one groupby; each chart
+# splits its rows by train with one more groupby. Stations are drawn in a process pool on
+# matplotlib Figure objects with the Agg canvas: no window, no pyplot state, nothing blocks.
+# <out>/manifest.json remembers, per chart file, the station's station_stats entry (row
+# count, last fetched_at) and the chart options at its last render; charts where both are
+# unchanged are skipped without reading their rows.
+
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from compact_schema import is_compact, iso_sql
+from data_access import SBB_DB, read_connection
+
+DEFAULT_OUT_DIR = "reports"
+MANIFEST = "manifest.json"
+CHART_VERSION = 1   # bump when the drawing changes, to re-render everything once
+FIGSIZE = (12, 6)
+MAX_LEGEND = 20     # more trains than this: no legend
+FORMATS = ("png", "svg")
+
+
+def draw_delays(ax, df, station, title=None):
+    """Delay over fetch time, one line per train, on a matplotlib Axes (also used by the interactive plots)"""
+    trains = 0
+    for train, rows in df.groupby("train_name", sort=False):
+        ax.plot(rows["fetched_at"], rows["delay_minutes"], marker="o", markersize=3, linestyle="-", label=train)
+        trains += 1
+    ax.set_title(title or f"Train Delays Over Time at {station}")
+    ax.set_xlabel("Time of Fetch")
+    ax.set_ylabel("Delay (minutes)")
+    ax.grid(True)
+    ax.axhline(0, color="gray", linestyle="--", linewidth=0.8)
+    ax.tick_params(axis="x", labelrotation=45)
+    if 0 < trains <= MAX_LEGEND:
+        ax.legend(fontsize="small")
+    return trains
+
+
+def chart_name(station, fmt):
+    return f"{quote(station, safe=' ')}.{fmt}"
+
+
+def chart_path(out_dir, station, fmt):
+    return os.path.join(out_dir, chart_name(station, fmt))
+
+
+def render_station(station, df, path, fmt, dpi=100):
+    """Draw one station's chart into `path` (written to a temp file, then renamed)"""
+    fig = Figure(figsize=FIGSIZE)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    mean = df["delay_minutes"].mean() if not df.empty else 0
+    draw_delays(ax, df, station, title=f"Train Delays Over Time at {station} (avg {mean:.1f} min, {len(df)} rows)")
+    fig.tight_layout()
+    tmp_path = path + ".tmp"
+    fig.savefig(tmp_path, format=fmt, dpi=dpi)
+    os.replace(tmp_path, path)
+    return station
+
+
+def _render(args):
+    return render_station(*args)
+
+
+# ------------------------
+# Change detection
+# ------------------------
+def load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def station_signatures(conn, stations=None):
+    """station -> [rows, last_fetched_at] from the station_stats catalog"""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'station_stats'").fetchone() is None:
+        raise SystemExit("No station_stats table yet, run db_schema.py first")
+    signatures = {station: [rows, last] for station, rows, last in conn.execute(
+        "SELECT station, rows, last_fetched_at FROM station_stats WHERE rows > 0 AND station != ''")}
+    if stations is not None:
+        signatures = {s: signatures[s] for s in stations if s in signatures}
+    return signatures
+
+
+def load_rows(conn, stations, since=None):
+    """Rows of `stations` since `since`, one query; fetched_at as datetime, delays numeric"""
+    placeholders = ", ".join("?" * len(stations))
+    if is_compact(conn):
+        # the view's fetched_at can't be ranged on: seek the compact (station_id, fetched_at) index
+        sql = f"""
+            SELECT s.name AS station, {iso_sql('c.fetched_at')} AS fetched_at, t.name AS train_name,
+                   c.delay_minutes AS delay_minutes
+            FROM stations s
+            JOIN stationboard_compact c ON c.station_id = s.id
+            LEFT JOIN trains t ON t.id = c.train_id
+            WHERE s.name IN ({placeholders}) {"AND c.fetched_at >= CAST(strftime('%s', ?) AS INTEGER)" if since else ""}
+            ORDER BY s.name, c.fetched_at
+        """
+    else:
+        sql = f"""
+            SELECT station, fetched_at, train_name, delay_minutes FROM stationboard
+            WHERE station IN ({placeholders}) {"AND fetched_at >= ?" if since else ""}
+            ORDER BY station, fetched_at
+        """
+    df = pd.read_sql_query(sql, conn, params=list(stations) + ([since] if since else []))
+    df["fetched_at"] = pd.to_datetime(df["fetched_at"])
+    df["delay_minutes"] = pd.to_numeric(df["delay_minutes"], errors="coerce")
+    return df
+
+
+def render_report(db=SBB_DB, out_dir=DEFAULT_OUT_DIR, fmt="png", days=7, stations=None,
+                  workers=None, force=False, dpi=100):
+    """
+    Render the charts of stations whose data changed since their last render.
+    Returns (rendered stations, number skipped).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    since = (datetime.utcnow().date() - timedelta(days=days)).isoformat() if days else None  # moves daily
+    options = [since, fmt, dpi, CHART_VERSION]
+    manifest = load_manifest(out_dir)
+
+    with read_connection(db) as conn:
+        signatures = station_signatures(conn, stations)
+        todo = [s for s, sig in signatures.items()
+                if force or manifest.get(chart_name(s, fmt)) != sig + options
+                or not os.path.exists(chart_path(out_dir, s, fmt))]
+        df = load_rows(conn, todo, since) if todo else None
+
+    jobs = []
+    if todo:
+        for station, rows in df.groupby("station", sort=False):
+            jobs.append((station, rows.drop(columns="station"), chart_path(out_dir, station, fmt), fmt, dpi))
+        # stations with no rows in the time range: an empty chart
+        for station in set(todo) - {job[0] for job in jobs}:
+            jobs.append((station, df.iloc[0:0].drop(columns="station"), chart_path(out_dir, station, fmt), fmt, dpi))
+
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            rendered = list(pool.map(_render, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        rendered = [_render(job) for job in jobs]
+
+    for station in rendered:
+        manifest[chart_name(station, fmt)] = signatures[station] + options
+    save_manifest(out_dir, manifest)
+    return rendered, len(signatures) - len(todo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render per-station delay charts to PNG/SVG (headless)")
+    parser.add_argument("--db", default=SBB_DB, help="SQLite DB filename")
+    parser.add_argument("--out", default=DEFAULT_OUT_DIR, help="Output folder")
+    parser.add_argument("--format", choices=FORMATS, default="png")
+    parser.add_argument("--days", type=int, default=7, help="Days of history per chart (0: all)")
+    parser.add_argument("--stations", help="Comma-separated station list (default: all in the catalog)")
+    parser.add_argument("--workers", type=int, help="Render processes (default: CPU count)")
+    parser.add_argument("--dpi", type=int, default=100)
+    parser.add_argument("--force", action="store_true", help="Render unchanged stations too")
+    args = parser.parse_args()
+
+    stations = [s.strip() for s in args.stations.split(",") if s.strip()] if args.stations else None
+    rendered, skipped = render_report(args.db, args.out, args.format, args.days, stations,
+                                      workers=args.workers, force=args.force, dpi=args.dpi)
+    print(f"Rendered {len(rendered)} charts into {args.out}, {skipped} unchanged")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+# compact_schema.py
+# Dictionary-encoded, integer-timestamp storage for stationboard data
+#
+# The classic `stationboard` table repeats station / train / category / destination /
+# operator as text in every row, stores timestamps as ISO strings and carries a raw
+# JSON/XML payload per row. The compact layout keeps one narrow row per departure:
+#
+#     stationboard_compact(id, fetched_at INTEGER, station_id, train_id, category_id,
+#                          to_station_id, operator_id, scheduled_at, actual_at,
+#                          delay_seconds, delay_minutes, source_id,
+#                          scheduled_offset, actual_offset)
+#
+# with lookup tables `stations`, `trains`, `categories`, `operators`, and (optionally)
+# raw payloads in a separate `stationboard_raw` table. scheduled/actual times are epoch
+# seconds plus the UTC offset they were written with, so the view returns SBB's
+# '2025-10-24T12:34:00+0200' unchanged; ISO '+02:00' offsets come back as '+0200' and
+# DB's 'YYMMddHHmm' values as ISO 'YYYY-MM-DDTHH:MM:00'.
+#
+# Without --keep-raw the compact layout has no raw payloads at all: the migration drops
+# raw_payloads together with the legacy table (--drop-legacy; until then the legacy rows
+# still reference it), and RawStore stops writing payloads to such a file (raw_store.stores_raw).
+#
+# The migration renames the old table to `stationboard_legacy` and creates a view named
+# `stationboard` with the old columns, plus INSTEAD OF triggers, so existing SELECTs,
+# INSERTs (all ingest scripts) and DELETEs (cleanup scripts) keep working unchanged;
+# the triggers also keep delay_rollup (rollups.py) and station_stats (station_catalog.py) up to date.
+# The view computes fetched_at per row, so a fetched_at range or ORDER BY on it can't use
+# an index: readers get the queries below through queries_for(conn), which seek the compact
+# table's (station_id, fetched_at) index instead. New code that needs fast time-range scans
+# should query the compact table directly too (see read_station_range()).
+#
+#     python compact_schema.py --db db_data.db [--keep-raw] [--drop-legacy]
+
+import argparse
+import sqlite3
+import sys
+import time
+
+import data_access
+from data_access import DB_DB, write_connection
+from db_schema import run_script
+from rollups import ROLLUP_TABLE_SQL, BACKFILL_SQL, rollup_add_sql, rollup_remove_sql
+from station_catalog import STATS_TABLE_SQL, BACKFILL_SQL as STATS_BACKFILL_SQL, stats_add_sql, stats_remove_sql
+
+LOOKUPS = ("stations", "trains", "categories", "operators")
+
+
+def epoch_sql(col):
+    """
+    SQL expression turning a timestamp column into epoch seconds. Understands
+    ISO 8601 (with or without offset, incl. SBB's '+0200'), and DB's 'YYMMddHHmm'
+    (stored as wall-clock time). Values it can't parse are kept as text.
+    """
+    return f"""COALESCE(CASE
+        WHEN {col} GLOB '[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]'
+            THEN CAST(strftime('%s', '20' || substr({col}, 1, 2) || '-' || substr({col}, 3, 2) || '-'
+                 || substr({col}, 5, 2) || ' ' || substr({col}, 7, 2) || ':' || substr({col}, 9, 2)) AS INTEGER)
+        WHEN {col} GLOB '*T*[+-][0-9][0-9][0-9][0-9]'
+            THEN CAST(strftime('%s', substr({col}, 1, length({col}) - 2) || ':' || substr({col}, -2)) AS INTEGER)
+        ELSE CAST(strftime('%s', {col}) AS INTEGER)
+    END, NULLIF({col}, ''))"""
+
+
+def offset_sql(col):
+    """SQL expression for the UTC offset (seconds) of an ISO timestamp with '+HHMM' or '+HH:MM', else NULL"""
+    return f"""CASE
+        WHEN {col} GLOB '*T*[+-][0-9][0-9][0-9][0-9]'
+            THEN (CASE substr({col}, -5, 1) WHEN '-' THEN -1 ELSE 1 END)
+                 * (substr({col}, -4, 2) * 3600 + substr({col}, -2, 2) * 60)
+        WHEN {col} GLOB '*T*[+-][0-9][0-9]:[0-9][0-9]'
+            THEN (CASE substr({col}, -6, 1) WHEN '-' THEN -1 ELSE 1 END)
+                 * (substr({col}, -5, 2) * 3600 + substr({col}, -2, 2) * 60)
+    END"""
+
+
+def iso_offset_sql(col, offset):
+    """Like iso_sql, but local time with a '+HHMM' suffix when `offset` (seconds) is not NULL"""
+    return f"""CASE WHEN typeof({col}) = 'integer' AND {offset} IS NOT NULL
+        THEN strftime('%Y-%m-%dT%H:%M:%S', {col} + {offset}, 'unixepoch')
+             || printf('%s%02d%02d', CASE WHEN {offset} < 0 THEN '-' ELSE '+' END,
+                       abs({offset}) / 3600, abs({offset}) % 3600 / 60)
+        ELSE {iso_sql(col)} END"""
+
+
+def iso_sql(col):
+    """SQL expression rendering an epoch column back as an ISO string (UTC); text values pass through"""
+    return f"CASE typeof({col}) WHEN 'integer' THEN strftime('%Y-%m-%dT%H:%M:%S', {col}, 'unixepoch') ELSE {col} END"
+
+
+def create_compact_tables(conn, keep_raw=False):
+    script = "".join(f"""
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY,
+        name TEXT UNIQUE
+    );
+    """ for name in LOOKUPS)
+    script += """
+    CREATE TABLE IF NOT EXISTS stationboard_compact (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        fetched_at INTEGER,
+        station_id INTEGER REFERENCES stations(id),
+        train_id INTEGER REFERENCES trains(id),
+        category_id INTEGER REFERENCES categories(id),
+        to_station_id INTEGER REFERENCES stations(id),
+        operator_id INTEGER REFERENCES operators(id),
+        scheduled_at INTEGER,
+        actual_at INTEGER,
+        delay_seconds INTEGER,
+        delay_minutes INTEGER,
+        source_id INTEGER,
+        scheduled_offset INTEGER,
+        actual_offset INTEGER
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_compact_station_fetched
+        ON stationboard_compact (station_id, fetched_at, train_id, category_id, delay_minutes);
+    CREATE INDEX IF NOT EXISTS idx_compact_station_id ON stationboard_compact (station_id);
+    CREATE INDEX IF NOT EXISTS idx_compact_source ON stationboard_compact (source_id);
+    """
+    if keep_raw:
+        script += """
+    CREATE TABLE IF NOT EXISTS stationboard_raw (
+        id INTEGER PRIMARY KEY,
+        raw TEXT
+    );
+    """
+    run_script(conn, script)
+
+
+def compact_bound(fn):
+    """MIN/MAX(fetched_at) of the deleted row's station, read from the compact index"""
+    return (f"(SELECT {iso_sql(f'{fn}(fetched_at)')} FROM stationboard_compact "
+            f"WHERE station_id = (SELECT id FROM stations WHERE name = old.station))")
+
+
+def create_compat_view(conn, raw_column, keep_raw=False):
+    """Create the `stationboard` view and the triggers that route writes to the compact tables"""
+    create_view(conn, raw_column, keep_raw)
+    create_triggers(conn, raw_column, keep_raw)
+
+
+def create_view(conn, raw_column, keep_raw=False):
+    raw_select = "r.raw" if keep_raw else "NULL"
+    raw_join = "LEFT JOIN stationboard_raw r ON r.id = c.id" if keep_raw else ""
+    run_script(conn, f"""
+    CREATE VIEW stationboard AS
+    SELECT c.id AS id,
+           {iso_sql('c.fetched_at')} AS fetched_at,
+           s.name AS station,
+           t.name AS train_name,
+           k.name AS category,
+           d.name AS to_station,
+           o.name AS operator,
+           {iso_offset_sql('c.scheduled_at', 'c.scheduled_offset')} AS scheduled_time,
+           {iso_offset_sql('c.actual_at', 'c.actual_offset')} AS actual_time,
+           c.delay_seconds AS delay_seconds,
+           c.delay_minutes AS delay_minutes,
+           {raw_select} AS {raw_column},
+           c.source_id AS source_id
+    FROM stationboard_compact c
+    LEFT JOIN stations s ON s.id = c.station_id
+    LEFT JOIN trains t ON t.id = c.train_id
+    LEFT JOIN categories k ON k.id = c.category_id
+    LEFT JOIN stations d ON d.id = c.to_station_id
+    LEFT JOIN operators o ON o.id = c.operator_id
+    {raw_join};
+    """)
+
+
+def create_triggers(conn, raw_column, keep_raw=False):
+    # the catalog keeps fetched_at as the view returns it (whole seconds), so the delete
+    # trigger's comparisons with old.fetched_at and compact_bound() match it
+    run_script(conn, f"""
+    CREATE TRIGGER stationboard_insert INSTEAD OF INSERT ON stationboard
+    BEGIN
+        INSERT OR IGNORE INTO stations (name) VALUES (new.station);
+        INSERT OR IGNORE INTO stations (name) VALUES (new.to_station);
+        INSERT OR IGNORE INTO trains (name) VALUES (new.train_name);
+        INSERT OR IGNORE INTO categories (name) VALUES (new.category);
+        INSERT OR IGNORE INTO operators (name) VALUES (new.operator);
+        INSERT INTO stationboard_compact (
+            fetched_at, station_id, train_id, category_id, to_station_id, operator_id,
+            scheduled_at, actual_at, delay_seconds, delay_minutes, source_id, scheduled_offset, actual_offset
+        ) VALUES (
+            {epoch_sql('new.fetched_at')},
+            (SELECT id FROM stations WHERE name = new.station),
+            (SELECT id FROM trains WHERE name = new.train_name),
+            (SELECT id FROM categories WHERE name = new.category),
+            (SELECT id FROM stations WHERE name = new.to_station),
+            (SELECT id FROM operators WHERE name = new.operator),
+            {epoch_sql('new.scheduled_time')},
+            {epoch_sql('new.actual_time')},
+            new.delay_seconds, new.delay_minutes, new.source_id,
+            {offset_sql('new.scheduled_time')}, {offset_sql('new.actual_time')}
+        );
+        {f"INSERT INTO stationboard_raw (id, raw) VALUES (last_insert_rowid(), new.{raw_column});" if keep_raw else ""}
+        {rollup_add_sql('new')}
+        {stats_add_sql('new', iso_sql(epoch_sql('new.fetched_at')))}
+    END;
+
+    CREATE TRIGGER stationboard_delete INSTEAD OF DELETE ON stationboard
+    BEGIN
+        DELETE FROM stationboard_compact WHERE id = old.id;
+        {"DELETE FROM stationboard_raw WHERE id = old.id;" if keep_raw else ""}
+        {rollup_remove_sql('old')}
+        {stats_remove_sql('old', compact_bound)}
+    END;
+    """)
+
+
+def is_compact(conn):
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = 'stationboard'").fetchone()
+    return row is not None and row[0] == "view"
+
+
+def update_compact(conn):
+    """Bring a database migrated by an earlier version up to date: indexes, triggers, catalog format"""
+    columns = [r[1] for r in conn.execute("PRAGMA table_info(stationboard)")]
+    raw_column = "raw_xml" if "raw_xml" in columns else "raw_json"
+    keep_raw = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'stationboard_raw'").fetchone() is not None
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        create_compact_tables(conn)
+        compact_columns = [r[1] for r in conn.execute("PRAGMA table_info(stationboard_compact)")]
+        for column in ("scheduled_offset", "actual_offset"):
+            if column not in compact_columns:
+                conn.execute(f"ALTER TABLE stationboard_compact ADD COLUMN {column} INTEGER")  # old rows: UTC
+        conn.execute("DROP VIEW stationboard")  # drops its triggers too
+        create_compat_view(conn, raw_column, keep_raw=keep_raw)
+        conn.execute(STATS_BACKFILL_SQL)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def migrate_to_compact(conn, keep_raw=False, drop_legacy=False):
+    """
+    Move an existing `stationboard` table into the compact layout (ids are preserved).
+    Runs in one transaction; afterwards `stationboard` is a compatibility view.
+    """
+    if is_compact(conn):
+        update_compact(conn)
+        print("Database already uses the compact schema.")
+        return 0
+
+    columns = [r[1] for r in conn.execute("PRAGMA table_info(stationboard)")]
+    if not columns:
+        raise ValueError("No stationboard table to migrate")
+    raw_column = "raw_xml" if "raw_xml" in columns else "raw_json"
+    source_expr = "l.source_id" if "source_id" in columns else "NULL"
+
+    t0 = time.perf_counter()
+    conn.execute("BEGIN")
+    try:
+        create_compact_tables(conn, keep_raw=keep_raw)
+        for table, expr in (("stations", "station"), ("stations", "to_station"), ("trains", "train_name"),
+                            ("categories", "category"), ("operators", "operator")):
+            conn.execute(f"INSERT OR IGNORE INTO {table} (name) SELECT DISTINCT {expr} FROM stationboard")
+        n = conn.execute(f"""
+            INSERT INTO stationboard_compact (
+                id, fetched_at, station_id, train_id, category_id, to_station_id, operator_id,
+                scheduled_at, actual_at, delay_seconds, delay_minutes, source_id, scheduled_offset, actual_offset
+            )
+            SELECT l.id, {epoch_sql('l.fetched_at')}, s.id, t.id, k.id, d.id, o.id,
+                   {epoch_sql('l.scheduled_time')}, {epoch_sql('l.actual_time')},
+                   l.delay_seconds, l.delay_minutes, {source_expr},
+                   {offset_sql('l.scheduled_time')}, {offset_sql('l.actual_time')}
+            FROM stationboard l
+            LEFT JOIN stations s ON s.name = l.station
+            LEFT JOIN trains t ON t.name = l.train_name
+            LEFT JOIN categories k ON k.name = l.category
+            LEFT JOIN stations d ON d.name = l.to_station
+            LEFT JOIN operators o ON o.name = l.operator
+            ORDER BY l.id
+        """).rowcount
+        if keep_raw:
+            conn.execute(f"INSERT INTO stationboard_raw (id, raw) SELECT id, {raw_column} FROM stationboard")
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'delay_rollup'").fetchone():
+            run_script(conn, ROLLUP_TABLE_SQL + BACKFILL_SQL)
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'station_stats'").fetchone():
+            run_script(conn, STATS_TABLE_SQL + STATS_BACKFILL_SQL)
+        conn.execute("ALTER TABLE stationboard RENAME TO stationboard_legacy")
+        # the rollup/catalog triggers moved with the table; the view's triggers take over
+        for trigger in ("rollup_insert", "rollup_delete", "stats_insert", "stats_delete"):
+            conn.execute(f"DROP TRIGGER IF EXISTS stationboard_{trigger}")
+        create_compat_view(conn, raw_column, keep_raw=keep_raw)
+        # catalog bounds in the view's format (the backfill above read the raw strings)
+        conn.execute(STATS_BACKFILL_SQL)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    print(f"Migrated {n} rows to the compact schema in {time.perf_counter() - t0:.1f}s")
+
+    if drop_legacy:
+        conn.execute("DROP TABLE stationboard_legacy")
+        if not keep_raw:
+            conn.execute("DROP TABLE IF EXISTS raw_payloads")  # only the legacy rows referenced them
+        conn.commit()
+        conn.execute("VACUUM")
+        print("Dropped stationboard_legacy and vacuumed the database")
+    return n
+
+
+# ------------------------
+# Reads
+# ------------------------
+# Same parameters and columns as the data_access queries of the same name; cutoffs stay
+# ISO strings and are turned into epoch seconds once per query.
+STATION_HISTORY_SQL = f"""
+    SELECT {iso_sql('c.fetched_at')} AS fetched_at, t.name AS train_name, c.delay_minutes AS delay_minutes,
+           s.name AS station
+    FROM stations s
+    JOIN stationboard_compact c ON c.station_id = s.id
+    LEFT JOIN trains t ON t.id = c.train_id
+    WHERE s.name = ?
+    ORDER BY c.fetched_at ASC
+"""
+
+STATION_LATEST_SQL = f"""
+    SELECT {iso_sql('c.fetched_at')} AS fetched_at, t.name AS train_name, d.name AS to_station,
+           c.delay_minutes AS delay_minutes
+    FROM stations s
+    JOIN stationboard_compact c ON c.station_id = s.id
+    LEFT JOIN trains t ON t.id = c.train_id
+    LEFT JOIN stations d ON d.id = c.to_station_id
+    WHERE s.name = ?
+    ORDER BY c.fetched_at DESC
+    LIMIT ?
+"""
+
+
+def latest_departures_sql(categories):
+    """Latest rows of a station since a cutoff, optionally restricted to some categories (one ? each)"""
+    category_filter = (f"AND c.category_id IN (SELECT id FROM categories WHERE name IN ({', '.join('?' * len(categories))}))"
+                       if categories else "")
+    return f"""
+        SELECT {iso_sql('c.fetched_at')} AS fetched_at, t.name AS train_name, c.delay_minutes AS delay_minutes,
+               s.name AS station, k.name AS category
+        FROM stations s
+        JOIN stationboard_compact c ON c.station_id = s.id
+        LEFT JOIN trains t ON t.id = c.train_id
+        LEFT JOIN categories k ON k.id = c.category_id
+        WHERE s.name = ?
+          AND c.fetched_at >= CAST(strftime('%s', ?) AS INTEGER)
+          {category_filter}
+        ORDER BY c.fetched_at DESC
+        LIMIT ?
+    """
+
+
+def queries_for(conn):
+    """
+    The module with the read queries (STATION_HISTORY_SQL, STATION_LATEST_SQL,
+    latest_departures_sql) for `conn`'s database: this one for the compact layout, else data_access
+    """
+    return sys.modules[__name__] if is_compact(conn) else data_access
+
+
+def load_lookup(conn, table):
+    """Return {id: name} for one lookup table (these stay small: hundreds to thousands of rows)"""
+    return dict(conn.execute(f"SELECT id, name FROM {table}"))
+
+
+def read_station_range(conn, station, since_epoch, until_epoch=None):
+    """
+    Fast path for time-range scans: rows of one station with fetched_at in [since, until).
+    Returns (fetched_at epoch, train_name, category, delay_minutes) tuples, oldest first.
+    The scan reads only the covering index; ids are decoded in Python.
+    """
+    row = conn.execute("SELECT id FROM stations WHERE name = ?", (station,)).fetchone()
+    if row is None:
+        return []
+    until_epoch = until_epoch if until_epoch is not None else 2**62
+    trains = load_lookup(conn, "trains")
+    categories = load_lookup(conn, "categories")
+    rows = conn.execute("""
+        SELECT fetched_at, train_id, category_id, delay_minutes
+        FROM stationboard_compact
+        WHERE station_id = ? AND fetched_at >= ? AND fetched_at < ?
+        ORDER BY fetched_at
+    """, (row[0], since_epoch, until_epoch))
+    return [(f, trains.get(t), categories.get(k), d) for f, t, k, d in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate a stationboard database to the compact schema")
+    parser.add_argument("--db", default=DB_DB, help="SQLite DB filename")
+    parser.add_argument("--keep-raw", action="store_true", help="Keep raw_json/raw_xml payloads (in stationboard_raw)")
+    parser.add_argument("--drop-legacy", action="store_true", help="Drop the old table and VACUUM to reclaim space")
+    args = parser.parse_args()
+
+    conn = write_connection(args.db)
+    conn.isolation_level = None
+    migrate_to_compact(conn, keep_raw=args.keep_raw, drop_legacy=args.drop_legacy)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,16 @@
 # dashboard.py
 import streamlit as st
 import pandas as pd
-import sqlite3
 import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np
-from ingest_sbb import fetch_station_data
+from datetime import datetime, timedelta
+from compact_schema import queries_for
+from data_access import DB_DB, SBB_DB
+from fetch_cache import StationFetchCache
+from query_cache import QueryCache
+from station_catalog import station_names, total_rows
+from rollups import CATEGORIES_SQL, TRAIN_MEAN_SQL, hour_key, station_summary
 from streamlit_autorefresh import st_autorefresh
 
 # ================================
@@ -39,6 +44,16 @@ st_autorefresh(interval=300_000, limit=None, key="train_delay_autorefresh")
 # ================================
 # --- Helper functions ---
 # ================================
+@st.cache_resource
+def get_fetch_cache():
+    """One background fetcher shared by all sessions: one API call per station per 5 minutes"""
+    return StationFetchCache(db=SBB_DB, ttl=300)
+
+@st.cache_resource
+def get_query_cache(db_file):
+    """Query results shared by all sessions, recomputed only after new data is committed"""
+    return QueryCache(db_file)
+
 def section_start():
     st.markdown('<div class="section-container">', unsafe_allow_html=True)
 
@@ -75,55 +90,52 @@ if railway == "SBB (Switzerland)":
                     "Lucerne", "St. Gallen", "Lugano", "Interlaken", "Winterthur"]
     station_name = st.selectbox("Select Station", swiss_cities)
     fetch_limit = st.number_input("Number of upcoming departures", min_value=5, max_value=50, value=15)
-    fetch_station_data(station=station_name, limit=fetch_limit)
+    # Refresh in the background (at most once per TTL); this rerun only reads from SQLite
+    fetch_cache = get_fetch_cache()
+    fetch_cache.request(station_name, limit=fetch_limit)
 
     # Info message
+    status = fetch_cache.status(station_name)
+    if status is None:
+        info = "Fetching latest departures in the background..."
+    else:
+        info = f"Data fetched automatically · last update {datetime.fromtimestamp(status[0]):%H:%M:%S}."
     section_start()
-    st.markdown('<div class="custom-info">Data fetched automatically.</div>', unsafe_allow_html=True)
+    st.markdown(f'<div class="custom-info">{info}</div>', unsafe_allow_html=True)
     section_end()
 
     # Load data
-    conn = sqlite3.connect("sbb_data.db")
-    df = pd.read_sql_query("""
-        SELECT fetched_at, train_name, delay_minutes, station, category
-        FROM stationboard
-        WHERE station = ?
-        ORDER BY fetched_at DESC
-        LIMIT ?
-    """, conn, params=(station_name, fetch_limit))
-
-    df_history = pd.read_sql_query("""
-        SELECT fetched_at, train_name, delay_minutes
-        FROM stationboard
-        WHERE station = ?
-          AND fetched_at >= datetime('now', '-7 days')
-        ORDER BY fetched_at ASC
-    """, conn, params=(station_name,))
-
-    total_rows = conn.execute("SELECT COUNT(*) FROM stationboard").fetchone()[0]
-    conn.close()
-
-    st.caption(f"📊 Records in database: {total_rows}")
-
-    # Timestamps
-    df['fetched_at'] = pd.to_datetime(df['fetched_at'])
-    df_history['fetched_at'] = pd.to_datetime(df_history['fetched_at'])
-
-    # Train type filter
-    categories = df['category'].dropna().unique().tolist()
+    cache = get_query_cache(SBB_DB)
+
+    # 7-day history comes from the hourly delay_rollup, not from the raw rows
+    week_ago = datetime.utcnow() - timedelta(days=7)
+    df_mean_delay = cache.read_sql(TRAIN_MEAN_SQL, (station_name, hour_key(week_ago)))
+    week_summary = cache.call(station_summary, station_name, hour_key(week_ago))
+
+    st.caption(f"📊 Records in database: {cache.call(total_rows)}")
+
+    # Train type filter (options: categories seen at this station in the last 7 days)
+    categories = cache.read_sql(CATEGORIES_SQL, (station_name, hour_key(week_ago)))['category'].tolist()
     selected_categories = st.multiselect("Select Train Types", options=categories, default=categories)
-    if selected_categories:
-        df = df[df['category'].isin(selected_categories)]
 
     # Last N hours
     hours_back = st.slider("Show data from last N hours", 1, 600, 240)
-    df_filtered = df[df['fetched_at'] >= pd.Timestamp.now() - pd.Timedelta(hours=hours_back)]
+
+    # Both filters run in SQLite, so LIMIT counts matching rows only.
+    # fetched_at is UTC; the cutoff is rounded to the minute so reruns share a cached result.
+    cutoff = (datetime.utcnow() - timedelta(hours=hours_back)).replace(second=0, microsecond=0)
+    queries = cache.call(queries_for)  # plain or compact schema
+    df_filtered = cache.read_sql(queries.latest_departures_sql(selected_categories),
+                                 (station_name, cutoff.isoformat(), *selected_categories, fetch_limit))
+    df_filtered['fetched_at'] = pd.to_datetime(df_filtered['fetched_at'])
 
     # KPI
     avg_delay = df_filtered['delay_minutes'].mean() if not df_filtered.empty else 0
     max_delay = df_filtered['delay_minutes'].max() if not df_filtered.empty else 0
     delayed_count = df_filtered[df_filtered['delay_minutes'] > 0].shape[0]
     kpi_block(avg_delay, delayed_count, max_delay)
+    st.caption(f"Last 7 days: avg {week_summary[0]:.1f} min · {week_summary[1]} delayed "
+               f"of {week_summary[3]} departures · max {week_summary[2]} min")
 
     # Delayed trains table
     section_start()
@@ -155,12 +167,10 @@ if railway == "SBB (Switzerland)":
     section_end()
 
     # Predicted delays
-    if not df_history.empty:
+    if not df_mean_delay.empty:
         section_start()
         st.subheader("Predicted Delays (last 7 days)")
-        df_mean_delay = df_history.groupby('train_name')['delay_minutes'].mean().reset_index()
-        df_mean_delay.rename(columns={'delay_minutes': 'predicted_delay'}, inplace=True)
-        df_forecast = df.merge(df_mean_delay, on='train_name', how='left')
+        df_forecast = df_filtered.merge(df_mean_delay, on='train_name', how='left')
         st.dataframe(
             df_forecast[['train_name', 'delay_minutes', 'predicted_delay', 'category']]
             .style.background_gradient(subset=['predicted_delay'], cmap='Greys')
@@ -172,28 +182,16 @@ if railway == "SBB (Switzerland)":
 # ================================
 elif railway == "Deutsche Bahn (Germany)":
     st.header("🚄 Deutsche Bahn (Germany)")
-    DB_FILE = "db_data.db"
-    conn = sqlite3.connect(DB_FILE)
-    stations = pd.read_sql_query(
-        "SELECT DISTINCT station FROM stationboard ORDER BY station", conn
-    )["station"].dropna().tolist()
+    cache = get_query_cache(DB_DB)
+    stations = cache.call(station_names)
     station_name_db = st.selectbox("Select DB Station", stations or ["No stations found"])
     limit = st.number_input("Number of recent departures", min_value=10, max_value=200, value=15, key="db_limit")
 
-    df_db = pd.read_sql_query("""
-        SELECT fetched_at, train_name, to_station, delay_minutes
-        FROM stationboard
-        WHERE station = ?
-        ORDER BY datetime(fetched_at) DESC
-        LIMIT ?
-    """, conn, params=(station_name_db, limit))
-
-    df_history_db = pd.read_sql_query("""
-        SELECT train_name, delay_minutes
-        FROM stationboard
-        WHERE station = ? AND fetched_at >= date('now', '-30 day')
-    """, conn, params=(station_name_db,))
-    conn.close()
+    df_db = cache.read_sql(cache.call(queries_for).STATION_LATEST_SQL, (station_name_db, limit))
+
+    month_ago = (datetime.utcnow() - timedelta(days=30)).replace(hour=0)
+    df_mean_delay_db = cache.read_sql(TRAIN_MEAN_SQL, (station_name_db, hour_key(month_ago)))
+    month_summary = cache.call(station_summary, station_name_db, hour_key(month_ago))
 
     df_db["fetched_at"] = pd.to_datetime(df_db["fetched_at"], errors="coerce")
 
@@ -204,6 +202,8 @@ elif railway == "Deutsche Bahn (Germany)":
     max_delay_db = df_filtered_db['delay_minutes'].max() if not df_filtered_db.empty else 0
     delayed_count_db = df_filtered_db[df_filtered_db['delay_minutes'] > 0].shape[0]
     kpi_block(avg_delay_db, delayed_count_db, max_delay_db)
+    st.caption(f"Last 30 days: avg {month_summary[0]:.1f} min · {month_summary[1]} delayed "
+               f"of {month_summary[3]} departures · max {month_summary[2]} min")
 
     # Delayed trains table
     section_start()
@@ -255,11 +255,9 @@ elif railway == "Deutsche Bahn (Germany)":
     section_end()
 
     # Predicted delays
-    if not df_history_db.empty:
+    if not df_mean_delay_db.empty:
         section_start()
         st.subheader("Predicted Delays (DB)")
-        df_mean_delay_db = df_history_db.groupby("train_name")["delay_minutes"].mean().reset_index()
-        df_mean_delay_db.rename(columns={"delay_minutes": "predicted_delay"}, inplace=True)
         np.random.seed(42)
         df_mean_delay_db["predicted_delay"] *= np.random.uniform(0.9, 1.1, len(df_mean_delay_db))
         df_mean_delay_db["predicted_delay"] = df_mean_delay_db["predicted_delay"].round(0).astype(int)
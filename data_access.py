@@ -0,0 +1,199 @@
+# data_access.py
+# One place where scripts get their SQLite connections
+#
+#     conn = write_connection(SBB_DB)              # ingest, cleanup, CLIs
+#     with read_connection(SBB_DB) as conn:        # dashboards, plots, reports
+#         ...
+#     df = read_frame(STATION_HISTORY_SQL, ("Zurich",), SBB_DB)
+#
+# Connections are opened once per process and reused (Streamlit reruns, auto_plot's loop,
+# fetch_cache refreshes), so PRAGMAs are applied once per connection, and the fixed SQL
+# strings below stay compiled in each connection's statement cache.
+# Per database file there is one writer connection (ingest PRAGMAs from bulk_writer) and a
+# small pool of read-only reader connections that threads check out and give back.
+# Everything is closed at interpreter exit; close() releases a file earlier (e.g. before
+# deleting or replacing it).
+
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from bulk_writer import tune_connection
+
+SBB_DB = "sbb_data.db"
+DB_DB = "db_data.db"
+
+DEFAULT_READERS = 4
+STATEMENT_CACHE = 256  # prepared statements kept per connection (sqlite3 default: 128)
+BUSY_TIMEOUT = 30      # seconds a writer waits for another process's write lock (sqlite3 default: 5)
+
+# Readers never write; WAL lets them run next to the writer
+READ_PRAGMAS = (
+    ("query_only", 1),
+    ("cache_size", -32000),   # ~32 MB per reader
+    ("mmap_size", 268435456),  # 256 MB memory-mapped reads
+    ("temp_store", "MEMORY"),
+)
+
+# ------------------------
+# Common queries
+# ------------------------
+# Newest rows of the whole table (read_db.py)
+LATEST_ROWS_SQL = """
+    SELECT id, fetched_at, station, train_name, to_station, delay_minutes
+    FROM stationboard
+    ORDER BY id DESC
+    LIMIT ?
+"""
+
+# Full history of one station, oldest first (plot_delays.py)
+STATION_HISTORY_SQL = """
+    SELECT fetched_at, train_name, delay_minutes, station
+    FROM stationboard
+    WHERE station = ?
+    ORDER BY fetched_at ASC
+"""
+
+# Latest N rows of one station (dashboard, DB section)
+STATION_LATEST_SQL = """
+    SELECT fetched_at, train_name, to_station, delay_minutes
+    FROM stationboard
+    WHERE station = ?
+    ORDER BY fetched_at DESC
+    LIMIT ?
+"""
+
+
+def latest_departures_sql(categories):
+    """Latest rows of a station since a cutoff, optionally restricted to some categories (one ? each)"""
+    category_filter = f"AND category IN ({', '.join('?' * len(categories))})" if categories else ""
+    return f"""
+        SELECT fetched_at, train_name, delay_minutes, station, category
+        FROM stationboard
+        WHERE station = ?
+          AND fetched_at >= ?
+          {category_filter}
+        ORDER BY fetched_at DESC
+        LIMIT ?
+    """
+
+
+class Database:
+    """Connections to one SQLite file: a shared writer and a pool of readers"""
+
+    def __init__(self, path, readers=DEFAULT_READERS):
+        self.path = path
+        self.readers = readers
+        self._writer = None
+        self.write_lock = threading.RLock()  # held by threads sharing the writer connection
+        self._idle = queue.LifoQueue()  # reader connections not checked out
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def writer(self):
+        """
+        The process's writer connection (WAL, synchronous=NORMAL, large cache).
+        It may be used from any thread, but only by one at a time: code that writes from
+        several threads serializes on `write_lock`.
+        """
+        with self._lock:
+            if self._writer is None:
+                self._writer = tune_connection(sqlite3.connect(
+                    self.path, timeout=BUSY_TIMEOUT, check_same_thread=False, cached_statements=STATEMENT_CACHE))
+            return self._writer
+
+    def open_reader(self):
+        """A new read-only connection with READ_PRAGMAS, owned by the caller"""
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=STATEMENT_CACHE)
+        for name, value in READ_PRAGMAS:
+            conn.execute(f"PRAGMA {name}={value}")
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """Check out a pooled reader; waits when all `readers` connections are in use"""
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            if self._closed:
+                conn.close()
+            else:
+                self._idle.put(conn)
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.readers:
+                self._opened += 1
+                return self.open_reader()
+        return self._idle.get()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+
+
+_databases = {}  # absolute path -> Database
+_databases_lock = threading.Lock()
+
+
+def database(path=SBB_DB):
+    """The process-wide Database for `path`"""
+    key = os.path.abspath(path)
+    with _databases_lock:
+        db = _databases.get(key)
+        if db is None:
+            db = _databases[key] = Database(path)
+        return db
+
+
+def write_connection(path=SBB_DB):
+    """The shared writer connection of `path` (don't close it, see close())"""
+    return database(path).writer()
+
+
+def read_connection(path=SBB_DB):
+    """with read_connection(path) as conn: ... (pooled, read-only)"""
+    return database(path).reader()
+
+
+def read_frame(sql, params=(), path=SBB_DB):
+    """pd.read_sql_query on a pooled reader"""
+    import pandas as pd  # ingest scripts use this module without pandas
+
+    with read_connection(path) as conn:
+        return pd.read_sql_query(sql, conn, params=tuple(params))
+
+
+def close(path=None):
+    """Close the connections of one file (or of all files); they are reopened on next use"""
+    with _databases_lock:
+        if path is None:
+            dbs = list(_databases.values())
+            _databases.clear()
+        else:
+            db = _databases.pop(os.path.abspath(path), None)
+            dbs = [db] if db is not None else []
+    for db in dbs:
+        db.close()
+
+
+atexit.register(close)
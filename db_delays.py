@@ -0,0 +1,119 @@
+# db_delays.py
+# Join Deutsche Bahn plan and fchg data per stop to get real delays
+#
+# A plan file lists the planned stops (<s id=...>) of a station with planned times (`pt`)
+# on <ar>/<dp>. fchg files carry changes for the same stop ids: changed times (`ct`) and
+# change status (`cs`: p = planned, a = added, c = cancelled).
+# Both are upserted into `stop_delays`, keyed on the stop id, so ingesting a new fchg
+# file only touches the stops it mentions. The delay is recomputed inside the upsert,
+# whichever of the two sides arrives first.
+
+import calendar
+from datetime import datetime
+from functools import lru_cache
+
+# DB timetable times look like 2510241205 = 2025-10-24 12:05 (local time)
+DB_TIME_FORMAT = "%y%m%d%H%M"
+
+
+def create_stop_tables(conn):
+    """Create the stop_delays table (one row per DB stop id)"""
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS stop_delays (
+        stop_id TEXT PRIMARY KEY,
+        station TEXT,
+        train_name TEXT,
+        category TEXT,
+        operator TEXT,
+        planned_arrival INTEGER,
+        planned_departure INTEGER,
+        changed_arrival INTEGER,
+        changed_departure INTEGER,
+        arrival_status TEXT,
+        departure_status TEXT,
+        arrival_delay_seconds INTEGER,
+        departure_delay_seconds INTEGER,
+        updated_at TEXT
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_stop_delays_station_departure
+        ON stop_delays (station, planned_departure);
+    """)
+    conn.commit()
+
+
+# Times are stored as epoch seconds of the local wall-clock time, so
+# differences between them are delays in seconds.
+PLAN_UPSERT_SQL = """
+    INSERT INTO stop_delays (
+        stop_id, station, train_name, category, operator,
+        planned_arrival, planned_departure, arrival_delay_seconds, departure_delay_seconds, updated_at
+    ) VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7,
+              CASE WHEN ?6 IS NOT NULL THEN 0 END, CASE WHEN ?7 IS NOT NULL THEN 0 END, ?8)
+    ON CONFLICT (stop_id) DO UPDATE SET
+        station = excluded.station,
+        train_name = excluded.train_name,
+        category = excluded.category,
+        operator = excluded.operator,
+        planned_arrival = excluded.planned_arrival,
+        planned_departure = excluded.planned_departure,
+        arrival_delay_seconds = COALESCE(changed_arrival, excluded.planned_arrival) - excluded.planned_arrival,
+        departure_delay_seconds = COALESCE(changed_departure, excluded.planned_departure) - excluded.planned_departure,
+        updated_at = excluded.updated_at
+"""
+
+CHANGE_UPSERT_SQL = """
+    INSERT INTO stop_delays (
+        stop_id, station, changed_arrival, changed_departure, arrival_status, departure_status, updated_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (stop_id) DO UPDATE SET
+        changed_arrival = COALESCE(excluded.changed_arrival, changed_arrival),
+        changed_departure = COALESCE(excluded.changed_departure, changed_departure),
+        arrival_status = COALESCE(excluded.arrival_status, arrival_status),
+        departure_status = COALESCE(excluded.departure_status, departure_status),
+        arrival_delay_seconds = COALESCE(excluded.changed_arrival, changed_arrival, planned_arrival) - planned_arrival,
+        departure_delay_seconds = COALESCE(excluded.changed_departure, changed_departure, planned_departure) - planned_departure,
+        updated_at = excluded.updated_at
+"""
+
+
+@lru_cache(maxsize=65536)  # a day of files only uses a few thousand distinct minutes
+def parse_db_time(value):
+    """'2510241205' -> epoch seconds of that wall-clock time (None if missing/invalid)"""
+    if not value:
+        return None
+    try:
+        return calendar.timegm(datetime.strptime(value, DB_TIME_FORMAT).timetuple())
+    except ValueError:
+        return None
+
+
+def plan_stop(s, station_name, updated_at):
+    """Build a PLAN_UPSERT_SQL row from a plan <s> element"""
+    tl = s.find("tl")
+    attrs = tl.attrib if tl is not None else {}
+    ar = s.find("ar")
+    dp = s.find("dp")
+    return (
+        s.attrib.get("id", ""), station_name,
+        attrs.get("n", ""), attrs.get("c", ""), attrs.get("o", ""),
+        parse_db_time(ar.attrib.get("pt")) if ar is not None else None,
+        parse_db_time(dp.attrib.get("pt")) if dp is not None else None,
+        updated_at,
+    )
+
+
+def change_stop(s, station_name, updated_at):
+    """Build a CHANGE_UPSERT_SQL row from an fchg <s> element, or None if it changes no times"""
+    ar = s.find("ar")
+    dp = s.find("dp")
+    ar_attrs = ar.attrib if ar is not None else {}
+    dp_attrs = dp.attrib if dp is not None else {}
+    if not ({"ct", "cs"} & (ar_attrs.keys() | dp_attrs.keys())):
+        return None
+    return (
+        s.attrib.get("id", ""), station_name,
+        parse_db_time(ar_attrs.get("ct")), parse_db_time(dp_attrs.get("ct")),
+        ar_attrs.get("cs"), dp_attrs.get("cs"),
+        updated_at,
+    )
@@ -0,0 +1,102 @@
+# db_schema.py
+# Schema migrations for the stationboard databases (sbb_data.db, db_data.db)
+#
+# Migrations are numbered and tracked in PRAGMA user_version, so each one runs once per file.
+# Each migration and its user_version bump are one write transaction: a backfill and the
+# triggers that keep it current see the same rows, and an interrupted or concurrent migrate
+# (two ingest processes starting at once) can't apply a migration twice.
+# Ingest scripts call migrate() after creating their tables; for an existing large database
+# run it once from the command line first (building an index over millions of rows takes a while):
+#
+#     python db_schema.py --db sbb_data.db
+
+import argparse
+import sqlite3
+
+from data_access import SBB_DB, write_connection
+from rollups import ROLLUP_MIGRATION_SQL
+from station_catalog import STATS_MIGRATION_SQL
+
+MIGRATIONS = [
+    # 1: every dashboard/plot query filters on station and orders or ranges on fetched_at.
+    # The extra columns make the index covering, so those queries never read the table
+    # rows (and their raw_json/raw_xml payloads). It also serves SELECT DISTINCT station.
+    (1, """
+    CREATE INDEX IF NOT EXISTS idx_stationboard_station_fetched
+        ON stationboard (station, fetched_at, train_name, category, to_station, delay_minutes);
+    ANALYZE stationboard;
+    """),
+    # 2: delay_rollup (per station/hour/category/train counts, sums, max), backfilled from
+    # the existing rows and kept current by triggers, see rollups.py
+    (2, ROLLUP_MIGRATION_SQL),
+    # 3: station_stats catalog (row count, first/last fetched_at, last fetch status per station),
+    # so the dashboard needs no COUNT(*) / DISTINCT scans, see station_catalog.py
+    (3, STATS_MIGRATION_SQL),
+    # 4: plain (station) index. Its entries end with the rowid, so `station = ? AND id > ?`
+    # (delta_loader's refresh) seeks straight to a station's new rows instead of walking
+    # the station's whole (station, fetched_at, ...) range
+    (4, """
+    CREATE INDEX IF NOT EXISTS idx_stationboard_station_id ON stationboard (station);
+    """),
+]
+
+
+def table_exists(conn, name):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone()
+    return row is not None
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def run_script(conn, script):
+    """Execute a multi-statement script inside the current transaction (unlike executescript)"""
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ""
+
+
+def migrate(conn, verbose=False):
+    """Apply all migrations newer than the database's user_version. Returns the new version."""
+    if not table_exists(conn, "stationboard"):
+        return schema_version(conn)
+
+    version = schema_version(conn)
+    for number, script in MIGRATIONS:
+        if number <= version:
+            continue
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("BEGIN IMMEDIATE")  # takes the write lock before reading user_version again
+        try:
+            version = schema_version(conn)  # another process may have applied it meanwhile
+            if number > version:
+                if verbose:
+                    print(f"Applying migration {number} ...")
+                run_script(conn, script)
+                conn.execute(f"PRAGMA user_version = {number}")
+                version = number
+            conn.commit()
+        except BaseException:  # Ctrl+C too: don't leave the write lock held
+            conn.rollback()
+            raise
+    return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply schema migrations (indexes) to a stationboard database")
+    parser.add_argument("--db", default=SBB_DB, help="SQLite DB filename")
+    args = parser.parse_args()
+
+    version = migrate(write_connection(args.db), verbose=True)
+    print(f"{args.db}: schema version {version}")
+
+
+if __name__ == "__main__":
+    main()
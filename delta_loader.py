@@ -0,0 +1,95 @@
+# delta_loader.py
+# Keep a station's recent stationboard rows in memory and load only what is new.
+#
+# stationboard ids come from AUTOINCREMENT, so they only grow: the first load reads the
+# window through the (station, fetched_at, ...) index, later refreshes ask for
+# `id > high-water mark` of one station (a seek in the (station) index, whose entries end
+# with the rowid, db_schema migration 4), append those rows, drop rows that have left the
+# time window and update the per-train aggregates of the trains that were added or dropped.
+# Refresh cost follows the number of new rows, not the length of the history.
+
+from datetime import datetime
+
+import pandas as pd
+
+COLUMNS = ("fetched_at", "train_name", "delay_minutes", "category")
+
+# per-train aggregates: departures, sum of delays, delayed departures, sum of their delays
+STAT_COLUMNS = ("rows", "delay_sum", "delayed", "delayed_sum")
+
+
+class StationWindow:
+    """
+    Rows of one station with fetched_at inside a sliding window (or the whole history).
+
+        history = StationWindow("Zurich", window=timedelta(days=7))
+        history.refresh(conn)          # first call loads the window, later calls only new rows
+        history.frame                  # DataFrame: id + COLUMNS, oldest first
+        history.train_means()          # mean delay per train, kept up to date incrementally
+
+    Rows deleted from the database by cleanup scripts stay in the frame until they leave
+    the window; use a fresh StationWindow after a large cleanup.
+    """
+
+    def __init__(self, station, window=None, columns=COLUMNS):
+        self.station = station
+        self.window = window
+        self.columns = tuple(columns)
+        self.high_water = 0  # largest stationboard id loaded so far
+        self.frame = pd.DataFrame(columns=("id",) + self.columns)
+        self._stats = pd.DataFrame(columns=STAT_COLUMNS, dtype="int64")
+
+    def refresh(self, conn, now=None):
+        """Load rows added since the last refresh and expire old ones. Returns the number of new rows."""
+        cutoff = None
+        if self.window is not None:
+            cutoff = ((now or datetime.utcnow()) - self.window).isoformat()
+
+        sql = f"SELECT id, {', '.join(self.columns)} FROM stationboard WHERE station = ?"
+        params = [self.station]
+        if self.high_water:
+            # only the id range: with a fetched_at bound too the planner may walk the
+            # station's fetched_at range; rows already outside the window expire below
+            sql += " AND id > ?"
+            params.append(self.high_water)
+        elif cutoff is not None:
+            sql += " AND fetched_at >= ?"
+            params.append(cutoff)
+        new = pd.read_sql_query(sql + " ORDER BY id", conn, params=params)
+
+        if not new.empty:
+            self.high_water = int(new["id"].iloc[-1])
+            new["fetched_at"] = pd.to_datetime(new["fetched_at"])
+            self._account(new, 1)
+            self.frame = new if self.frame.empty else pd.concat([self.frame, new], ignore_index=True)
+
+        if cutoff is not None and not self.frame.empty:
+            expired = self.frame["fetched_at"] < pd.Timestamp(cutoff)
+            if expired.any():
+                self._account(self.frame[expired], -1)
+                self.frame = self.frame[~expired].reset_index(drop=True)
+        return len(new)
+
+    def _account(self, rows, sign):
+        """Add (sign=1) or remove (sign=-1) rows from the per-train aggregates"""
+        delay = pd.to_numeric(rows["delay_minutes"], errors="coerce")
+        delayed = delay > 0
+        delta = pd.DataFrame({
+            "rows": delay.notna().astype("int64"),
+            "delay_sum": delay.fillna(0).astype("int64"),
+            "delayed": delayed.astype("int64"),
+            "delayed_sum": delay.where(delayed, 0).fillna(0).astype("int64"),
+        }).groupby(rows["train_name"].fillna("").values).sum() * sign
+        stats = self._stats.add(delta, fill_value=0).astype("int64")
+        self._stats = stats[stats["rows"] > 0]
+
+    def train_means(self):
+        """DataFrame train_name, mean delay (same as frame.groupby('train_name')['delay_minutes'].mean())"""
+        stats = self._stats
+        means = (stats["delay_sum"] / stats["rows"]).rename("delay_minutes")
+        return means.rename_axis("train_name").reset_index()
+
+    def delayed_mean(self):
+        """Mean delay of the delayed departures only (0 if none)"""
+        delayed = self._stats["delayed"].sum()
+        return self._stats["delayed_sum"].sum() / delayed if delayed else 0.0
@@ -0,0 +1,121 @@
+# fetch_cache.py
+# Shared, TTL-based background fetcher for SBB stationboards.
+# The dashboard asks the cache to keep a station fresh and then only reads from SQLite;
+# the HTTP request and the SQLite write happen in a background thread, at most once per TTL.
+
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from data_access import SBB_DB, database, write_connection
+from db_schema import migrate
+from ingest_sbb import create_db, fetch_stationboard, make_session, parse, store_fetch_status, store_rows
+from raw_store import RawStore
+from writer_service import WriterError, connect_writer
+
+DEFAULT_TTL = 300  # seconds, matches the dashboard autorefresh interval
+
+
+class StationFetchCache:
+    """
+    Per-station TTL cache in front of the SBB API.
+    One instance is meant to be shared by every dashboard session in the process,
+    so N viewers of the same station cause one upstream request per TTL.
+    """
+
+    def __init__(self, db=SBB_DB, ttl=DEFAULT_TTL, workers=4, timeout=10, retries=3):
+        self.db = db
+        self.ttl = ttl
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._write_lock = database(db).write_lock  # single SQLite writer inside this process
+        self._prepared = False  # tables created / migrated on the writer connection
+        self._writer_client = None  # writer_service client while a service is running
+        self._last_fetch = {}   # station -> time.monotonic() of last attempt
+        self._last_status = {}  # station -> (wall-clock time, rows stored or error text)
+        self._pending = {}      # station -> Future of the running refresh
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sbb-fetch")
+        self._session = make_session(pool_size=workers, retries=retries)
+        self._raw_store = RawStore()  # only used under _write_lock
+
+    def is_fresh(self, station):
+        last = self._last_fetch.get(station)
+        return last is not None and time.monotonic() - last < self.ttl
+
+    def request(self, station, limit=20, wait=False):
+        """
+        Make sure `station` is refreshed at most once per TTL.
+        Returns immediately unless `wait=True`, in which case it waits for a running refresh.
+        """
+        submitted = False
+        with self._lock:
+            future = self._pending.get(station)
+            if future is None and not self.is_fresh(station):
+                self._last_fetch[station] = time.monotonic()
+                future = self._pool.submit(self._refresh, station, limit)
+                self._pending[station] = future
+                submitted = True
+        if submitted:
+            # outside the lock: a future that is already done runs the callback right here,
+            # and _done takes the lock
+            future.add_done_callback(lambda f, s=station: self._done(s))
+        if wait and future is not None:
+            future.result()
+        return future
+
+    def status(self, station):
+        """Return (fetched_at, rows stored or error message) of the last refresh, or None"""
+        return self._last_status.get(station)
+
+    def _done(self, station):
+        with self._lock:
+            self._pending.pop(station, None)
+
+    def _write(self, fn):
+        """
+        Run fn(conn) one writer at a time, on a writer service client if a service runs
+        for the database (see writer_service.py), else on the process's shared writer connection
+        """
+        with self._write_lock:
+            conn = write_connection(self.db)
+            if not self._prepared:
+                create_db(conn)
+                migrate(conn)
+                self._prepared = True
+            if self._writer_client is None:
+                self._writer_client = connect_writer(self.db)
+            if self._writer_client is None:
+                return fn(conn)
+            try:
+                return fn(self._writer_client)
+            except (EOFError, OSError):
+                self._writer_client = None  # service stopped; the next write checks again
+                raise
+
+    def _store(self, conn, station, rows, stops):
+        n = store_rows(rows, conn, self._raw_store, stops)
+        store_fetch_status(conn, station, rows=n)
+        return n
+
+    def _refresh(self, station, limit):
+        try:
+            json_data = fetch_stationboard(station, limit=limit, session=self._session, timeout=self.timeout)
+            rows, stops = parse(json_data, station)
+            n = self._write(lambda conn: self._store(conn, station, rows, stops))
+        except Exception as e:
+            print(f"Error fetching data for {station}:", e)
+            self._last_status[station] = (time.time(), str(e))
+            try:
+                self._write(lambda conn: store_fetch_status(conn, station, error=e))
+            except (sqlite3.Error, WriterError, EOFError, OSError):
+                pass  # the database itself may be what failed
+            return 0
+        self._last_status[station] = (time.time(), n)
+        return n
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        self._session.close()
+        if self._writer_client is not None:
+            self._writer_client.close()
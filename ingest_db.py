@@ -1,13 +1,24 @@
 # ingest_db.py
 # Fetch data from local Deutsche Bahn GitHub repo and store in SQLite
 
-import sqlite3
 import csv
 import json
 from datetime import datetime
 import argparse
 from pathlib import Path
 
+from bulk_writer import BulkWriter
+from data_access import DB_DB, write_connection
+from db_schema import migrate
+from raw_store import RawStore
+
+INSERT_SQL = """
+    INSERT INTO stationboard (
+        fetched_at, station, train_name, category, to_station, operator,
+        scheduled_time, actual_time, delay_seconds, delay_minutes, raw_json
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
 # ------------------------
 # SQLite DB functions
 # ------------------------
@@ -57,11 +68,10 @@ def fetch_csv(station, data_dir="data/stationboard"):
 # Parse CSV and store
 # ------------------------
 def parse_and_store(csv_file, station, conn):
-    inserted = 0
-    cur = conn.cursor()
     fetched_at = datetime.utcnow().isoformat()
+    writer = BulkWriter(conn, INSERT_SQL, raw_store=RawStore())
 
-    with open(csv_file, newline="", encoding="utf-8") as f:
+    with open(csv_file, newline="", encoding="utf-8") as f, writer:
         reader = csv.DictReader(f)
         for row in reader:
             name = row.get("train_name") or ""
@@ -74,33 +84,27 @@ def parse_and_store(csv_file, station, conn):
             delay_minutes = int(delay_seconds / 60) if delay_seconds else 0
             raw = json.dumps(row, ensure_ascii=False)
 
-            cur.execute("""
-                INSERT INTO stationboard (
-                    fetched_at, station, train_name, category, to_station, operator,
-                    scheduled_time, actual_time, delay_seconds, delay_minutes, raw_json
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
+            writer.add((
                 fetched_at, station, name, category, to_station, operator,
                 scheduled, actual, delay_seconds, delay_minutes, raw
             ))
-            inserted += 1
 
-    conn.commit()
-    return inserted
+    writer.report(f"{Path(csv_file).name}")
+    return writer.rows
 
 # ------------------------
 # Wrapper
 # ------------------------
-def fetch_station_data(station="berlin_hbf", db="db_data.db", data_dir="data/stationboard"):
+def fetch_station_data(station="berlin_hbf", db=DB_DB, data_dir="data/stationboard"):
     csv_file = fetch_csv(station, data_dir=data_dir)
     if not csv_file:
         print(f"No CSV found for station {station} in {data_dir}")
         return 0
 
-    conn = sqlite3.connect(db)
+    conn = write_connection(db)
     create_db(conn)
+    migrate(conn)
     n = parse_and_store(csv_file, station, conn)
-    conn.close()
     print(f"Loaded {n} rows for station {station} from {csv_file.name}")
     return n
 
@@ -110,7 +114,7 @@ def fetch_station_data(station="berlin_hbf", db="db_data.db", data_dir="data/sta
 def main():
     parser = argparse.ArgumentParser(description="Ingest DB Stationboard from local CSV to SQLite")
     parser.add_argument("--station", "-s", default="berlin_hbf", help="Station name (e.g. berlin_hbf)")
-    parser.add_argument("--db", default="db_data.db", help="SQLite DB filename")
+    parser.add_argument("--db", default=DB_DB, help="SQLite DB filename")
     parser.add_argument("--data_dir", default="data/stationboard", help="Local CSV data directory")
     args = parser.parse_args()
 
@@ -0,0 +1,123 @@
+# ingest_manifest.py
+# Remember which XML files are already in the database, so re-runs only ingest new or changed files
+
+import hashlib
+import os
+from datetime import datetime
+
+
+def create_manifest(conn):
+    """
+    Create the ingest_manifest table and link stationboard rows to their source file.
+    `rows IS NULL` marks a file whose ingestion has started but not been committed.
+    """
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS ingest_manifest (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        path TEXT NOT NULL UNIQUE,
+        size INTEGER,
+        mtime_ns INTEGER,
+        sha256 TEXT,
+        rows INTEGER,
+        ingested_at TEXT
+    );
+    """)
+    kind = conn.execute("SELECT type FROM sqlite_master WHERE name = 'stationboard'").fetchone()
+    if kind is not None and kind[0] == "table":
+        # (a compact-schema view already exposes source_id, see compact_schema.py)
+        columns = [r[1] for r in conn.execute("PRAGMA table_info(stationboard)")]
+        if "source_id" not in columns:
+            conn.execute("ALTER TABLE stationboard ADD COLUMN source_id INTEGER")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_stationboard_source ON stationboard (source_id)")
+    conn.commit()
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Manifest:
+    """
+    In-memory view of ingest_manifest for one run.
+
+        manifest = Manifest(conn)
+        for path in files:
+            entry = manifest.check(path)
+            if entry is None:
+                continue                       # unchanged, not even opened
+            source_id = manifest.begin(entry)  # drops rows of the previous version
+            ... writer.add(row + (source_id,)) ...
+            manifest.finish(source_id, n)
+        writer.flush()                         # commits rows and manifest together
+
+    begin() and finish() run on the writer's connection without committing, so they
+    are committed in the same transaction as the file's last batch of rows.
+    If a run dies in between, the file is simply ingested again next time.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        create_manifest(conn)
+        self.entries = {
+            path: (entry_id, size, mtime_ns, sha256, rows)
+            for entry_id, path, size, mtime_ns, sha256, rows in conn.execute(
+                "SELECT id, path, size, mtime_ns, sha256, rows FROM ingest_manifest"
+            )
+        }
+        self.skipped = 0
+
+    def check(self, path):
+        """
+        Return None if `path` is already ingested and unchanged, otherwise a dict
+        describing the new version of the file (to pass to begin()).
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        known = self.entries.get(path)
+        if known is not None and known[4] is not None:
+            if known[1] == st.st_size and known[2] == st.st_mtime_ns:
+                self.skipped += 1
+                return None
+
+        digest = file_sha256(path)
+        if known is not None and known[4] is not None and known[3] == digest:
+            # Touched but not modified: remember the new mtime, keep the rows
+            self.conn.execute(
+                "UPDATE ingest_manifest SET size = ?, mtime_ns = ? WHERE id = ?",
+                (st.st_size, st.st_mtime_ns, known[0]),
+            )
+            self.entries[path] = (known[0], st.st_size, st.st_mtime_ns, digest, known[4])
+            self.skipped += 1
+            return None
+
+        return {"path": path, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}
+
+    def begin(self, entry):
+        """Remove rows of a previous version of the file and return the source_id for the new rows"""
+        conn = self.conn
+        known = self.entries.get(entry["path"])
+        if known is not None:
+            conn.execute("DELETE FROM stationboard WHERE source_id = ?", (known[0],))
+            conn.execute(
+                "UPDATE ingest_manifest SET size = ?, mtime_ns = ?, sha256 = ?, rows = NULL WHERE id = ?",
+                (entry["size"], entry["mtime_ns"], entry["sha256"], known[0]),
+            )
+            source_id = known[0]
+        else:
+            source_id = conn.execute(
+                "INSERT INTO ingest_manifest (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                (entry["path"], entry["size"], entry["mtime_ns"], entry["sha256"]),
+            ).lastrowid
+        self.entries[entry["path"]] = (source_id, entry["size"], entry["mtime_ns"], entry["sha256"], None)
+        return source_id
+
+    def finish(self, source_id, rows):
+        """Mark the file as completely ingested (committed with the writer's next batch)"""
+        self.conn.execute(
+            "UPDATE ingest_manifest SET rows = ?, ingested_at = ? WHERE id = ?",
+            (rows, datetime.utcnow().isoformat(), source_id),
+        )
@@ -2,13 +2,49 @@
 # Fetch data from transport.opendata.ch and store in SQLite
 
 import requests
-import sqlite3
 import json
 from datetime import datetime
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from bulk_writer import BulkWriter
+from data_access import SBB_DB, write_connection
+from db_schema import migrate
+from pass_list import STOPS_UPSERT_SQL, create_stops_table, stop_rows
+from raw_store import RAW_INDEX, RawStore
+from station_catalog import RECORD_FETCH_SQL, fetch_status_row, record_fetch
+from writer_service import WriterClient, connect_writer
 
 API_URL = "https://transport.opendata.ch/v1/stationboard"
 
+INSERT_SQL = """
+    INSERT INTO stationboard (
+        fetched_at, station, train_name, category, to_station, operator,
+        scheduled_time, actual_time, delay_seconds, delay_minutes, raw_json
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+UPSERT_SQL = """
+    INSERT INTO departures (
+        last_seen, first_seen, station, train_name, category, to_station, operator,
+        scheduled_time, actual_time, delay_seconds, delay_minutes, raw_json
+    ) VALUES (?1, ?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8, ?9, ?10, ?11)
+    ON CONFLICT (station, train_name, scheduled_time) DO UPDATE SET
+        last_seen = excluded.last_seen,
+        category = excluded.category,
+        to_station = excluded.to_station,
+        operator = excluded.operator,
+        actual_time = excluded.actual_time,
+        delay_seconds = excluded.delay_seconds,
+        delay_minutes = excluded.delay_minutes,
+        raw_json = excluded.raw_json,
+        polls = polls + 1
+"""
+
+STORAGE_MODES = ("append", "upsert")
+
 def create_db(conn):
     """Create the stationboard table if it doesn't exist"""
     sql = """
@@ -28,24 +64,96 @@ def create_db(conn):
     );
     """
     conn.execute(sql)
+    create_stops_table(conn)
+    conn.commit()
+
+def make_session(pool_size=10, retries=3, backoff=0.5):
+    """
+    Create a requests session with a keep-alive connection pool.
+    Failed requests (connection errors, 429 and 5xx) are retried with exponential backoff.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",),
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def create_departure_tables(conn):
+    """
+    Create the tables for the "upsert" storage mode:
+    - departures: one row per (station, train_name, scheduled_time), updated in place on every poll
+    - departure_observations: one row per departure whenever its delay changes
+    Observations are written by triggers, so every writer of `departures` records them.
+    """
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS departures (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        station TEXT NOT NULL,
+        train_name TEXT NOT NULL,
+        scheduled_time TEXT NOT NULL,
+        category TEXT,
+        to_station TEXT,
+        operator TEXT,
+        actual_time TEXT,
+        delay_seconds INTEGER,
+        delay_minutes INTEGER,
+        first_seen TEXT,
+        last_seen TEXT,
+        polls INTEGER DEFAULT 1,
+        raw_json TEXT,
+        UNIQUE (station, train_name, scheduled_time)
+    );
+
+    CREATE TABLE IF NOT EXISTS departure_observations (
+        departure_id INTEGER NOT NULL REFERENCES departures(id),
+        observed_at TEXT NOT NULL,
+        actual_time TEXT,
+        delay_seconds INTEGER
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_departure_observations_departure
+        ON departure_observations (departure_id, observed_at);
+
+    CREATE TRIGGER IF NOT EXISTS departures_observe_new AFTER INSERT ON departures
+    BEGIN
+        INSERT INTO departure_observations (departure_id, observed_at, actual_time, delay_seconds)
+        VALUES (new.id, new.last_seen, new.actual_time, new.delay_seconds);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS departures_observe_change AFTER UPDATE OF delay_seconds ON departures
+    WHEN old.delay_seconds IS NOT new.delay_seconds
+    BEGIN
+        INSERT INTO departure_observations (departure_id, observed_at, actual_time, delay_seconds)
+        VALUES (new.id, new.last_seen, new.actual_time, new.delay_seconds);
+    END;
+    """)
     conn.commit()
 
-def fetch_stationboard(station, limit=20):
+def fetch_stationboard(station, limit=20, session=None, timeout=10):
     """Fetch stationboard JSON from Open Data API"""
     params = {"station": station, "limit": limit}
-    resp = requests.get(API_URL, params=params, timeout=10)
+    http = session or requests
+    resp = http.get(API_URL, params=params, timeout=timeout)
     resp.raise_for_status()
     return resp.json()
 
-def parse_and_store(json_data, station, conn):
-    """Parse API JSON and store in SQLite"""
+def train_name_of(entry):
+    return entry.get("name") or entry.get("category") or ""
+
+def parse_rows(json_data, station, fetched_at=None):
+    """Parse API JSON into stationboard rows (no database access)"""
     entries = json_data.get("stationboard", [])
-    inserted = 0
-    cur = conn.cursor()
-    fetched_at = datetime.utcnow().isoformat()
+    rows = []
+    fetched_at = fetched_at or datetime.utcnow().isoformat()
 
     for e in entries:
-        name = e.get("name") or e.get("category") or ""
+        name = train_name_of(e)
         category = e.get("category") or ""
         to_station = e.get("to") or ""
         operator = e.get("operator") or ""
@@ -65,54 +173,201 @@ def parse_and_store(json_data, station, conn):
 
         raw = json.dumps(e, ensure_ascii=False)
 
-        cur.execute("""
-            INSERT INTO stationboard (
-                fetched_at, station, train_name, category, to_station, operator,
-                scheduled_time, actual_time, delay_seconds, delay_minutes, raw_json
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
+        rows.append((
             fetched_at, station, name, category, to_station, operator,
             scheduled, actual, delay_seconds, delay_minutes, raw
         ))
-        inserted += 1
 
-    conn.commit()
-    return inserted
+    return rows
 
-def fetch_station_data(station="Zurich", limit=20, db="sbb_data.db"):
+def parse_stops(json_data, fetched_at):
+    """Parse the passList of every API entry into `stops` upsert rows (see pass_list.py)"""
+    stops = []
+    for e in json_data.get("stationboard", []):
+        stops.extend(stop_rows(e, train_name_of(e), fetched_at))
+    return stops
+
+def parse(json_data, station):
+    """(stationboard rows, stops rows) of one API response, with the same fetched_at"""
+    fetched_at = datetime.utcnow().isoformat()
+    return parse_rows(json_data, station, fetched_at), parse_stops(json_data, fetched_at)
+
+def _write(conn, sql, rows, raw_store, stops):
+    """
+    One transaction: rows for `sql` (raw_json to the payload store) plus their stops.
+    `conn` is a SQLite connection or a writer_service client (see open_writer).
+    """
+    if isinstance(conn, WriterClient):
+        conn.write([(sql, rows, RAW_INDEX), (STOPS_UPSERT_SQL, stops, None)])
+        return len(rows)
+    with BulkWriter(conn, sql, batch_size=len(rows) + len(stops) + 1, raw_store=raw_store or RawStore()) as writer:
+        writer.add_many(rows)
+        for stop in stops:
+            writer.add(stop, sql=STOPS_UPSERT_SQL)
+    return len(rows)
+
+def store_rows(rows, conn, raw_store=None, stops=()):
+    """Insert parsed stationboard rows (and their stops) in one transaction"""
+    return _write(conn, INSERT_SQL, rows, raw_store, stops)
+
+def upsert_rows(rows, conn, raw_store=None, stops=()):
+    """
+    Insert or update parsed rows in `departures`, keyed on (station, train_name, scheduled_time).
+    A delay change is recorded in `departure_observations`; unchanged polls only touch last_seen.
+    """
+    # The natural key can't contain NULLs, otherwise UNIQUE never matches
+    rows = [r[:6] + (r[6] or "",) + r[7:] for r in rows]
+    return _write(conn, UPSERT_SQL, rows, raw_store, stops)
+
+def store(rows, conn, mode="append", raw_store=None, stops=()):
+    """Store parsed rows (and their stops) using the given storage mode ("append" or "upsert")"""
+    if mode == "upsert":
+        return upsert_rows(rows, conn, raw_store, stops)
+    return store_rows(rows, conn, raw_store, stops)
+
+def prepare_db(conn, mode="append"):
+    """Create the tables needed by the given storage mode"""
+    if mode == "upsert":
+        create_departure_tables(conn)
+        create_stops_table(conn)
+    else:
+        create_db(conn)
+        migrate(conn)
+
+def open_writer(db, mode="append"):
+    """
+    Where this process's rows for `db` go: a client of the writer service when one is
+    running for `db` (see writer_service.py), otherwise the shared writer connection.
+    The tables are created either way.
+    """
+    conn = write_connection(db)
+    prepare_db(conn, mode)
+    return connect_writer(db) or conn
+
+def close_writer(conn):
+    if isinstance(conn, WriterClient):
+        conn.close()  # the shared SQLite connection stays open for the process
+
+def store_fetch_status(conn, station, rows=None, error=None):
+    """station_stats fetch status (append mode), directly or through the writer service"""
+    if isinstance(conn, WriterClient):
+        conn.write([(RECORD_FETCH_SQL, [fetch_status_row(station, rows, error)], None)])
+    else:
+        record_fetch(conn, station, rows=rows, error=error)
+
+def parse_and_store(json_data, station, conn, mode="append"):
+    """Parse API JSON (stationboard rows and their passList stops) and store in SQLite"""
+    rows, stops = parse(json_data, station)
+    return store(rows, conn, mode=mode, stops=stops)
+
+def fetch_station_data(station="Zurich", limit=20, db=SBB_DB, mode="append", timeout=10, retries=3):
     """
     Wrapper: fetch data from API and store in SQLite.
-    ✅ Each call appends new rows to the database to keep historical records.
+    ✅ In "append" mode each call appends new rows to the database to keep historical records.
+    ✅ In "upsert" mode each departure is stored once and only delay changes are recorded.
     """
+    session = make_session(pool_size=1, retries=retries)
     try:
         # 1️⃣ Fetch data from SBB API
-        json_data = fetch_stationboard(station, limit=limit)
+        json_data = fetch_stationboard(station, limit=limit, session=session, timeout=timeout)
     except Exception as e:
         print("Error fetching data:", e)
+        if mode == "append":
+            conn = open_writer(db, mode)
+            store_fetch_status(conn, station, error=e)
+            close_writer(conn)
         return 0
+    finally:
+        session.close()
 
-    # 2️⃣ Connect to SQLite database
-    conn = sqlite3.connect(db)
-    # 3️⃣ Make sure the table exists (create if not)
-    create_db(conn)
+    # 2️⃣ Writer service if one is running, else the shared writer connection of this process
+    # 3️⃣ Make sure the tables exist (create if not)
+    conn = open_writer(db, mode)
     # 4️⃣ Parse the JSON and insert new rows into the database
-    n = parse_and_store(json_data, station, conn)
-    # 5️⃣ Close the connection
-    conn.close()
-    
+    n = parse_and_store(json_data, station, conn, mode=mode)
+    if mode == "append":
+        store_fetch_status(conn, station, rows=n)
+    close_writer(conn)
+
     print(f"Fetched and stored {n} rows for station {station}")
     return n
 
+def fetch_stations_data(stations, limit=20, db=SBB_DB, workers=8, timeout=10, retries=3,
+                        mode="append"):
+    """
+    Fetch many stations concurrently and store them in SQLite.
+    HTTP requests run in a thread pool over one shared keep-alive session;
+    parsed rows are handed back to the calling thread, which is the only SQLite writer.
+    Returns a dict {station: rows stored} (0 for stations that failed).
+    """
+    results = {}
+    session = make_session(pool_size=workers, retries=retries)
+
+    def fetch_and_parse(station):
+        json_data = fetch_stationboard(station, limit=limit, session=session, timeout=timeout)
+        return parse(json_data, station)
+
+    # record(station, rows, error) keeps the station_stats fetch status in append mode
+    conn = open_writer(db, mode)
+    raw_store = RawStore()  # remembers payloads already stored during this run
+    write = lambda rows, stops: store(rows, conn, mode=mode, raw_store=raw_store, stops=stops)
+    record = (lambda *args: store_fetch_status(conn, *args)) if mode == "append" else (lambda *args: None)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(fetch_and_parse, s): s for s in stations}
+            for future in as_completed(futures):
+                station = futures[future]
+                try:
+                    rows, stops = future.result()
+                except Exception as e:
+                    print(f"Error fetching data for {station}:", e)
+                    results[station] = 0
+                    record(station, None, e)
+                    continue
+                try:
+                    results[station] = write(rows, stops)
+                except Exception as e:
+                    # the batch was rolled back; keep going with the other stations
+                    print(f"Error storing data for {station}:", e)
+                    results[station] = 0
+                    try:
+                        record(station, None, e)
+                    except Exception:
+                        pass  # the database itself may be what failed
+                    continue
+                record(station, results[station], None)
+                print(f"Fetched and stored {results[station]} rows for station {station}")
+    finally:
+        close_writer(conn)
+        session.close()
+
+    return results
+
 
 def main():
     parser = argparse.ArgumentParser(description="Ingest stationboard to SQLite")
     parser.add_argument("--station", "-s", default="Zurich", help="Station name (e.g. Zurich)")
-    parser.add_argument("--db", default="sbb_data.db", help="SQLite DB filename")
+    parser.add_argument("--db", default=SBB_DB, help="SQLite DB filename")
     parser.add_argument("--limit", type=int, default=20, help="Number of upcoming departures to fetch")
+    parser.add_argument("--mode", choices=STORAGE_MODES, default="append",
+                        help="append: one row per departure per poll; upsert: one row per departure, delay changes only")
+    parser.add_argument("--stations", help="Comma-separated station list; fetches them concurrently (e.g. Zurich,Bern,Basel)")
+    parser.add_argument("--workers", type=int, default=8, help="Max concurrent requests in --stations mode")
+    parser.add_argument("--timeout", type=float, default=10, help="Per-request timeout in seconds")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per request on connection errors / 5xx")
     args = parser.parse_args()
 
+    if args.stations:
+        stations = [s.strip() for s in args.stations.split(",") if s.strip()]
+        print(f"Fetching stationboards for {len(stations)} stations ({args.workers} workers) ...")
+        results = fetch_stations_data(stations, limit=args.limit, db=args.db, workers=args.workers,
+                                      timeout=args.timeout, retries=args.retries, mode=args.mode)
+        print(f"Total rows stored: {sum(results.values())}")
+        return
+
     print(f"Fetching stationboard for: {args.station} ...")
-    fetch_station_data(station=args.station, limit=args.limit, db=args.db)
+    fetch_station_data(station=args.station, limit=args.limit, db=args.db, mode=args.mode,
+                       timeout=args.timeout, retries=args.retries)
 
 if __name__ == "__main__":
     main()
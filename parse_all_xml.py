@@ -1,17 +1,33 @@
 import os
-import sqlite3
+import argparse
 import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
+from bulk_writer import BulkWriter
+from data_access import DB_DB, write_connection
+from db_delays import CHANGE_UPSERT_SQL, PLAN_UPSERT_SQL, change_stop, create_stop_tables, plan_stop
+from db_schema import migrate
+from ingest_manifest import Manifest
+from raw_store import RawStore
+from xml_stream import iter_elements
+
 # Путь к папке с XML
 DATA_DIR = "deutsche-bahn-data/data/2025-10-24"  # можно менять на любую дату
-DB_FILE = "db_data.db"
+DB_FILE = DB_DB
+
+INSERT_SQL = """
+    INSERT INTO stationboard (
+        fetched_at, station, train_name, category, to_station, operator,
+        scheduled_time, actual_time, delay_seconds, delay_minutes, raw_xml, source_id
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
 
 # ------------------------
 # Создаем таблицу
 # ------------------------
 def create_db(db_file=DB_FILE):
-    conn = sqlite3.connect(db_file)
+    conn = write_connection(db_file)
     sql = """
     CREATE TABLE IF NOT EXISTS stationboard (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -25,27 +41,30 @@ def create_db(db_file=DB_FILE):
         actual_time TEXT,
         delay_seconds INTEGER,
         delay_minutes INTEGER,
-        raw_xml TEXT
+        raw_xml TEXT,
+        source_id INTEGER
     );
     """
     conn.execute(sql)
     conn.commit()
-    conn.close()
+    migrate(conn)
 
 # ------------------------
 # Парсер fchg файлов
 # ------------------------
-def parse_fchg_xml(filepath, conn):
-    tree = ET.parse(filepath)
-    root = tree.getroot()
-    
-    station_name = root.attrib.get("station", "Unknown")
+def iter_fchg_rows(filepath, on_change=None):
+    """
+    Stream stationboard rows from an fchg file, one <s> element at a time.
+    If given, `on_change` receives a db_delays change row for every stop with changed times.
+    """
     fetched_at = datetime.utcnow().isoformat()
-    
-    cur = conn.cursor()
-    inserted = 0
-    
-    for s in root.findall(".//s"):
+
+    for station_name, s in iter_elements(filepath, "s"):
+        if on_change is not None:
+            change = change_stop(s, station_name, fetched_at)
+            if change is not None:
+                on_change(change)
+
         # Отправления и прибытия
         for tag in ["ar", "dp"]:
             dep = s.find(tag)
@@ -56,42 +75,41 @@ def parse_fchg_xml(filepath, conn):
                 category = m.attrib.get("c", "")
                 name = m.attrib.get("id", "")
                 operator = ""  # обычно нет в fchg
-                
+
                 scheduled = m.attrib.get("ts", "")
                 actual = scheduled
                 delay_seconds = int(m.attrib.get("c", 0)) if m.attrib.get("c") else 0
                 delay_minutes = int(delay_seconds / 60)
-                
+
                 raw_xml = ET.tostring(m, encoding="unicode")
-                
-                cur.execute("""
-                    INSERT INTO stationboard (
-                        fetched_at, station, train_name, category, to_station, operator,
-                        scheduled_time, actual_time, delay_seconds, delay_minutes, raw_xml
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
+
+                yield (
                     fetched_at, station_name, name, category, "", operator,
                     scheduled, actual, delay_seconds, delay_minutes, raw_xml
-                ))
-                inserted += 1
-                
-    conn.commit()
+                )
+
+def parse_fchg_xml(filepath, writer, source_id=None):
+    inserted = 0
+    on_change = lambda change: writer.add(change, sql=CHANGE_UPSERT_SQL)
+    for row in iter_fchg_rows(filepath, on_change):
+        writer.add(row + (source_id,))
+        inserted += 1
     return inserted
 
 # ------------------------
 # Парсер plan файлов
 # ------------------------
-def parse_plan_xml(filepath, conn):
-    tree = ET.parse(filepath)
-    root = tree.getroot()
-    
-    station_name = root.attrib.get("station", "Unknown")
+def iter_plan_rows(filepath, on_stop=None):
+    """
+    Stream stationboard rows (arrival + departure) from a plan file, one <s> element at a time.
+    If given, `on_stop` receives a db_delays plan row for every planned stop.
+    """
     fetched_at = datetime.utcnow().isoformat()
-    
-    cur = conn.cursor()
-    inserted = 0
-    
-    for s in root.findall("s"):
+
+    for station_name, s in iter_elements(filepath, "s"):
+        if on_stop is not None:
+            on_stop(plan_stop(s, station_name, fetched_at))
+
         tl = s.find("tl")
         if tl is not None:
             category = tl.attrib.get("c", "")
@@ -99,72 +117,116 @@ def parse_plan_xml(filepath, conn):
             operator = tl.attrib.get("o", "")
         else:
             category = name = operator = ""
-        
-        # Прибытие
-        ar = s.find("ar")
-        if ar is not None:
-            scheduled = ar.attrib.get("pt", "")
-            actual = scheduled
-            delay_seconds = delay_minutes = 0
-            raw_xml = ET.tostring(ar, encoding="unicode")
-            cur.execute("""
-                INSERT INTO stationboard (
-                    fetched_at, station, train_name, category, to_station, operator,
-                    scheduled_time, actual_time, delay_seconds, delay_minutes, raw_xml
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                fetched_at, station_name, name, category, ar.attrib.get("ppth", ""), operator,
-                scheduled, actual, delay_seconds, delay_minutes, raw_xml
-            ))
-            inserted += 1
-        
-        # Отправление
-        dp = s.find("dp")
-        if dp is not None:
-            scheduled = dp.attrib.get("pt", "")
+
+        # Прибытие и отправление
+        for event in (s.find("ar"), s.find("dp")):
+            if event is None:
+                continue
+            scheduled = event.attrib.get("pt", "")
             actual = scheduled
             delay_seconds = delay_minutes = 0
-            raw_xml = ET.tostring(dp, encoding="unicode")
-            cur.execute("""
-                INSERT INTO stationboard (
-                    fetched_at, station, train_name, category, to_station, operator,
-                    scheduled_time, actual_time, delay_seconds, delay_minutes, raw_xml
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                fetched_at, station_name, name, category, dp.attrib.get("ppth", ""), operator,
+            raw_xml = ET.tostring(event, encoding="unicode")
+            yield (
+                fetched_at, station_name, name, category, event.attrib.get("ppth", ""), operator,
                 scheduled, actual, delay_seconds, delay_minutes, raw_xml
-            ))
-            inserted += 1
-            
-    conn.commit()
+            )
+
+def parse_plan_xml(filepath, writer, source_id=None):
+    inserted = 0
+    on_stop = lambda stop: writer.add(stop, sql=PLAN_UPSERT_SQL)
+    for row in iter_plan_rows(filepath, on_stop):
+        writer.add(row + (source_id,))
+        inserted += 1
     return inserted
 
+# ------------------------
+# Список файлов и разбор одного файла
+# ------------------------
+def list_xml_files(data_dir):
+    """Return sorted (fname, filepath) pairs of the fchg/plan files in a day folder"""
+    files = []
+    for fname in sorted(os.listdir(data_dir)):
+        if fname.endswith(".xml") and ("fchg" in fname or "plan" in fname):
+            files.append((fname, os.path.join(data_dir, fname)))
+    return files
+
+def parse_file(filepath):
+    """
+    Parse one fchg/plan file (used by worker processes).
+    Returns (stationboard rows, stop_delays rows, upsert statement for the stop rows).
+    """
+    fname = os.path.basename(filepath)
+    stops = []
+    if "fchg" in fname:
+        return list(iter_fchg_rows(filepath, stops.append)), stops, CHANGE_UPSERT_SQL
+    return list(iter_plan_rows(filepath, stops.append)), stops, PLAN_UPSERT_SQL
+
 # ------------------------
 # Главная функция
 # ------------------------
-def parse_all_xml(data_dir=DATA_DIR, db_file=DB_FILE):
+def parse_all_xml(data_dir=DATA_DIR, db_file=DB_FILE, workers=1):
+    """
+    Parse every fchg/plan file in `data_dir` into `db_file`.
+    With workers > 1 files are parsed in a process pool; rows are sent back to
+    this process, which stays the only SQLite writer. Files are handled in the
+    same (sorted) order in both modes, so the stored rows are the same.
+    Files already recorded in ingest_manifest and unchanged since are skipped.
+    Planned times and changes are also joined per stop id into `stop_delays` (see db_delays.py).
+    """
     create_db(db_file)
-    conn = sqlite3.connect(db_file)
+    conn = write_connection(db_file)
+    create_stop_tables(conn)
+    writer = BulkWriter(conn, INSERT_SQL, raw_store=RawStore())
+    manifest = Manifest(conn)
     total_inserted = 0
-    
-    for fname in os.listdir(data_dir):
-        if not fname.endswith(".xml"):
-            continue
-        filepath = os.path.join(data_dir, fname)
-        if "fchg" in fname:
-            inserted = parse_fchg_xml(filepath, conn)
-        elif "plan" in fname:
-            inserted = parse_plan_xml(filepath, conn)
-        else:
-            continue
-        print(f"{fname}: inserted {inserted} rows")
-        total_inserted += inserted
-    
-    conn.close()
+
+    # Only new or changed files; unchanged ones are skipped from their size/mtime alone
+    files = []
+    for fname, filepath in list_xml_files(data_dir):
+        entry = manifest.check(filepath)
+        if entry is not None:
+            files.append((fname, filepath, entry))
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # map() yields results in submission order; chunksize amortises IPC over small files
+            chunksize = max(1, len(files) // (workers * 16))
+            results = pool.map(parse_file, [path for _, path, _ in files], chunksize=chunksize)
+            for (fname, _, entry), (rows, stops, stop_sql) in zip(files, results):
+                source_id = manifest.begin(entry)
+                writer.add_many(row + (source_id,) for row in rows)
+                for stop in stops:
+                    writer.add(stop, sql=stop_sql)
+                manifest.finish(source_id, len(rows))
+                print(f"{fname}: inserted {len(rows)} rows")
+                total_inserted += len(rows)
+    else:
+        for fname, filepath, entry in files:
+            source_id = manifest.begin(entry)
+            if "fchg" in fname:
+                inserted = parse_fchg_xml(filepath, writer, source_id)
+            else:
+                inserted = parse_plan_xml(filepath, writer, source_id)
+            manifest.finish(source_id, inserted)
+            print(f"{fname}: inserted {inserted} rows")
+            total_inserted += inserted
+
+    writer.flush()
+    print(f"Skipped {manifest.skipped} unchanged files")
     print(f"Total rows inserted: {total_inserted}")
+    writer.report("parse_all_xml")
 
 # ------------------------
 # Запуск
 # ------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Parse a folder of Deutsche Bahn fchg/plan XML files into SQLite")
+    parser.add_argument("--data_dir", default=DATA_DIR, help="Folder with XML files (e.g. deutsche-bahn-data/data/2025-10-24)")
+    parser.add_argument("--db", default=DB_FILE, help="SQLite DB filename")
+    parser.add_argument("--workers", type=int, default=1, help="Parser processes (1 = serial)")
+    args = parser.parse_args()
+
+    parse_all_xml(data_dir=args.data_dir, db_file=args.db, workers=args.workers)
+
 if __name__ == "__main__":
-    parse_all_xml()
+    main()
@@ -1,19 +1,32 @@
 # parse_xml.py
 # Parse Deutsche Bahn XML stationboard files and store in SQLite
 
-import sqlite3
 import xml.etree.ElementTree as ET
 from datetime import datetime
 import os
 
-DB_FILE = "db_data.db"
+from bulk_writer import BulkWriter
+from data_access import DB_DB, write_connection
+from db_schema import migrate
+from ingest_manifest import Manifest
+from raw_store import RawStore
+from xml_stream import iter_elements
+
+DB_FILE = DB_DB
 DATA_FOLDER = "deutsche-bahn-data/data/2025-10-24/"  # укажи актуальную папку
 
+INSERT_SQL = """
+    INSERT INTO stationboard (
+        fetched_at, station, train_name, category, to_station, operator,
+        scheduled_time, actual_time, delay_seconds, delay_minutes, raw_xml, source_id
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
 # ------------------------
 # Создаём таблицу, если её нет
 # ------------------------
 def create_db(db_file=DB_FILE):
-    conn = sqlite3.connect(db_file)
+    conn = write_connection(db_file)
     sql = """
     CREATE TABLE IF NOT EXISTS stationboard (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -27,27 +40,22 @@ def create_db(db_file=DB_FILE):
         actual_time TEXT,
         delay_seconds INTEGER,
         delay_minutes INTEGER,
-        raw_xml TEXT
+        raw_xml TEXT,
+        source_id INTEGER
     );
     """
     conn.execute(sql)
     conn.commit()
-    conn.close()
+    migrate(conn)
 
 # ------------------------
 # Парсим один XML файл
 # ------------------------
-def parse_xml_file(filepath, conn):
-    tree = ET.parse(filepath)
-    root = tree.getroot()
-    
-    station_name = root.attrib.get("station", "Unknown")
+def iter_xml_rows(filepath):
+    """Stream stationboard rows from one XML file, one <s> element at a time"""
     fetched_at = datetime.utcnow().isoformat()
-    
-    cur = conn.cursor()
-    inserted = 0
 
-    for s in root.findall(".//s"):
+    for station_name, s in iter_elements(filepath, "s"):
         for tag in ["dp", "ar"]:
             for block in s.findall(tag):
                 for m in block.findall("m"):
@@ -57,21 +65,19 @@ def parse_xml_file(filepath, conn):
                     delay_sec = int(m.attrib.get("c", "0"))
                     ts = m.attrib.get("ts", "")
                     ts_human = m.attrib.get("ts-tts", "")
-                    
+
                     raw_xml = ET.tostring(m, encoding="unicode")
-                    
-                    cur.execute("""
-                        INSERT INTO stationboard (
-                            fetched_at, station, train_name, category, to_station, operator,
-                            scheduled_time, actual_time, delay_seconds, delay_minutes, raw_xml
-                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (
+
+                    yield (
                         fetched_at, station_name, train_id, category, t_type, "",
                         ts, ts_human, delay_sec, int(delay_sec/60), raw_xml
-                    ))
-                    inserted += 1
+                    )
 
-    conn.commit()
+def parse_xml_file(filepath, writer, source_id=None):
+    inserted = 0
+    for row in iter_xml_rows(filepath):
+        writer.add(row + (source_id,))
+        inserted += 1
     return inserted
 
 # ------------------------
@@ -79,18 +85,27 @@ def parse_xml_file(filepath, conn):
 # ------------------------
 def main():
     create_db(DB_FILE)
-    conn = sqlite3.connect(DB_FILE)
+    conn = write_connection(DB_FILE)
+    writer = BulkWriter(conn, INSERT_SQL, raw_store=RawStore())
+    manifest = Manifest(conn)
     total = 0
 
-    for filename in os.listdir(DATA_FOLDER):
+    for filename in sorted(os.listdir(DATA_FOLDER)):
         if filename.endswith(".xml"):
             filepath = os.path.join(DATA_FOLDER, filename)
-            n = parse_xml_file(filepath, conn)
+            entry = manifest.check(filepath)
+            if entry is None:
+                continue  # already ingested and unchanged
+            source_id = manifest.begin(entry)
+            n = parse_xml_file(filepath, writer, source_id)
+            manifest.finish(source_id, n)
             print(f"{filename}: inserted {n} rows")
             total += n
 
-    conn.close()
+    writer.flush()
+    print(f"Skipped {manifest.skipped} unchanged files")
     print(f"Total rows inserted: {total}")
+    writer.report("parse_xml")
 
 if __name__ == "__main__":
     main()
@@ -1,20 +1,33 @@
 # parse_xml_folder.py
 import os
-import sqlite3
 import xml.etree.ElementTree as ET
 from datetime import datetime
 
+from bulk_writer import BulkWriter
+from data_access import DB_DB, write_connection
+from db_schema import migrate
+from ingest_manifest import Manifest
+from raw_store import RawStore
+from xml_stream import iter_elements
+
 # ------------------------
 # Настройки
 # ------------------------
-DB_FILE = "db_data.db"
+DB_FILE = DB_DB
 XML_DIR = "deutsche-bahn-data/data/2025-10-24/"  # поменяй на актуальную дату
 
+INSERT_SQL = """
+    INSERT INTO stationboard (
+        fetched_at, station, train_name, category, to_station, operator,
+        scheduled_time, actual_time, delay_seconds, delay_minutes, raw_xml, source_id
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
 # ------------------------
 # Создание базы и таблицы
 # ------------------------
 def create_db(db_file):
-    conn = sqlite3.connect(db_file)
+    conn = write_connection(db_file)
     sql = """
     CREATE TABLE IF NOT EXISTS stationboard (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -28,28 +41,22 @@ def create_db(db_file):
         actual_time TEXT,
         delay_seconds INTEGER,
         delay_minutes INTEGER,
-        raw_xml TEXT
+        raw_xml TEXT,
+        source_id INTEGER
     );
     """
     conn.execute(sql)
     conn.commit()
-    conn.close()
+    migrate(conn)
 
 # ------------------------
 # Парсинг одного XML
 # ------------------------
-def parse_xml_file(filepath, conn):
-    tree = ET.parse(filepath)
-    root = tree.getroot()
-    
-    station_name = root.attrib.get("station", "Unknown")
+def iter_xml_rows(filepath):
+    """Stream stationboard rows from one XML file, one <departure> element at a time"""
     fetched_at = datetime.utcnow().isoformat()
-    
-    cur = conn.cursor()
-    inserted = 0
-    
-    departures = root.findall(".//departure")
-    for departure in departures:
+
+    for station_name, departure in iter_elements(filepath, "departure"):
         train_info = departure.find("train")
         name = train_info.findtext("name", "") if train_info is not None else ""
         category = train_info.findtext("category", "") if train_info is not None else ""
@@ -60,19 +67,17 @@ def parse_xml_file(filepath, conn):
         delay_seconds = int(departure.findtext("delay") or 0)
         delay_minutes = int(delay_seconds / 60)
         raw_xml = ET.tostring(departure, encoding="unicode")
-        
-        cur.execute("""
-            INSERT INTO stationboard (
-                fetched_at, station, train_name, category, to_station, operator,
-                scheduled_time, actual_time, delay_seconds, delay_minutes, raw_xml
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
+
+        yield (
             fetched_at, station_name, name, category, to_station, operator,
             scheduled, actual, delay_seconds, delay_minutes, raw_xml
-        ))
+        )
+
+def parse_xml_file(filepath, writer, source_id=None):
+    inserted = 0
+    for row in iter_xml_rows(filepath):
+        writer.add(row + (source_id,))
         inserted += 1
-    
-    conn.commit()
     return inserted
 
 # ------------------------
@@ -80,18 +85,27 @@ def parse_xml_file(filepath, conn):
 # ------------------------
 def main():
     create_db(DB_FILE)
-    conn = sqlite3.connect(DB_FILE)
+    conn = write_connection(DB_FILE)
+    writer = BulkWriter(conn, INSERT_SQL, raw_store=RawStore())
+    manifest = Manifest(conn)
     total_inserted = 0
 
-    for filename in os.listdir(XML_DIR):
+    for filename in sorted(os.listdir(XML_DIR)):
         if filename.endswith(".xml"):
             filepath = os.path.join(XML_DIR, filename)
-            inserted = parse_xml_file(filepath, conn)
+            entry = manifest.check(filepath)
+            if entry is None:
+                continue  # already ingested and unchanged
+            source_id = manifest.begin(entry)
+            inserted = parse_xml_file(filepath, writer, source_id)
+            manifest.finish(source_id, inserted)
             print(f"{filename}: inserted {inserted} rows")
             total_inserted += inserted
 
-    conn.close()
+    writer.flush()
+    print(f"Skipped {manifest.skipped} unchanged files")
     print(f"Total rows inserted: {total_inserted}")
+    writer.report("parse_xml_folder")
 
 if __name__ == "__main__":
     main()
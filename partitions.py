@@ -0,0 +1,275 @@
+# partitions.py
+# Time-partitioned stationboard storage: one SQLite file per month
+#
+#     sbb_data_2025-09.db, sbb_data_2025-10.db, ...
+#
+# Rows are routed to the partition of their fetched_at month. Queries fan out over the
+# partitions that overlap the requested time range (newest first for "latest N" queries),
+# and expiring a month is deleting one file instead of a DELETE scan over the whole table.
+#
+# Ingest writes the single-file database (sbb_data.db), which the dashboard, plots, rollups
+# and the station catalog read. `import` moves its closed months (everything before the
+# current month) into partitions and deletes them there, so run it e.g. monthly from cron:
+# the live file keeps about one month, and retention.py expires older months by dropping
+# partition files. Moved months are read through query() / the partition files.
+#
+#     python partitions.py --prefix sbb_data list
+#     python partitions.py --prefix sbb_data import sbb_data.db      # move closed months out of sbb_data.db
+#     python partitions.py --prefix sbb_data drop-before 2025-09
+
+import argparse
+import glob
+import os
+import re
+from datetime import datetime
+
+import data_access
+from bulk_writer import BulkWriter
+from data_access import write_connection
+from db_schema import migrate
+from raw_store import PREFIX, RAW_COLUMNS, RAW_TABLE_SQL, RawStore, is_reference
+from station_catalog import total_rows
+
+MONTH_RE = re.compile(r"_(\d{4}-\d{2})\.db$")
+MOVE_CHUNK = 5000  # rows per import transaction (partition commit, then delete from the source)
+
+RAW_COPY_SQL = "INSERT OR IGNORE INTO raw_payloads (hash, data, first_seen, last_seen) VALUES (?, ?, ?, ?)"
+
+
+def month_of(fetched_at):
+    """'2025-10-24T12:00:00' -> '2025-10'"""
+    return fetched_at[:7]
+
+
+class PartitionedStore:
+    """
+    Monthly SQLite partitions of the stationboard table.
+    `create_table(conn)` creates the table in a new partition (e.g. ingest_sbb.create_db);
+    it is only needed by writers. With raw_payloads=True, store_rows() keeps raw payloads
+    in each partition's content-addressed store (see raw_store.py).
+    """
+
+    def __init__(self, base_dir=".", prefix="sbb_data", create_table=None, raw_payloads=False):
+        self.base_dir = base_dir
+        self.prefix = prefix
+        self.create_table = create_table
+        self.raw_payloads = raw_payloads
+        self._connections = {}  # month -> shared writer connection, tables created
+        self._raw_stores = {}  # month -> RawStore
+
+    def path(self, month):
+        return os.path.join(self.base_dir, f"{self.prefix}_{month}.db")
+
+    def months(self):
+        """Existing partitions, oldest first"""
+        found = []
+        for path in glob.glob(os.path.join(self.base_dir, f"{self.prefix}_*.db")):
+            m = MONTH_RE.search(os.path.basename(path))
+            if m:
+                found.append(m.group(1))
+        return sorted(found)
+
+    def connection(self, month):
+        conn = self._connections.get(month)
+        if conn is None:
+            conn = write_connection(self.path(month))
+            if self.create_table is not None:
+                self.create_table(conn)
+            migrate(conn)
+            self._connections[month] = conn
+        return conn
+
+    def close(self):
+        for month in self._connections:
+            data_access.close(self.path(month))
+        self._connections = {}
+
+    # ------------------------
+    # Writes
+    # ------------------------
+    def store_rows(self, rows, sql, extra=None):
+        """
+        Write stationboard rows (fetched_at first) with INSERT statement `sql` into their monthly partitions.
+        `extra` = (other_sql, rows), also fetched_at first, are written with them in the same transactions.
+        """
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(month_of(row[0]), ([], []))[0].append(row)
+        if extra is not None:
+            for row in extra[1]:
+                by_month.setdefault(month_of(row[0]), ([], []))[1].append(row)
+        for month, (month_rows, extra_rows) in by_month.items():
+            raw_store = self._raw_stores.setdefault(month, RawStore()) if self.raw_payloads else None
+            with BulkWriter(self.connection(month), sql, raw_store=raw_store) as writer:
+                writer.add_many(month_rows)
+                for row in extra_rows:
+                    writer.add(row, sql=extra[0])
+        return sum(len(r) for r, _ in by_month.values())
+
+    # ------------------------
+    # Reads
+    # ------------------------
+    def query(self, sql, params=(), since=None, until=None, newest_first=False, limit=None):
+        """
+        Run `sql` on every partition overlapping [since, until] (ISO strings or None)
+        and concatenate the results. Partitions are visited oldest first, or newest first
+        with newest_first=True; with `limit`, later partitions are skipped once enough rows are found.
+        `sql` should itself order rows the same way inside a partition.
+        """
+        months = [m for m in self.months()
+                  if (since is None or m >= since[:7]) and (until is None or m <= until[:7])]
+        if newest_first:
+            months.reverse()
+        rows = []
+        for month in months:
+            rows.extend(self.connection(month).execute(sql, params).fetchall())
+            if limit is not None and len(rows) >= limit:
+                return rows[:limit]
+        return rows
+
+    def count(self):
+        """Total rows over all partitions, from each partition's station_stats catalog"""
+        return sum(total_rows(self.connection(m)) for m in self.months())
+
+    # ------------------------
+    # Retention
+    # ------------------------
+    def drop_partition(self, month):
+        """Delete one month of data: close the connections and remove the file (O(1))"""
+        self._connections.pop(month, None)
+        data_access.close(self.path(month))
+        removed = False
+        for suffix in ("", "-wal", "-shm"):
+            path = self.path(month) + suffix
+            if os.path.exists(path):
+                os.remove(path)
+                removed = True
+        return removed
+
+    def drop_before(self, month):
+        """Drop all partitions older than `month` ('YYYY-MM'). Returns the dropped months."""
+        dropped = [m for m in self.months() if m < month]
+        for m in dropped:
+            self.drop_partition(m)
+        return dropped
+
+    # ------------------------
+    # Moving closed months out of a single-file database
+    # ------------------------
+    def import_db(self, db_file, before=None, chunk=MOVE_CHUNK):
+        """
+        Move the stationboard rows of `db_file` fetched before month `before` ('YYYY-MM',
+        default: the current month) into monthly partitions, `chunk` rows per transaction.
+        Rows keep their ids and are deleted from `db_file` once their partition has committed
+        them, through its triggers (rollups, station_stats). A rerun after an interruption
+        skips rows a partition already holds. Returns the number of rows moved.
+        """
+        before = before or datetime.utcnow().strftime("%Y-%m")
+        src = write_connection(db_file)
+        schema = src.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'stationboard'"
+        ).fetchone()
+        if schema is None:
+            raise ValueError(f"{db_file} has no stationboard table")
+        columns = [r[1] for r in src.execute("PRAGMA table_info(stationboard)")]
+        sql = f"INSERT INTO stationboard ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        fetched_idx = columns.index("fetched_at")
+        raw_idx = next((i for i, c in enumerate(columns) if c in RAW_COLUMNS), None)
+        if src.execute("SELECT 1 FROM sqlite_master WHERE name = 'raw_payloads'").fetchone() is None:
+            raw_idx = None
+
+        # rows added while we run are left for the next run
+        max_id = src.execute("SELECT MAX(id) FROM stationboard").fetchone()[0] or 0
+        last_id, moved, skipped = 0, {}, 0
+        while True:
+            rows = src.execute(f"""
+                SELECT {', '.join(columns)} FROM stationboard
+                WHERE id > ? AND id <= ? AND fetched_at < ?
+                ORDER BY id LIMIT ?
+            """, (last_id, max_id, before, chunk)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            by_month = {}
+            for row in rows:
+                month = month_of(row[fetched_idx] or "")
+                if MONTH_RE.search(f"_{month}.db"):
+                    by_month.setdefault(month, []).append(row)
+                else:
+                    skipped += 1  # stays in db_file
+            for month, month_rows in sorted(by_month.items()):
+                if not os.path.exists(self.path(month)):
+                    write_connection(self.path(month)).execute(schema[0])
+                self._write_moved(month, sql, month_rows, src, fetched_idx, raw_idx)
+                moved[month] = moved.get(month, 0) + len(month_rows)
+            # through stationboard, so the triggers keep rollups and station_stats up to date
+            src.executemany("DELETE FROM stationboard WHERE id = ?",
+                            [(r[0],) for month_rows in by_month.values() for r in month_rows])
+            src.commit()
+
+        for month, n in sorted(moved.items()):
+            print(f"{self.path(month)}: {n} rows")
+        if skipped:
+            print(f"Kept {skipped} rows without a valid fetched_at in {db_file}")
+        return sum(moved.values())
+
+    def _write_moved(self, month, sql, rows, src, fetched_idx, raw_idx):
+        """One transaction on the partition: the rows it doesn't hold yet, plus their raw payloads"""
+        conn = self.connection(month)
+        ids = [r[0] for r in rows]
+        present = {}  # id -> fetched_at, rows written by an interrupted earlier run
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            present.update(conn.execute(
+                f"SELECT id, fetched_at FROM stationboard WHERE id IN ({', '.join('?' * len(part))})", part))
+        new_rows = []
+        for row in rows:
+            if row[0] not in present:
+                new_rows.append(row)
+            elif present[row[0]] != row[fetched_idx]:
+                raise ValueError(f"{self.path(month)}: id {row[0]} holds another row "
+                                 f"(partition filled from another database?)")
+
+        payloads = []
+        if raw_idx is not None:
+            conn.execute(RAW_TABLE_SQL)
+            hashes = sorted({r[raw_idx][len(PREFIX):] for r in new_rows if is_reference(r[raw_idx])})
+            for i in range(0, len(hashes), 500):
+                part = hashes[i:i + 500]
+                payloads.extend(src.execute(
+                    f"SELECT hash, data, first_seen, last_seen FROM raw_payloads "
+                    f"WHERE hash IN ({', '.join('?' * len(part))})", part))
+        with BulkWriter(conn, sql, batch_size=len(new_rows) + len(payloads) + 1) as writer:
+            writer.add_many(new_rows)
+            for payload in payloads:
+                writer.add(payload, sql=RAW_COPY_SQL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage monthly stationboard partitions")
+    parser.add_argument("--dir", default=".", help="Folder holding the partition files")
+    parser.add_argument("--prefix", default="sbb_data", help="Partition file prefix (sbb_data or db_data)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="List partitions and their row counts")
+    p_import = sub.add_parser("import", help="Move the closed months of a single-file DB into partitions")
+    p_import.add_argument("db", help="Source SQLite DB")
+    p_import.add_argument("--before", help="YYYY-MM; rows of this month and newer stay (default: current month)")
+    p_drop = sub.add_parser("drop-before", help="Delete partitions older than a month")
+    p_drop.add_argument("month", help="YYYY-MM; this month and newer are kept")
+    args = parser.parse_args()
+
+    store = PartitionedStore(base_dir=args.dir, prefix=args.prefix)
+    if args.command == "list":
+        for month in store.months():
+            n = total_rows(store.connection(month))
+            print(f"{month}: {n} rows ({os.path.getsize(store.path(month)) // 1024} KiB)")
+    elif args.command == "import":
+        print(f"Moved {store.import_db(args.db, before=args.before)} rows")
+    elif args.command == "drop-before":
+        dropped = store.drop_before(args.month)
+        print(f"Dropped partitions: {', '.join(dropped) or 'none'}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,22 @@
-import sqlite3
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from chart_report import draw_delays
+from compact_schema import queries_for
+from data_access import SBB_DB, read_connection
+
 # Parameters
 station_name = "Zurich"  # filter by station
 
-# Connect to the database
-conn = sqlite3.connect("sbb_data.db")
-
-# Load data into pandas DataFrame
-df = pd.read_sql_query("""
-SELECT fetched_at, train_name, delay_minutes, station
-FROM stationboard
-WHERE station = ?
-ORDER BY fetched_at ASC
-""", conn, params=(station_name,))
-
-conn.close()
+# Load data into pandas DataFrame (plain or compact schema, see compact_schema.py)
+with read_connection(SBB_DB) as conn:
+    df = pd.read_sql_query(queries_for(conn).STATION_HISTORY_SQL, conn, params=(station_name,))
 
 # Convert fetched_at to datetime
 df['fetched_at'] = pd.to_datetime(df['fetched_at'])
 
-# Plot delays
+# Plot delays: each train separately (one groupby pass, see chart_report.py for batch PNG/SVG)
 plt.figure(figsize=(12,6))
-
-# Plot each train separately
-for train in df['train_name'].unique():
-    train_data = df[df['train_name'] == train]
-    plt.plot(train_data['fetched_at'], train_data['delay_minutes'], marker='o', linestyle='-', label=train)
-
-plt.title(f"Train Delays Over Time at {station_name}")
-plt.xlabel("Time of Fetch")
-plt.ylabel("Delay (minutes)")
-plt.grid(True)
-plt.xticks(rotation=45)
-plt.legend()
+draw_delays(plt.gca(), df, station_name)
 plt.tight_layout()
 plt.show()
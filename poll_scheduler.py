@@ -0,0 +1,305 @@
+# poll_scheduler.py
+# Headless polling daemon for many SBB stations, with an adaptive interval per station
+#
+#     python poll_scheduler.py --stations "Zurich,Bern,Basel,Geneva" --budget 30
+#     python poll_scheduler.py --stations-file stations.txt --min-interval 60 --max-interval 900
+#
+# The API returns the next `limit` departures of a station. A busy station's board covers a
+# few minutes, a quiet one's several hours, so each station is polled again when about half
+# of the time its last board covered has passed (COVERAGE), clamped to
+# [min_interval, max_interval]. Stations whose delays changed since the previous poll
+# (volatility: share of the trains seen twice whose delay moved) are polled sooner. Intervals
+# are smoothed and get +-10% jitter, so stations don't fall into lockstep.
+#
+# A failed request backs the station off exponentially (BACKOFF_BASE * 2^failures, up to
+# MAX_BACKOFF); HTTP 429 also pauses every station for Retry-After seconds. All requests
+# draw from one token bucket (--budget requests per minute), so when more stations are due
+# than the budget allows they are served in due order and the quota goes where polls are due.
+#
+# Rows are stored like ingest_sbb.py does (through the writer service if one is running).
+# Ctrl+C / SIGTERM finishes the running requests and stops.
+
+import argparse
+import heapq
+import random
+import signal
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+from data_access import SBB_DB
+from ingest_sbb import close_writer, fetch_stationboard, make_session, open_writer, parse, store, store_fetch_status
+from pass_list import parse_time
+from raw_store import RawStore
+
+DEFAULT_BUDGET = 30   # requests per minute over all stations
+MIN_INTERVAL = 60     # seconds
+MAX_INTERVAL = 900
+COVERAGE = 0.5        # poll again when this share of the last board's time span has passed
+VOLATILITY_WEIGHT = 0.5  # all delays changed -> interval halved
+SMOOTHING = 0.5       # weight of the new target interval against the previous one
+JITTER = 0.1
+BACKOFF_BASE = 30
+MAX_BACKOFF = 3600
+
+SCHEDULED_IDX, DELAY_IDX = 6, 8  # scheduled_time / delay_seconds in ingest_sbb rows
+
+
+class RateBudget:
+    """Token bucket shared by all stations: `per_minute` requests, bursts of up to `burst`"""
+
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst or max(1, round(per_minute / 6))  # at most 10 s worth at once
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a request may be sent (0: now)"""
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds, now):
+        """No requests for `seconds` (the API said 429)"""
+        self.paused_until = max(self.paused_until, now + seconds)
+
+
+class StationState:
+    def __init__(self, name, interval):
+        self.name = name
+        self.interval = interval  # smoothed adaptive interval, without jitter and backoff
+        self.failures = 0
+        self.delays = {}          # (train_name, scheduled_time) -> delay_seconds of the last poll
+        self.density = None       # departures per minute on the last board
+        self.volatility = None
+        self.unparsed = False     # the last board had no usable departure times (logged once)
+        self.polls = 0
+        self.errors = 0
+
+
+def board_span(rows, now):
+    """(departures per minute, seconds until the last departure) of a board, or (None, None)"""
+    times = [parse_time(r[SCHEDULED_IDX]) for r in rows]
+    times = [t for t in times if t is not None and t.tzinfo is not None]
+    if not times:
+        return None, None
+    span = (max(times) - now).total_seconds()
+    if span <= 0:
+        return None, None
+    return len(times) / (span / 60), span
+
+
+def volatility(previous, current):
+    """Share of the trains on both boards whose delay changed, None without overlap"""
+    common = [k for k in current if k in previous]
+    if not common:
+        return None
+    return sum(previous[k] != current[k] for k in common) / len(common)
+
+
+def adapt(state, rows, now, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL):
+    """Update `state` from a successful poll's rows and return its new interval (seconds)"""
+    delays = {(r[2], r[SCHEDULED_IDX]): r[DELAY_IDX] for r in rows}
+    state.density, span = board_span(rows, now)
+    unparsed = bool(rows) and not any(getattr(parse_time(r[SCHEDULED_IDX]), "tzinfo", None) for r in rows)
+    if unparsed and not state.unparsed:
+        print(f"{state.name}: no departure time could be parsed (e.g. {rows[0][SCHEDULED_IDX]!r}), "
+              f"polling every {max_interval:.0f}s until one can")
+    state.unparsed = unparsed
+    state.volatility = volatility(state.delays, delays)
+    state.delays = delays
+
+    target = span * COVERAGE if span is not None else max_interval
+    if state.volatility is not None:
+        target *= 1 - VOLATILITY_WEIGHT * state.volatility
+    target = min(max_interval, max(min_interval, target))
+    state.interval = SMOOTHING * target + (1 - SMOOTHING) * state.interval
+    return state.interval
+
+
+def retry_after(error):
+    """Retry-After seconds of an HTTP 429 error, else None"""
+    response = getattr(error, "response", None)
+    if response is None or response.status_code != 429:
+        return None
+    try:
+        return float(response.headers.get("Retry-After", BACKOFF_BASE))
+    except ValueError:
+        return BACKOFF_BASE
+
+
+class PollScheduler:
+    """
+    Polls `stations` forever (or until stop()): one dispatcher thread (run()) sends due
+    requests to a pool of `workers` threads within the rate budget and stores the results.
+    """
+
+    def __init__(self, stations, db=SBB_DB, limit=20, budget=DEFAULT_BUDGET, workers=4, timeout=10,
+                 min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, fetch=fetch_stationboard):
+        self.db = db
+        self.limit = limit
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.fetch = fetch
+        self.budget = RateBudget(budget)
+        self.workers = workers
+        self.states = {s: StationState(s, min_interval) for s in stations}
+        now = time.monotonic()
+        # first polls spread over one minimum interval
+        self._due = [(now + random.uniform(0, min_interval), s) for s in stations]
+        heapq.heapify(self._due)
+        self._stop = threading.Event()
+        self._conn = None
+        self._raw_store = RawStore()
+        self.requests = 0
+
+    def stop(self):
+        self._stop.set()
+
+    def _schedule(self, station, delay):
+        delay *= random.uniform(1 - JITTER, 1 + JITTER)
+        heapq.heappush(self._due, (time.monotonic() + delay, station))
+        return delay
+
+    def _fetch(self, station, session):
+        return parse(self.fetch(station, limit=self.limit, session=session, timeout=self.timeout), station)
+
+    def _writer(self):
+        if self._conn is None:
+            self._conn = open_writer(self.db)
+        return self._conn
+
+    def _store(self, station, rows, stops):
+        try:
+            conn = self._writer()
+            n = store(rows, conn, raw_store=self._raw_store, stops=stops)
+            store_fetch_status(conn, station, rows=n)
+            return n
+        except (EOFError, OSError):
+            self._conn = None  # writer service stopped: the next poll writes directly
+            raise
+
+    def _done(self, station, future):
+        state = self.states[station]
+        state.polls += 1
+        try:
+            rows, stops = future.result()
+        except Exception as e:
+            state.failures += 1
+            state.errors += 1
+            pause = retry_after(e)
+            if pause is not None:
+                self.budget.pause(pause, time.monotonic())
+            delay = max(pause or 0, min(MAX_BACKOFF, BACKOFF_BASE * 2 ** (state.failures - 1)))
+            delay = self._schedule(station, delay)
+            print(f"{station}: error ({e}), retry in {delay:.0f}s")
+            try:
+                store_fetch_status(self._writer(), station, error=e)
+            except Exception:
+                self._conn = None
+            return
+
+        state.failures = 0
+        interval = adapt(state, rows, datetime.now(timezone.utc), self.min_interval, self.max_interval)
+        try:
+            n = self._store(station, rows, stops)
+        except Exception as e:
+            n = f"not stored ({e})"
+        delay = self._schedule(station, interval)
+        density = "?" if state.density is None else f"{state.density:.1f}/min"
+        changed = "?" if state.volatility is None else f"{state.volatility:.0%}"
+        print(f"{station}: {n} rows, next in {delay:.0f}s (departures {density}, delays changed {changed})")
+
+    def _step(self, pool, session, running):
+        for future in [f for f in running if f.done()]:
+            self._done(running.pop(future), future)
+
+        now = time.monotonic()
+        sleep = 1.0
+        if not self._stop.is_set() and self._due and len(running) < self.workers:
+            due_at, station = self._due[0]
+            sleep = max(due_at - now, self.budget.wait_time(now))
+            if sleep <= 0:
+                heapq.heappop(self._due)
+                self.budget.take(now)
+                self.requests += 1
+                running[pool.submit(self._fetch, station, session)] = station
+                return
+        if running:
+            wait(list(running), timeout=min(sleep, 1.0), return_when=FIRST_COMPLETED)
+        else:
+            self._stop.wait(min(sleep, 1.0))
+
+    def run(self):
+        """
+        Dispatch until stop() or Ctrl+C; returns after the running requests are stored
+        (a second Ctrl+C doesn't wait for them)
+        """
+        session = make_session(pool_size=self.workers, retries=0)  # retries are scheduled, and counted
+        running = {}  # future -> station
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="poll") as pool:
+                while not self._stop.is_set() or running:
+                    try:
+                        self._step(pool, session, running)
+                    except KeyboardInterrupt:
+                        if self._stop.is_set():
+                            raise
+                        print(f"Stopping, {len(running)} requests still running ...")
+                        self.stop()
+        finally:
+            session.close()
+            if self._conn is not None:
+                close_writer(self._conn)
+                self._conn = None
+
+    def summary(self):
+        return {s.name: {"polls": s.polls, "errors": s.errors, "interval_s": round(s.interval)}
+                for s in self.states.values()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Poll many SBB stations with adaptive intervals")
+    parser.add_argument("--db", default=SBB_DB, help="SQLite DB filename")
+    parser.add_argument("--stations", help="Comma-separated station list")
+    parser.add_argument("--stations-file", help="File with one station per line")
+    parser.add_argument("--limit", type=int, default=20, help="Departures per request")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET, help="Requests per minute, all stations")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent requests")
+    parser.add_argument("--timeout", type=float, default=10, help="Per-request timeout in seconds")
+    parser.add_argument("--min-interval", type=float, default=MIN_INTERVAL, help="Seconds")
+    parser.add_argument("--max-interval", type=float, default=MAX_INTERVAL, help="Seconds")
+    args = parser.parse_args()
+
+    stations = [s.strip() for s in (args.stations or "").split(",") if s.strip()]
+    if args.stations_file:
+        with open(args.stations_file, encoding="utf-8") as f:
+            stations += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    if not stations:
+        parser.error("give --stations and/or --stations-file")
+
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    scheduler = PollScheduler(list(dict.fromkeys(stations)), db=args.db, limit=args.limit, budget=args.budget,
+                              workers=args.workers, timeout=args.timeout,
+                              min_interval=args.min_interval, max_interval=args.max_interval)
+    print(f"Polling {len(scheduler.states)} stations, budget {args.budget:g} requests/min")
+    scheduler.run()
+    for name, s in scheduler.summary().items():
+        print(f"{name}: {s}")
+
+
+if __name__ == "__main__":
+    main()
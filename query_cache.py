@@ -0,0 +1,99 @@
+# query_cache.py
+# Shared, version-aware result cache for dashboard queries.
+# Results are keyed on (query, parameters) and reused until another connection commits
+# a change to the file (new rows from ingest, deletes from cleanup); then the cache is
+# emptied and each query is recomputed once, on its next request.
+
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from data_access import database
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class QueryCache:
+    """
+    LRU cache of query results for one SQLite file, shared by every dashboard session.
+
+        cache = QueryCache("sbb_data.db")
+        df = cache.read_sql("SELECT ... WHERE station = ?", ("Zurich",))
+        n = cache.call(count_rows)            # count_rows(conn) -> any value
+
+    The version token is PRAGMA data_version of the cache's own connection: it changes
+    whenever another connection commits to the database, and costs no table access.
+    Memory is bounded by `max_entries` and by the approximate size of cached DataFrames.
+    """
+
+    def __init__(self, db, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.db = db
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # a reader of its own: data_version only moves for commits made by other connections
+        self._conn = database(db).open_reader()
+        self._lock = threading.Lock()  # one query at a time on the shared connection
+        self._entries = OrderedDict()  # key -> (result, size), all computed at self._seen
+        self._bytes = 0
+        self._seen = None
+
+    def version(self):
+        with self._lock:
+            return self._version()
+
+    def _version(self):
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def read_sql(self, sql, params=()):
+        """pd.read_sql_query through the cache; returns a copy the caller may modify"""
+        df = self._get(("sql", sql, tuple(params)),
+                       lambda conn: pd.read_sql_query(sql, conn, params=tuple(params)))
+        return df.copy()
+
+    def call(self, fn, *args):
+        """Cached fn(conn, *args); the result is shared, so treat it as read-only"""
+        return self._get(("call", fn.__module__, fn.__qualname__, args), lambda conn: fn(conn, *args))
+
+    def _get(self, key, compute):
+        with self._lock:
+            version = self._version()
+            if version != self._seen:
+                # new data landed: every cached result is stale
+                self._entries.clear()
+                self._bytes = 0
+                self._seen = version
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            result = compute(self._conn)
+            self._store(key, result)
+            return result
+
+    def _store(self, key, result):
+        size = int(result.memory_usage(index=True).sum()) if isinstance(result, pd.DataFrame) else 0
+        self._entries[key] = (result, size)
+        self._bytes += size
+        # evict least recently used entries; the one just stored always stays
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._seen = None
+
+    def stats(self):
+        return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,225 @@
+# raw_store.py
+# Content-addressed, compressed storage for raw API/XML payloads
+#
+# Instead of the full JSON/XML text, stationboard.raw_json / raw_xml hold a reference
+#
+#     raw:<32 hex digits of blake2b-128(payload)>
+#
+# and the payload itself is stored once, zlib-compressed, in
+#
+#     raw_payloads(hash PRIMARY KEY, data BLOB, first_seen, last_seen)
+#
+# A payload that is byte-identical to an earlier poll costs one small upsert that moves
+# last_seen. expire_payloads() drops payloads not seen for a configurable number of days;
+# rows keep their reference and load_raw() returns None for them.
+#
+#     python raw_store.py --db sbb_data.db stats
+#     python raw_store.py --db sbb_data.db convert          # move existing inline payloads
+#     python raw_store.py --db sbb_data.db expire --keep-days 14
+
+import argparse
+import hashlib
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from data_access import SBB_DB, write_connection
+
+PREFIX = "raw:"
+RAW_COLUMNS = ("raw_json", "raw_xml")
+# index of the raw column in the ingest INSERT statements (fetched_at first, raw_json/raw_xml 11th)
+RAW_INDEX = 10
+DELETE_CHUNK = 5000
+
+RAW_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS raw_payloads (
+        hash TEXT PRIMARY KEY,
+        data BLOB,
+        first_seen TEXT,
+        last_seen TEXT
+    );
+"""
+
+# data is only sent for payloads this process hasn't written recently (NULL otherwise)
+RAW_UPSERT_SQL = """
+    INSERT INTO raw_payloads (hash, data, first_seen, last_seen) VALUES (?1, ?2, ?3, ?3)
+    ON CONFLICT (hash) DO UPDATE SET
+        data = COALESCE(data, excluded.data),
+        last_seen = MAX(last_seen, excluded.last_seen)
+"""
+
+
+def payload_hash(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def is_reference(value):
+    return isinstance(value, str) and value.startswith(PREFIX) and len(value) == len(PREFIX) + 32
+
+
+def stores_raw(conn):
+    """False for a compact-schema file migrated without --keep-raw: its view drops raw payloads"""
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = 'stationboard'").fetchone()
+    if row is None or row[0] != "view":
+        return True
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'stationboard_raw'").fetchone() is not None
+
+
+class RawStore:
+    """
+    Turns ingest rows with an inline payload into rows with a reference plus a
+    RAW_UPSERT_SQL row; used by BulkWriter(raw_store=...), which writes both in one transaction.
+
+    Hashes written in the last `ttl` seconds are remembered, so repeated payloads are not
+    compressed again. `ttl` must stay well below the expiry window (days), so a remembered
+    payload can't have been expired in the meantime. A hash only counts as written once the
+    transaction carrying its data committed: the writer calls commit() after COMMIT and
+    forget() after ROLLBACK. On a database that keeps no raw payloads (see stores_raw)
+    create_table() switches the store off and rows pass through unchanged.
+    """
+
+    sql = RAW_UPSERT_SQL
+
+    def __init__(self, column=RAW_INDEX, ttl=3600, max_known=200_000, level=6):
+        self.column = column
+        self.ttl = ttl
+        self.max_known = max_known
+        self.level = level
+        self._known = OrderedDict()  # hash -> time.monotonic() of the last committed write with data
+        self._uncommitted = {}       # hash -> time.monotonic(), data sent in the open transaction
+        self.enabled = True
+
+    def create_table(self, conn):
+        self.enabled = stores_raw(conn)
+        if self.enabled:
+            conn.execute(RAW_TABLE_SQL)
+
+    def split(self, row):
+        """(row with the payload replaced by its reference, upsert row or None)"""
+        text = row[self.column]
+        if not self.enabled or not text or is_reference(text):
+            return row, None
+        h = payload_hash(text)
+        now = time.monotonic()
+        seen = self._known.get(h)
+        if h in self._uncommitted or (seen is not None and now - seen < self.ttl):
+            data = None  # stored already, or earlier in the same transaction
+            if seen is not None:
+                self._known.move_to_end(h)
+        else:
+            data = zlib.compress(text.encode("utf-8"), self.level)
+            self._uncommitted[h] = now
+        ref_row = row[:self.column] + (PREFIX + h,) + row[self.column + 1:]
+        return ref_row, (h, data, row[0])
+
+    def commit(self):
+        """The transaction with the payloads split since the last commit()/forget() committed"""
+        for h, now in self._uncommitted.items():
+            self._known[h] = now
+            self._known.move_to_end(h)
+        self._uncommitted.clear()
+        while len(self._known) > self.max_known:
+            self._known.popitem(last=False)
+
+    def forget(self):
+        """The transaction rolled back (or its rows were dropped): its payloads were never stored"""
+        self._uncommitted.clear()
+
+
+def load_raw(conn, value):
+    """Payload text for a raw_json/raw_xml value: resolves references, passes inline text through"""
+    if not is_reference(value):
+        return value
+    row = conn.execute("SELECT data FROM raw_payloads WHERE hash = ?", (value[len(PREFIX):],)).fetchone()
+    if row is None or row[0] is None:
+        return None  # expired
+    return zlib.decompress(row[0]).decode("utf-8")
+
+
+def decompress(data):
+    return zlib.decompress(data).decode("utf-8") if data is not None else None
+
+
+def raw_column(conn):
+    columns = [r[1] for r in conn.execute("PRAGMA table_info(stationboard)")]
+    return next(c for c in RAW_COLUMNS if c in columns)
+
+
+def convert_inline(conn, chunk=DELETE_CHUNK):
+    """Move inline payloads of existing rows into raw_payloads, in short transactions"""
+    column = raw_column(conn)
+    conn.execute(RAW_TABLE_SQL)
+    store = RawStore(column=1)
+    converted = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(f"""
+            SELECT id, fetched_at, {column} FROM stationboard
+            WHERE id > ? ORDER BY id LIMIT ?
+        """, (last_id, chunk)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        updates, payloads = [], []
+        for row in rows:
+            ref_row, payload = store.split((row[1], row[2]))
+            if payload is not None:
+                updates.append((ref_row[1], row[0]))
+                payloads.append(payload)
+        if updates:
+            conn.execute("BEGIN")
+            conn.executemany(RAW_UPSERT_SQL, payloads)
+            conn.executemany(f"UPDATE stationboard SET {column} = ? WHERE id = ?", updates)
+            conn.commit()
+            store.commit()
+            converted += len(updates)
+    return converted
+
+
+def expire_payloads(conn, keep_days):
+    """Delete payloads not seen in the last `keep_days` days, in short transactions"""
+    return expire_payloads_before(conn, (datetime.utcnow() - timedelta(days=keep_days)).isoformat())
+
+
+def expire_payloads_before(conn, cutoff):
+    """Delete payloads last seen before `cutoff` (ISO string), in short transactions"""
+    deleted = 0
+    while True:
+        n = conn.execute("""
+            DELETE FROM raw_payloads WHERE rowid IN (
+                SELECT rowid FROM raw_payloads WHERE last_seen < ? LIMIT ?)
+        """, (cutoff, DELETE_CHUNK)).rowcount
+        conn.commit()
+        deleted += n
+        if n < DELETE_CHUNK:
+            return deleted
+
+
+def payload_stats(conn):
+    count, stored = conn.execute("SELECT COUNT(*), COALESCE(SUM(length(data)), 0) FROM raw_payloads").fetchone()
+    return {"payloads": count, "compressed_bytes": stored}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the content-addressed raw payload store")
+    parser.add_argument("--db", default=SBB_DB, help="SQLite DB filename")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="Number and size of stored payloads")
+    sub.add_parser("convert", help="Move inline raw_json/raw_xml payloads into the store")
+    p_expire = sub.add_parser("expire", help="Drop payloads not seen for N days")
+    p_expire.add_argument("--keep-days", type=int, default=14)
+    args = parser.parse_args()
+
+    conn = write_connection(args.db)
+    conn.isolation_level = None
+    conn.execute(RAW_TABLE_SQL)
+    if args.command == "convert":
+        print(f"Converted {convert_inline(conn)} rows (run VACUUM to return the space to the OS)")
+    elif args.command == "expire":
+        print(f"Expired {expire_payloads(conn, args.keep_days)} payloads")
+    print(payload_stats(conn))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,11 @@
-import sqlite3  # библиотека для работы с SQLite
+from data_access import LATEST_ROWS_SQL, SBB_DB, read_connection  # общий слой доступа к SQLite
 
-# Подключаемся к базе данных sbb_data.db
-# Если база в другой папке, укажи полный путь
-conn = sqlite3.connect("sbb_data.db")  
-
-# Создаём объект курсора — через него выполняем запросы
-cur = conn.cursor()
-
-# SQL-запрос: выбрать последние 20 записей из таблицы stationboard
-cur.execute("""
-SELECT id, fetched_at, station, train_name, to_station, delay_minutes
-FROM stationboard
-ORDER BY id DESC
-LIMIT 20;
-""")
-
-# Получаем все строки результата
-rows = cur.fetchall()
+# Берём соединение только для чтения к базе sbb_data.db
+# Если база в другой папке, укажи полный путь вместо SBB_DB
+with read_connection(SBB_DB) as conn:
+    # SQL-запрос: выбрать последние 20 записей из таблицы stationboard
+    rows = conn.execute(LATEST_ROWS_SQL, (20,)).fetchall()
 
 # Выводим строки на экран
 for row in rows:
     print(row)
-
-# Закрываем соединение с базой
-conn.close()
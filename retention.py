@@ -0,0 +1,367 @@
+# retention.py
+# Declarative retention for the stationboard databases, their monthly partitions and the DB XML files
+#
+#     Policy("db-xml-7-days", railway="db", older_than_days=7, scope=("xml",))
+#     Policy("db-before-sep", railway="db", before="2025-09-01", scope=("rows", "xml"))
+#     Policy("db-only-hbf", railway="db", keep_stations="*hbf*", scope=("rows", "xml"))
+#
+# A policy deletes what matches all of its conditions: older than `older_than_days` and/or
+# `before`, station matching `stations` and/or not matching `keep_stations` (glob patterns,
+# case-insensitive). Rows without a station are only covered by age-only policies and by
+# stations="" (not by patterns, not by keep_stations). `railway` ("sbb", "db" or None for both) picks the files, `scope` what
+# is deleted: "rows" (stationboard rows in <db>.db and the <db>_YYYY-MM.db partitions) and/or
+# "xml" (Deutsche Bahn XML files; their date is the YYYY-MM-DD folder they are in, else mtime;
+# their station is any part of their path).
+#
+# Safe to run from cron while ingest is running:
+#   - rows are deleted per station through the (station, fetched_at) index, found in the
+#     station_stats catalog, in short transactions of `chunk` rows (no COUNT(*) or full scans);
+#   - partitions entirely before an age cutoff are dropped as files; `partitions.py import`
+#     moves closed months out of <db>.db, so with a monthly import age cutoffs are file drops
+#     and the chunked deletes only cover the month a cutoff falls into;
+#   - age policies also expire the stops table and unreferenced raw payloads;
+#   - freed pages go back to the OS with incremental vacuum, a few MB per transaction
+#     (files created before auto_vacuum was enabled need `enable-vacuum` once);
+#   - the XML tree is walked once for all policies; only folders emptied by the run are removed.
+# --dry-run only reads: no schema migration, read-only connections, nothing created.
+#
+#     python retention.py run                              # POLICIES below
+#     python retention.py run --policies retention.json    # [{"name": ..., "railway": ..., ...}, ...]
+#     python retention.py run --railway db --before 2025-09-01 --scope rows,xml --dry-run
+#     python retention.py enable-vacuum --db db_data.db    # one full VACUUM, stop ingest first
+
+import argparse
+import fnmatch
+import json
+import os
+import re
+from datetime import datetime, timedelta
+
+import data_access
+from compact_schema import is_compact
+from data_access import DB_DB, SBB_DB, read_connection, write_connection
+from db_schema import migrate
+from partitions import PartitionedStore
+from pass_list import expire_stops
+from raw_store import expire_payloads_before
+from station_catalog import total_rows
+
+RAILWAYS = {"sbb": (SBB_DB, "sbb_data"), "db": (DB_DB, "db_data")}  # railway -> (database, partition prefix)
+XML_DIRS = ("deutsche-bahn-data/data",)
+SCOPES = ("rows", "xml")
+DELETE_CHUNK = 5000  # rows per delete transaction
+VACUUM_STEP = 2000   # pages returned to the OS per incremental_vacuum transaction
+DATE_DIR_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+class Policy:
+    """One retention rule; see the module comment for the meaning of the fields"""
+
+    def __init__(self, name, railway=None, older_than_days=None, before=None,
+                 stations=None, keep_stations=None, scope=("rows",)):
+        if railway is not None and railway not in RAILWAYS:
+            raise ValueError(f"{name}: unknown railway {railway!r}")
+        scope = tuple(scope.split(",")) if isinstance(scope, str) else tuple(scope)
+        if not scope or any(s not in SCOPES for s in scope):
+            raise ValueError(f"{name}: scope must be some of {', '.join(SCOPES)}")
+        if "xml" in scope and railway == "sbb":
+            raise ValueError(f"{name}: there are no SBB XML files")
+        if older_than_days is None and before is None and stations is None and keep_stations is None:
+            raise ValueError(f"{name}: a policy without conditions would delete everything")
+        self.name = name
+        self.railway = railway
+        self.older_than_days = older_than_days
+        self.before = datetime.fromisoformat(before).isoformat() if before else None
+        self.stations = stations.lower() if stations is not None else None  # "": rows without a station
+        self.keep_stations = keep_stations.lower() if keep_stations else None
+        self.scope = scope
+
+    def __repr__(self):
+        return f"Policy({self.name!r})"
+
+    def cutoff(self, now):
+        """ISO timestamp: older things are deleted (None: no age condition)"""
+        cutoffs = [self.before] if self.before else []
+        if self.older_than_days is not None:
+            cutoffs.append((now - timedelta(days=self.older_than_days)).isoformat())
+        return min(cutoffs) if cutoffs else None
+
+    @property
+    def by_station(self):
+        return self.stations is not None or self.keep_stations is not None
+
+    def matches_station(self, *names):
+        """True if the station (any of `names`, e.g. the parts of a file path) is covered"""
+        names = [n.lower() for n in names]
+        if names == [""] and self.by_station:
+            return self.stations == ""  # no station: only when asked for explicitly
+        if self.stations is not None and not any(fnmatch.fnmatchcase(n, self.stations) for n in names):
+            return False
+        if self.keep_stations and any(fnmatch.fnmatchcase(n, self.keep_stations) for n in names):
+            return False
+        return True
+
+    def railways(self):
+        return [self.railway] if self.railway else list(RAILWAYS)
+
+
+def load_policies(path):
+    with open(path, encoding="utf-8") as f:
+        return [Policy(**p) for p in json.load(f)]
+
+
+# Scheduled default: XML files are only needed until they are ingested
+POLICIES = [
+    Policy("db-xml-7-days", railway="db", older_than_days=7, scope=("xml",)),
+]
+
+
+# ------------------------
+# Rows
+# ------------------------
+def _station_clauses(conn, station):
+    """(table, WHERE clause, params) selecting one catalog station's rows"""
+    if is_compact(conn):
+        # the compat view computes fetched_at per row: seek the compact table's index instead
+        if station == "":
+            return [("stationboard_compact", "station_id IS NULL", ()),
+                    ("stationboard_compact", "station_id = (SELECT id FROM stations WHERE name = '')", ())]
+        return [("stationboard_compact", "station_id = (SELECT id FROM stations WHERE name = ?)", (station,))]
+    # the catalog keeps rows without a station under ''
+    if station == "":
+        return [("stationboard", "station IS NULL", ()), ("stationboard", "station = ''", ())]
+    return [("stationboard", "station = ?", (station,))]
+
+
+def _has_table(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is not None
+
+
+def delete_rows(conn, policy, now, chunk=DELETE_CHUNK, dry_run=False):
+    """
+    Delete the stationboard rows `policy` covers in one database. Returns the number of rows,
+    None for a dry run on a file without the station_stats catalog (a real run migrates it first).
+    """
+    if not dry_run:
+        migrate(conn)
+    if not _has_table(conn, "station_stats"):
+        return None if dry_run and _has_table(conn, "stationboard") else 0
+    cutoff = policy.cutoff(now)
+    stations = [s for (s,) in conn.execute(
+        "SELECT station FROM station_stats WHERE rows > 0 AND (?1 IS NULL OR first_fetched_at < ?1)", (cutoff,)
+    ) if policy.matches_station(s)]
+
+    deleted = 0
+    for station in stations:
+        for table, where, params in _station_clauses(conn, station):
+            if cutoff:
+                # compact rows keep fetched_at as epoch seconds
+                where += (" AND fetched_at < CAST(strftime('%s', ?) AS INTEGER)" if table == "stationboard_compact"
+                          else " AND fetched_at < ?")
+                params += (cutoff,)
+            if dry_run:
+                deleted += conn.execute(f"SELECT COUNT(*) FROM {table} WHERE {where}", params).fetchone()[0]
+                continue
+            # loop until nothing is left: DELETE's rowcount is 0 on the compact schema's view
+            while True:
+                ids = conn.execute(f"SELECT id FROM {table} WHERE {where} LIMIT ?", params + (chunk,)).fetchall()
+                if not ids:
+                    break
+                # through stationboard, so the triggers keep rollups and station_stats up to date
+                conn.executemany("DELETE FROM stationboard WHERE id = ?", ids)
+                conn.commit()
+                deleted += len(ids)
+    return deleted
+
+
+def expire_related(conn, policy, now):
+    """stops and raw payloads older than an age-only policy's cutoff (shared by all stations)"""
+    cutoff = policy.cutoff(now)
+    if cutoff is None or policy.by_station:
+        return 0, 0
+    tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    stops = expire_stops(conn, cutoff) if "stops" in tables else 0
+    payloads = expire_payloads_before(conn, cutoff) if "raw_payloads" in tables else 0
+    return stops, payloads
+
+
+def incremental_vacuum(conn, step=VACUUM_STEP):
+    """Return free pages to the OS, `step` pages per transaction. Returns the pages freed, None if not enabled."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return None
+    freed = 0
+    while True:
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if not free:
+            break
+        # executescript steps the pragma to the end (execute() frees one page per call)
+        conn.executescript(f"PRAGMA incremental_vacuum({step});")
+        freed += min(free, step)
+    conn.execute("PRAGMA wal_checkpoint(PASSIVE)")  # shrink the file now if no reader is in the way
+    return freed
+
+
+def enable_vacuum(db_file):
+    """Switch an existing file to auto_vacuum=INCREMENTAL (rewrites the whole file once)"""
+    conn = write_connection(db_file)
+    conn.commit()
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+
+def apply_rows(policies, base_dir=".", now=None, chunk=DELETE_CHUNK, dry_run=False):
+    """Apply the "rows" policies to the databases and partitions of their railways"""
+    now = now or datetime.utcnow()
+    for railway, (db_name, prefix) in RAILWAYS.items():
+        selected = [p for p in policies if "rows" in p.scope and railway in p.railways()]
+        if not selected:
+            continue
+        store = PartitionedStore(base_dir=base_dir, prefix=prefix)
+        # whole months before an age cutoff: delete the file, not the rows
+        dropped = set()
+        for policy in selected:
+            cutoff = policy.cutoff(now)
+            if cutoff is None or policy.by_station:
+                continue
+            for month in [m for m in store.months() if m < cutoff[:7] and m not in dropped]:
+                dropped.add(month)
+                if dry_run:
+                    with read_connection(store.path(month)) as conn:
+                        rows = total_rows(conn) if _has_table(conn, "station_stats") else "?"
+                    print(f"{store.path(month)}: {policy.name}: would drop the partition ({rows} rows)")
+                    data_access.close(store.path(month))
+                else:
+                    store.drop_partition(month)
+                    print(f"{store.path(month)}: {policy.name}: dropped the partition")
+
+        paths = [os.path.join(base_dir, db_name)] + [store.path(m) for m in store.months() if m not in dropped]
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            if dry_run:
+                with read_connection(path) as conn:
+                    for policy in selected:
+                        rows = delete_rows(conn, policy, now, chunk, dry_run=True)
+                        if rows is None:
+                            print(f"{path}: {policy.name}: no station_stats catalog yet, run db_schema.py first")
+                        else:
+                            print(f"{path}: {policy.name}: would delete {rows} rows")
+                if path != paths[0]:
+                    data_access.close(path)
+                continue
+            conn = write_connection(path)
+            for policy in selected:
+                rows = delete_rows(conn, policy, now, chunk)
+                stops, payloads = expire_related(conn, policy, now)
+                print(f"{path}: {policy.name}: deleted {rows} rows, {stops} stops, {payloads} raw payloads")
+            freed = incremental_vacuum(conn)
+            if freed is None:
+                print(f"{path}: auto_vacuum is off, run `retention.py enable-vacuum --db {path}` once to shrink it")
+            elif freed:
+                print(f"{path}: returned {freed} pages to the OS")
+            if path != paths[0]:
+                data_access.close(path)  # partitions are not kept open
+
+
+# ------------------------
+# XML files
+# ------------------------
+def _file_date(parts, path):
+    for part in reversed(parts):
+        if DATE_DIR_RE.match(part):
+            return datetime.strptime(part, "%Y-%m-%d")
+    return datetime.fromtimestamp(os.path.getmtime(path))
+
+
+def apply_xml(policies, xml_dirs=XML_DIRS, now=None, dry_run=False):
+    """Delete the XML files any "xml" policy covers, in one walk per folder. Returns (files, folders)."""
+    now = now or datetime.now()
+    selected = [p for p in policies if "xml" in p.scope and "db" in p.railways()]
+    cutoffs = {p.name: p.cutoff(now) for p in selected}
+    deleted_files = deleted_folders = 0
+    if not selected:
+        return deleted_files, deleted_folders
+
+    for xml_dir in xml_dirs:
+        if not os.path.isdir(xml_dir):
+            print(f"{xml_dir} does not exist, skipping XML cleanup.")
+            continue
+        emptied = set()  # folders we deleted something from
+        for root, dirs, files in os.walk(xml_dir, topdown=False):
+            parts = os.path.relpath(root, xml_dir).split(os.sep)
+            for name in files:
+                if not name.lower().endswith(".xml"):
+                    continue
+                path = os.path.join(root, name)
+                names = parts + [name[:-4]]
+                file_date = None
+                for policy in selected:
+                    if not policy.matches_station(*names):
+                        continue
+                    if cutoffs[policy.name] is not None:
+                        file_date = file_date or _file_date(parts, path)
+                        if file_date.isoformat() >= cutoffs[policy.name]:
+                            continue
+                    if not dry_run:
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            break  # gone already or still being written
+                        emptied.add(root)
+                    deleted_files += 1
+                    break
+            # only folders this run emptied: a downloader may have just created an empty one
+            if root != xml_dir and (root in emptied or any(os.path.join(root, d) in emptied for d in dirs)):
+                try:
+                    os.rmdir(root)
+                    deleted_folders += 1
+                    emptied.add(root)
+                except OSError:
+                    pass  # not empty
+    verb = "Would delete" if dry_run else "Deleted"
+    print(f"[XML] {verb} {deleted_files} files and {deleted_folders} folders ({', '.join(p.name for p in selected)})")
+    return deleted_files, deleted_folders
+
+
+def run(policies, base_dir=".", xml_dirs=XML_DIRS, chunk=DELETE_CHUNK, dry_run=False):
+    apply_rows(policies, base_dir, chunk=chunk, dry_run=dry_run)
+    apply_xml(policies, xml_dirs, dry_run=dry_run)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete old or unwanted stationboard rows and XML files by policy")
+    parser.add_argument("--dir", default=".", help="Folder holding the databases and partitions")
+    parser.add_argument("--xml-dir", action="append", help=f"XML folder (repeatable, default: {', '.join(XML_DIRS)})")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_run = sub.add_parser("run", help="Apply the policies (POLICIES, --policies, or the one given by the flags)")
+    p_run.add_argument("--policies", help="JSON file with a list of policies")
+    p_run.add_argument("--railway", choices=sorted(RAILWAYS))
+    p_run.add_argument("--older-than-days", type=int)
+    p_run.add_argument("--before", help="ISO date/time, exclusive")
+    p_run.add_argument("--stations", help="Only stations matching this glob, e.g. '*flughafen*'")
+    p_run.add_argument("--keep-stations", help="Keep stations matching this glob, e.g. '*hbf*'")
+    p_run.add_argument("--scope", default="rows", help="rows, xml or rows,xml")
+    p_run.add_argument("--chunk", type=int, default=DELETE_CHUNK, help="Rows per delete transaction")
+    p_run.add_argument("--dry-run", action="store_true", help="Only print what would be deleted")
+    p_vacuum = sub.add_parser("enable-vacuum", help="Enable incremental vacuum on an existing file (full VACUUM)")
+    p_vacuum.add_argument("--db", default=SBB_DB, help="SQLite DB filename")
+    args = parser.parse_args()
+
+    if args.command == "enable-vacuum":
+        enable_vacuum(args.db)
+        print(f"{args.db}: auto_vacuum=INCREMENTAL")
+        return
+
+    if any(v is not None for v in (args.older_than_days, args.before, args.stations, args.keep_stations)):
+        policies = [Policy("command-line", railway=args.railway, older_than_days=args.older_than_days,
+                           before=args.before, stations=args.stations, keep_stations=args.keep_stations,
+                           scope=args.scope)]
+    elif args.policies:
+        policies = load_policies(args.policies)
+    else:
+        policies = POLICIES
+    run(policies, args.dir, tuple(args.xml_dir or XML_DIRS), chunk=args.chunk, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
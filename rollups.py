@@ -0,0 +1,171 @@
+# rollups.py
+# Pre-aggregated delay statistics per station, category, train and hour
+#
+#     delay_rollup(station, hour 'YYYY-MM-DDTHH', category, train_name,
+#                  departures, delay_count, delay_sum, delay_max, delayed_count)
+#
+# Triggers on `stationboard` keep the rollup in step with the raw rows, inside the same
+# transaction as the INSERT/DELETE, so every ingest and cleanup script maintains it without
+# changes. The dashboard reads a few hundred rollup rows instead of weeks of raw rows.
+# Deleting rows lowers counts and sums; delay_max is not lowered (rebuild to recompute it).
+#
+#     python rollups.py --db sbb_data.db --rebuild
+
+import argparse
+
+from data_access import SBB_DB, write_connection
+
+# PRIMARY KEY columns must not be NULL in a WITHOUT ROWID table
+KEY_COLUMNS = ("station", "hour", "category", "train_name")
+
+
+def key_values(ref):
+    """SQL expressions for the rollup key of row `ref` (new/old in a trigger, or a table alias)"""
+    return (f"COALESCE({ref}.station, '')",
+            f"COALESCE(substr({ref}.fetched_at, 1, 13), '')",
+            f"COALESCE({ref}.category, '')",
+            f"COALESCE({ref}.train_name, '')")
+
+
+def rollup_add_sql(ref):
+    """Statement adding row `ref` to its rollup bucket"""
+    return f"""
+        INSERT INTO delay_rollup ({', '.join(KEY_COLUMNS)},
+                                  departures, delay_count, delay_sum, delay_max, delayed_count)
+        VALUES ({', '.join(key_values(ref))}, 1, {ref}.delay_minutes IS NOT NULL,
+                COALESCE({ref}.delay_minutes, 0), {ref}.delay_minutes, COALESCE({ref}.delay_minutes > 0, 0))
+        ON CONFLICT ({', '.join(KEY_COLUMNS)}) DO UPDATE SET
+            departures = departures + 1,
+            delay_count = delay_count + excluded.delay_count,
+            delay_sum = delay_sum + excluded.delay_sum,
+            delay_max = CASE WHEN delay_max IS NULL OR excluded.delay_max > delay_max
+                             THEN excluded.delay_max ELSE delay_max END,
+            delayed_count = delayed_count + excluded.delayed_count;"""
+
+
+def rollup_remove_sql(ref):
+    """Statements removing row `ref` from its rollup bucket (the bucket goes when it is empty)"""
+    where = " AND ".join(f"{col} = {val}" for col, val in zip(KEY_COLUMNS, key_values(ref)))
+    return f"""
+        UPDATE delay_rollup SET
+            departures = departures - 1,
+            delay_count = delay_count - ({ref}.delay_minutes IS NOT NULL),
+            delay_sum = delay_sum - COALESCE({ref}.delay_minutes, 0),
+            delayed_count = delayed_count - COALESCE({ref}.delay_minutes > 0, 0)
+        WHERE {where};
+        DELETE FROM delay_rollup WHERE {where} AND departures <= 0;"""
+
+
+ROLLUP_TABLE_SQL = f"""
+    CREATE TABLE IF NOT EXISTS delay_rollup (
+        station TEXT NOT NULL,
+        hour TEXT NOT NULL,
+        category TEXT NOT NULL,
+        train_name TEXT NOT NULL,
+        departures INTEGER NOT NULL,
+        delay_count INTEGER NOT NULL,
+        delay_sum INTEGER NOT NULL,
+        delay_max INTEGER,
+        delayed_count INTEGER NOT NULL,
+        PRIMARY KEY ({', '.join(KEY_COLUMNS)})
+    ) WITHOUT ROWID;
+"""
+
+BACKFILL_SQL = f"""
+    INSERT INTO delay_rollup ({', '.join(KEY_COLUMNS)},
+                              departures, delay_count, delay_sum, delay_max, delayed_count)
+    SELECT {', '.join(key_values('s'))}, COUNT(*), COUNT(s.delay_minutes),
+           COALESCE(SUM(s.delay_minutes), 0), MAX(s.delay_minutes), COALESCE(SUM(s.delay_minutes > 0), 0)
+    FROM stationboard s
+    GROUP BY 1, 2, 3, 4;
+"""
+
+# Triggers for a plain `stationboard` table (compact_schema puts the same statements
+# into the INSTEAD OF triggers of its view)
+ROLLUP_TRIGGERS_SQL = f"""
+    CREATE TRIGGER IF NOT EXISTS stationboard_rollup_insert AFTER INSERT ON stationboard
+    BEGIN{rollup_add_sql('new')}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS stationboard_rollup_delete AFTER DELETE ON stationboard
+    BEGIN{rollup_remove_sql('old')}
+    END;
+"""
+
+# Used as a db_schema migration: table, backfill from existing rows, then triggers
+ROLLUP_MIGRATION_SQL = ROLLUP_TABLE_SQL + BACKFILL_SQL + ROLLUP_TRIGGERS_SQL
+
+# ------------------------
+# Queries
+# ------------------------
+# Mean delay per train of one station since an hour key; same result as
+# df.groupby('train_name')['delay_minutes'].mean() over the raw rows
+TRAIN_MEAN_SQL = """
+    SELECT train_name, CAST(SUM(delay_sum) AS REAL) / SUM(delay_count) AS predicted_delay
+    FROM delay_rollup
+    WHERE station = ? AND hour >= ?
+    GROUP BY train_name
+    HAVING SUM(delay_count) > 0
+"""
+
+# Categories seen at one station since an hour key
+CATEGORIES_SQL = """
+    SELECT DISTINCT category
+    FROM delay_rollup
+    WHERE station = ? AND hour >= ? AND category != ''
+    ORDER BY category
+"""
+
+# avg / delayed / max of one station since an hour key
+STATION_SUMMARY_SQL = """
+    SELECT CAST(SUM(delay_sum) AS REAL) / SUM(delay_count), SUM(delayed_count), MAX(delay_max), SUM(departures)
+    FROM delay_rollup
+    WHERE station = ? AND hour >= ?
+"""
+
+
+def hour_key(dt):
+    """datetime -> rollup hour key 'YYYY-MM-DDTHH' (same prefix as the ISO fetched_at)"""
+    return dt.strftime("%Y-%m-%dT%H")
+
+
+def station_summary(conn, station, since_hour):
+    """(avg delay, delayed count, max delay, departures) of a station since hour key `since_hour`"""
+    avg, delayed, maximum, departures = conn.execute(STATION_SUMMARY_SQL, (station, since_hour)).fetchone()
+    return avg or 0, delayed or 0, maximum or 0, departures or 0
+
+
+def rebuild_rollups(conn):
+    """Recompute delay_rollup from the raw rows (fixes delay_max after partial deletes)"""
+    conn.execute("BEGIN")
+    try:
+        conn.execute(ROLLUP_TABLE_SQL)
+        conn.execute("DELETE FROM delay_rollup")
+        n = conn.execute(BACKFILL_SQL).rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the delay_rollup table from raw stationboard rows")
+    parser.add_argument("--db", default=SBB_DB, help="SQLite DB filename")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute all rollup rows")
+    args = parser.parse_args()
+
+    conn = write_connection(args.db)
+    conn.isolation_level = None
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'delay_rollup'").fetchone()
+    if exists is None:
+        print(f"{args.db}: no delay_rollup table yet, run db_schema.py first")
+    elif args.rebuild:
+        print(f"{args.db}: {rebuild_rollups(conn)} rollup rows")
+    else:
+        n = conn.execute("SELECT COUNT(*) FROM delay_rollup").fetchone()[0]
+        print(f"{args.db}: {n} rollup rows (use --rebuild to recompute)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+# snapshot_sync.py
+# Publish a stationboard database as a snapshot plus delta batches, and keep a local mirror of it
+#
+# Published layout, servable by any static HTTP host (a GitHub repo, `python -m http.server`):
+#
+#     db_data.db                             consistent snapshot (VACUUM INTO), rollback-journal mode
+#     db_data.db.sha256                      "<sha256 hex>  db_data.db"
+#     db_data.db.deltas/manifest.json        {"base_id", "columns", "batches": [{"file", "first_id", "last_id", "sha256"}, ...]}
+#     db_data.db.deltas/<first>-<last>.json.gz   stationboard rows with base_id < id, by id
+#
+#     python snapshot_sync.py --db db_data.db publish --out dist        # where the data is collected
+#     python snapshot_sync.py --db db_data.db pull --url http://localhost:8000/db_data.db [--delta]
+#
+# pull streams the snapshot in 1 MB chunks into <db>.download while hashing it, and resumes an
+# interrupted transfer with an HTTP Range request (a partial file is only reused for the same
+# published checksum). The verified file then replaces the live database: by os.replace
+# when there is none yet, otherwise through SQLite's backup API, which swaps the content in
+# one transaction that readers see whole or not at all. (Renaming over a WAL database that
+# other processes have open would pair their old -wal/-shm files with the new file.)
+#
+# With --delta only the batches above the local high-water mark (MAX(id)) are fetched and
+# inserted. Delta rows carry no raw payloads, and deletions on the publishing side are not
+# replayed; a full pull brings both back. When the published batches don't reach back to the
+# local high-water mark (no local database yet, or pruned batches), pull takes the snapshot.
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+
+import requests
+
+from bulk_writer import BulkWriter
+from data_access import DB_DB, read_connection, write_connection
+from raw_store import RAW_COLUMNS
+
+CHUNK = 1 << 20          # bytes per streamed read/write
+DELTA_BATCH = 50_000     # rows per delta file
+KEEP_BATCHES = 500       # delta files kept; older ones are pruned (base_id moves up)
+DEFAULT_TIMEOUT = 30
+
+
+def sha256_file(path, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK), b""):
+            digest.update(block)
+    return digest
+
+
+def _write_atomic(path, data):
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+
+def delta_url(url):
+    return url + ".deltas/"
+
+
+def high_water(conn):
+    """Largest stationboard id (0 for an empty or missing table)"""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'stationboard'").fetchone() is None:
+        return 0
+    return conn.execute("SELECT MAX(id) FROM stationboard").fetchone()[0] or 0
+
+
+# ------------------------
+# Publishing side
+# ------------------------
+def publish_snapshot(db, out_dir):
+    """Write a consistent copy of `db` and its checksum into `out_dir`. Returns the sha256 hex."""
+    os.makedirs(out_dir, exist_ok=True)
+    name = os.path.basename(db)
+    path = os.path.join(out_dir, name)
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = write_connection(db)  # readers are query_only, which VACUUM INTO refuses
+    conn.commit()
+    conn.execute("VACUUM INTO ?", (tmp_path,))  # only reads db (WAL): ingest keeps running
+    snapshot = sqlite3.connect(tmp_path)
+    snapshot.execute("PRAGMA journal_mode=DELETE")  # a single self-contained file
+    snapshot.close()
+    digest = sha256_file(tmp_path).hexdigest()
+    os.replace(tmp_path, path)
+    _write_atomic(path + ".sha256", f"{digest}  {name}\n".encode())
+    return digest
+
+
+def publish_deltas(db, out_dir, batch_rows=DELTA_BATCH, keep_batches=KEEP_BATCHES):
+    """Append delta files for the rows added since the last publish. Returns the number of rows."""
+    delta_dir = os.path.join(out_dir, os.path.basename(db) + ".deltas")
+    os.makedirs(delta_dir, exist_ok=True)
+    manifest_path = os.path.join(delta_dir, "manifest.json")
+    with read_connection(db) as conn:
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        else:
+            # the snapshot published with it holds everything so far
+            manifest = {"base_id": high_water(conn), "batches": []}
+        columns = [r[1] for r in conn.execute("PRAGMA table_info(stationboard)") if r[1] not in RAW_COLUMNS]
+        manifest["columns"] = columns
+        last_id = manifest["batches"][-1]["last_id"] if manifest["batches"] else manifest["base_id"]
+
+        written = 0
+        cur = conn.execute(f"SELECT {', '.join(columns)} FROM stationboard WHERE id > ? ORDER BY id", (last_id,))
+        id_idx = columns.index("id")
+        while True:
+            rows = cur.fetchmany(batch_rows)
+            if not rows:
+                break
+            first, last = rows[0][id_idx], rows[-1][id_idx]
+            name = f"{first:012d}-{last:012d}.json.gz"
+            data = gzip.compress(json.dumps({"columns": columns, "rows": rows}).encode(), 6)
+            _write_atomic(os.path.join(delta_dir, name), data)
+            manifest["batches"].append({"file": name, "first_id": first, "last_id": last,
+                                        "rows": len(rows), "sha256": hashlib.sha256(data).hexdigest()})
+            written += len(rows)
+
+    pruned, manifest["batches"] = manifest["batches"][:-keep_batches], manifest["batches"][-keep_batches:]
+    if pruned:
+        manifest["base_id"] = pruned[-1]["last_id"]
+    _write_atomic(manifest_path, json.dumps(manifest, indent=1).encode())
+    for batch in pruned:
+        os.remove(os.path.join(delta_dir, batch["file"]))
+    return written
+
+
+# ------------------------
+# Mirror side
+# ------------------------
+def published_checksum(session, url, timeout=DEFAULT_TIMEOUT):
+    resp = session.get(url + ".sha256", timeout=timeout)
+    resp.raise_for_status()
+    return resp.text.split()[0].lower()
+
+
+def download(session, url, dest, expected, timeout=DEFAULT_TIMEOUT):
+    """
+    Stream `url` into `dest`, resuming a partial `dest` of the same `expected` sha256,
+    and verify it. Raises ValueError (and drops the partial file) on a checksum mismatch.
+    """
+    state_path = dest + ".json"
+    offset = 0
+    if os.path.exists(dest):
+        try:
+            with open(state_path, encoding="utf-8") as f:
+                same = json.load(f).get("sha256") == expected
+        except (OSError, ValueError):
+            same = False
+        offset = os.path.getsize(dest) if same else 0
+    if not offset:
+        with open(state_path, "w", encoding="utf-8") as f:
+            json.dump({"url": url, "sha256": expected}, f)
+    digest = sha256_file(dest) if offset else hashlib.sha256()
+
+    # identity encoding: byte ranges must refer to the file itself
+    headers = {"Accept-Encoding": "identity"}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as resp:
+        if not (offset and resp.status_code == 416):  # 416: the partial file is already complete
+            resp.raise_for_status()
+            if offset and resp.status_code != 206:
+                offset, digest = 0, hashlib.sha256()  # the server ignored Range: start over
+            with open(dest, "ab" if offset else "wb") as f:
+                for block in resp.iter_content(CHUNK):
+                    f.write(block)
+                    digest.update(block)
+                f.flush()
+                os.fsync(f.fileno())
+
+    os.remove(state_path)
+    if digest.hexdigest() != expected:
+        os.remove(dest)
+        raise ValueError(f"{url}: checksum mismatch (got {digest.hexdigest()}, published {expected})")
+    return dest
+
+
+def install_snapshot(path, db):
+    """Make the verified snapshot at `path` the content of `db`, atomically for readers"""
+    if not os.path.exists(db):
+        os.replace(path, db)
+        return
+    src = sqlite3.connect(path)
+    try:
+        dst = write_connection(db)
+        dst.commit()
+        src.backup(dst)  # one write transaction on db; waits for the busy timeout if ingest holds the lock
+    finally:
+        src.close()
+    os.remove(path)
+
+
+def pull_snapshot(url, db=DB_DB, session=None, timeout=DEFAULT_TIMEOUT):
+    """Download and install the published snapshot unless it is the one installed last. Returns True if installed."""
+    session = session or requests.Session()
+    expected = published_checksum(session, url, timeout)
+    installed_path = db + ".sha256"  # checksum of the snapshot installed last
+    if os.path.exists(db) and os.path.exists(installed_path):
+        with open(installed_path, encoding="utf-8") as f:
+            if f.read().split()[0] == expected:
+                return False
+    path = download(session, url, db + ".download", expected, timeout)
+    install_snapshot(path, db)
+    _write_atomic(installed_path, f"{expected}  {os.path.basename(db)}\n".encode())
+    return True
+
+
+def pull_deltas(url, db=DB_DB, session=None, timeout=DEFAULT_TIMEOUT):
+    """
+    Insert the published rows above the local high-water mark, one transaction per batch.
+    Returns the number of rows inserted, or None if the deltas can't bring `db` up to date.
+    """
+    session = session or requests.Session()
+    resp = session.get(delta_url(url) + "manifest.json", timeout=timeout)
+    if resp.status_code == 404:
+        return None
+    resp.raise_for_status()
+    manifest = resp.json()
+    if not os.path.exists(db):
+        return None
+    conn = write_connection(db)
+    hw = high_water(conn)
+    if not hw or hw < manifest["base_id"]:
+        return None
+
+    local = {r[1] for r in conn.execute("PRAGMA table_info(stationboard)")}
+    keep = [i for i, c in enumerate(manifest["columns"]) if c in local]
+    columns = [manifest["columns"][i] for i in keep]
+    id_idx = manifest["columns"].index("id")
+    sql = f"INSERT OR IGNORE INTO stationboard ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    inserted = 0
+    for batch in manifest["batches"]:
+        if batch["last_id"] <= hw:
+            continue
+        resp = session.get(delta_url(url) + batch["file"], timeout=timeout)
+        resp.raise_for_status()
+        if hashlib.sha256(resp.content).hexdigest() != batch["sha256"]:
+            raise ValueError(f"{batch['file']}: checksum mismatch")
+        rows = [r for r in json.loads(gzip.decompress(resp.content))["rows"] if r[id_idx] > hw]
+        with BulkWriter(conn, sql, batch_size=len(rows) + 1) as writer:
+            writer.add_many(tuple(r[i] for i in keep) for r in rows)
+        inserted += len(rows)
+    return inserted
+
+
+def sync(url, db=DB_DB, delta=False, session=None, timeout=DEFAULT_TIMEOUT):
+    """Bring `db` up to date with the published copy; returns a short description of what happened"""
+    session = session or requests.Session()
+    if delta:
+        inserted = pull_deltas(url, db, session, timeout)
+        if inserted is not None:
+            return f"{inserted} new rows from delta batches"
+    if pull_snapshot(url, db, session, timeout):
+        return "snapshot installed"
+    return "snapshot unchanged"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish or mirror a stationboard database snapshot")
+    parser.add_argument("--db", default=DB_DB, help="SQLite DB filename")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_pub = sub.add_parser("publish", help="Write snapshot, checksum and delta batches into a folder")
+    p_pub.add_argument("--out", default="dist", help="Folder served over HTTP")
+    p_pub.add_argument("--deltas-only", action="store_true", help="Skip the (full-copy) snapshot")
+    p_pub.add_argument("--batch-rows", type=int, default=DELTA_BATCH)
+    p_pull = sub.add_parser("pull", help="Update the local database from a published copy")
+    p_pull.add_argument("--url", required=True, help="URL of the published .db file")
+    p_pull.add_argument("--delta", action="store_true", help="Fetch only new rows when possible")
+    p_pull.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT)
+    args = parser.parse_args()
+
+    if args.command == "publish":
+        if not args.deltas_only:
+            print(f"Snapshot sha256 {publish_snapshot(args.db, args.out)}")
+        print(f"Published {publish_deltas(args.db, args.out, args.batch_rows)} new rows as deltas")
+    else:
+        print(f"{args.db}: {sync(args.url, args.db, delta=args.delta, timeout=args.timeout)}")
+
+
+if __name__ == "__main__":
+    main()
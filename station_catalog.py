@@ -0,0 +1,173 @@
+# station_catalog.py
+# Per-station metadata kept next to the stationboard rows
+#
+#     station_stats(station, rows, first_fetched_at, last_fetched_at,
+#                   last_fetch_at, last_fetch_rows, last_fetch_error)
+#
+# Row counts and first/last timestamps are maintained by triggers on `stationboard`
+# (inserts from every ingest script, deletes from cleanup), in the same transaction.
+# The last-fetch columns are written by the SBB fetchers via record_fetch().
+# "How many rows", "which stations" and "when was X last updated" become lookups
+# in a table with one row per station instead of COUNT(*) / DISTINCT scans.
+#
+#     python station_catalog.py --db sbb_data.db [--rebuild]
+
+import argparse
+from datetime import datetime
+
+from data_access import SBB_DB, write_connection
+
+STATS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS station_stats (
+        station TEXT PRIMARY KEY,
+        rows INTEGER NOT NULL DEFAULT 0,
+        first_fetched_at TEXT,
+        last_fetched_at TEXT,
+        last_fetch_at TEXT,
+        last_fetch_rows INTEGER,
+        last_fetch_error TEXT
+    );
+"""
+
+BACKFILL_SQL = """
+    INSERT INTO station_stats (station, rows, first_fetched_at, last_fetched_at)
+    SELECT COALESCE(station, ''), COUNT(*), MIN(fetched_at), MAX(fetched_at)
+    FROM stationboard
+    GROUP BY 1
+    ON CONFLICT (station) DO UPDATE SET
+        rows = excluded.rows,
+        first_fetched_at = excluded.first_fetched_at,
+        last_fetched_at = excluded.last_fetched_at;
+"""
+
+
+def stats_add_sql(ref, fetched_at=None):
+    """
+    Statement counting row `ref` in its station's catalog entry; `fetched_at` is the SQL
+    for its timestamp as the table returns it (default: {ref}.fetched_at as written)
+    """
+    fetched_at = fetched_at or f"{ref}.fetched_at"
+    return f"""
+        INSERT INTO station_stats (station, rows, first_fetched_at, last_fetched_at)
+        VALUES (COALESCE({ref}.station, ''), 1, {fetched_at}, {fetched_at})
+        ON CONFLICT (station) DO UPDATE SET
+            rows = rows + 1,
+            first_fetched_at = CASE WHEN first_fetched_at IS NULL OR excluded.first_fetched_at < first_fetched_at
+                                    THEN excluded.first_fetched_at ELSE first_fetched_at END,
+            last_fetched_at = CASE WHEN last_fetched_at IS NULL OR excluded.last_fetched_at > last_fetched_at
+                                   THEN excluded.last_fetched_at ELSE last_fetched_at END;"""
+
+
+def table_bound(ref):
+    """MIN/MAX(fetched_at) of row `ref`'s station on a plain stationboard table (an index seek)"""
+    return lambda fn: f"(SELECT {fn}(fetched_at) FROM stationboard WHERE station = {ref}.station)"
+
+
+def stats_remove_sql(ref, bound=None):
+    """
+    Statements removing row `ref` from its station's catalog entry. When the row held the
+    first or last timestamp, the new bound is looked up with bound('MIN'/'MAX')
+    (default: the stationboard table). Entries without rows or fetch history are deleted.
+    """
+    bound = bound or table_bound(ref)
+    where = f"station = COALESCE({ref}.station, '')"
+    return f"""
+        UPDATE station_stats SET
+            rows = rows - 1,
+            first_fetched_at = CASE WHEN {ref}.fetched_at <= first_fetched_at
+                                    THEN {bound('MIN')} ELSE first_fetched_at END,
+            last_fetched_at = CASE WHEN {ref}.fetched_at >= last_fetched_at
+                                   THEN {bound('MAX')} ELSE last_fetched_at END
+        WHERE {where};
+        DELETE FROM station_stats WHERE {where} AND rows <= 0 AND last_fetch_at IS NULL;"""
+
+
+STATS_TRIGGERS_SQL = f"""
+    CREATE TRIGGER IF NOT EXISTS stationboard_stats_insert AFTER INSERT ON stationboard
+    BEGIN{stats_add_sql('new')}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS stationboard_stats_delete AFTER DELETE ON stationboard
+    BEGIN{stats_remove_sql('old')}
+    END;
+"""
+
+# Used as a db_schema migration
+STATS_MIGRATION_SQL = STATS_TABLE_SQL + BACKFILL_SQL + STATS_TRIGGERS_SQL
+
+RECORD_FETCH_SQL = """
+    INSERT INTO station_stats (station, last_fetch_at, last_fetch_rows, last_fetch_error)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (station) DO UPDATE SET
+        last_fetch_at = excluded.last_fetch_at,
+        last_fetch_rows = excluded.last_fetch_rows,
+        last_fetch_error = excluded.last_fetch_error
+"""
+
+
+def fetch_status_row(station, rows=None, error=None):
+    """RECORD_FETCH_SQL parameters for the outcome of an API fetch of `station`"""
+    return (station, datetime.utcnow().isoformat(), rows, str(error) if error is not None else None)
+
+
+def record_fetch(conn, station, rows=None, error=None):
+    """Remember the outcome of the latest API fetch of `station` (rows stored, or the error)"""
+    conn.execute(RECORD_FETCH_SQL, fetch_status_row(station, rows, error))
+    conn.commit()
+
+
+# ------------------------
+# Reads
+# ------------------------
+def total_rows(conn):
+    return conn.execute("SELECT COALESCE(SUM(rows), 0) FROM station_stats").fetchone()[0]
+
+
+def station_names(conn):
+    """Stations that have rows, sorted"""
+    return [r[0] for r in conn.execute(
+        "SELECT station FROM station_stats WHERE rows > 0 AND station != '' ORDER BY station")]
+
+
+def station_info(conn, station):
+    """dict of one station's catalog entry, or None"""
+    cur = conn.execute("SELECT * FROM station_stats WHERE station = ?", (station,))
+    row = cur.fetchone()
+    return dict(zip([d[0] for d in cur.description], row)) if row else None
+
+
+def rebuild_stats(conn):
+    """Recompute counts and bounds from the raw rows (fetch history is kept)"""
+    conn.execute("BEGIN")
+    try:
+        conn.execute("UPDATE station_stats SET rows = 0, first_fetched_at = NULL, last_fetched_at = NULL")
+        conn.execute(BACKFILL_SQL)
+        conn.execute("DELETE FROM station_stats WHERE rows <= 0 AND last_fetch_at IS NULL")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show (or rebuild) the per-station catalog of a stationboard database")
+    parser.add_argument("--db", default=SBB_DB, help="SQLite DB filename")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute counts and first/last timestamps")
+    args = parser.parse_args()
+
+    conn = write_connection(args.db)
+    conn.isolation_level = None
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'station_stats'").fetchone() is None:
+        print(f"{args.db}: no station_stats table yet, run db_schema.py first")
+        return
+    if args.rebuild:
+        rebuild_stats(conn)
+    for station, rows, first, last, fetch_at, fetch_rows, error in conn.execute(
+            "SELECT * FROM station_stats ORDER BY station"):
+        fetch = f"last fetch {fetch_at} ({error or f'{fetch_rows} rows'})" if fetch_at else ""
+        print(f"{station or '(none)'}: {rows} rows, {first} .. {last} {fetch}")
+    print(f"Total: {total_rows(conn)} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+# test_snapshot_sync.py
+# snapshot_sync against a local HTTP server that answers Range requests and can drop a
+# download half-way
+#
+#     python -m pytest -q test_snapshot_sync.py      (or: python -m unittest test_snapshot_sync)
+
+import os
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+
+import data_access
+import snapshot_sync
+from ingest_sbb import INSERT_SQL, create_db
+
+
+class RangeHandler(SimpleHTTPRequestHandler):
+    """Static files with `Range: bytes=N-`; `server.cut` = (path, n) drops that download after n bytes, once"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        rng = self.headers.get("Range")
+        self.server.requests.append((self.path, rng))
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            return self.send_error(404)
+        size = os.path.getsize(path)
+        start = int(rng.split("=")[1].split("-")[0]) if rng else 0
+        if start >= size > 0:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.end_headers()
+            return
+        if rng:
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(size - start))
+        self.end_headers()
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read()
+        if self.server.cut and self.server.cut[0] == self.path:
+            cut, self.server.cut = self.server.cut[1], None
+            self.wfile.write(data[:cut])
+            self.wfile.flush()
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        self.wfile.write(data)
+
+
+def add_rows(db, n, start=0):
+    now = datetime(2025, 10, 24, 12, 0)
+    rows = [((now + timedelta(minutes=start + i)).isoformat(), f"S{i % 3}", f"IC{i % 7}", "IC", "X", "SBB",
+             None, None, 60, i % 5, None) for i in range(n)]
+    conn = data_access.write_connection(db)
+    conn.executemany(INSERT_SQL, rows)
+    conn.commit()
+
+
+def rows(db, sql="SELECT id, fetched_at, station, delay_minutes FROM stationboard ORDER BY id"):
+    conn = sqlite3.connect(db)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+def row_count(db):
+    return rows(db, "SELECT COUNT(*) FROM stationboard")[0][0]
+
+
+class SnapshotSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.dir, "db_data.db")  # the publishing side
+        self.dist = os.path.join(self.dir, "dist")
+        self.mirror = os.path.join(self.dir, "mirror", "db_data.db")
+        os.makedirs(os.path.dirname(self.mirror))
+        create_db(data_access.write_connection(self.source))
+        add_rows(self.source, 2000)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), partial(RangeHandler, directory=self.dist))
+        self.server.requests = []
+        self.server.cut = None
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/db_data.db"
+        self.session = requests.Session()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.session.close()
+        data_access.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def publish(self):
+        digest = snapshot_sync.publish_snapshot(self.source, self.dist)
+        snapshot_sync.publish_deltas(self.source, self.dist, batch_rows=100)
+        return digest
+
+    def test_first_pull_renames_the_verified_file(self):
+        self.publish()
+        with mock.patch("snapshot_sync.os.replace", wraps=os.replace) as replace:
+            self.assertTrue(snapshot_sync.pull_snapshot(self.url, self.mirror, self.session))
+        replace.assert_any_call(self.mirror + ".download", self.mirror)
+        self.assertFalse(os.path.exists(self.mirror + ".download"))
+        self.assertEqual(row_count(self.mirror), 2000)
+        # same published checksum: nothing is downloaded again
+        self.server.requests.clear()
+        self.assertFalse(snapshot_sync.pull_snapshot(self.url, self.mirror, self.session))
+        self.assertEqual([p for p, _ in self.server.requests], ["/db_data.db.sha256"])
+
+    def test_checksum_mismatch_keeps_the_installed_database(self):
+        self.publish()
+        snapshot_sync.pull_snapshot(self.url, self.mirror, self.session)
+        add_rows(self.source, 10, start=2000)
+        self.publish()
+        with open(os.path.join(self.dist, "db_data.db"), "r+b") as f:  # damaged in transit
+            f.seek(5000)
+            f.write(b"\xff" * 16)
+        with self.assertRaises(ValueError):
+            snapshot_sync.pull_snapshot(self.url, self.mirror, self.session)
+        self.assertEqual(row_count(self.mirror), 2000)
+        self.assertFalse(os.path.exists(self.mirror + ".download"))
+        with open(self.mirror + ".sha256", encoding="utf-8") as f:  # still the old snapshot
+            installed = f.read().split()[0]
+        self.assertEqual(installed, snapshot_sync.sha256_file(self.mirror).hexdigest())
+
+    def test_interrupted_download_resumes_with_range(self):
+        digest = self.publish()
+        self.server.cut = ("/db_data.db", 20000)
+        with mock.patch("snapshot_sync.CHUNK", 4096), self.assertRaises(requests.RequestException):
+            snapshot_sync.pull_snapshot(self.url, self.mirror, self.session)
+        partial_size = os.path.getsize(self.mirror + ".download")
+        self.assertTrue(0 < partial_size <= 20000)
+        self.assertFalse(os.path.exists(self.mirror))
+
+        self.server.requests.clear()
+        self.assertTrue(snapshot_sync.pull_snapshot(self.url, self.mirror, self.session))
+        self.assertIn(("/db_data.db", f"bytes={partial_size}-"), self.server.requests)
+        self.assertEqual(snapshot_sync.sha256_file(self.mirror).hexdigest(), digest)
+        self.assertEqual(row_count(self.mirror), 2000)
+
+    def test_install_over_open_wal_database(self):
+        self.publish()
+        snapshot_sync.pull_snapshot(self.url, self.mirror, self.session)
+        writer = data_access.write_connection(self.mirror)
+        self.assertEqual(writer.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        reader = sqlite3.connect(self.mirror)
+        reader.execute("BEGIN")
+        self.assertEqual(reader.execute("SELECT COUNT(*) FROM stationboard").fetchone()[0], 2000)
+
+        add_rows(self.source, 500, start=2000)
+        self.publish()
+        self.assertTrue(snapshot_sync.pull_snapshot(self.url, self.mirror, self.session))
+        # the open read transaction keeps its view; the next one sees the whole new snapshot
+        self.assertEqual(reader.execute("SELECT COUNT(*) FROM stationboard").fetchone()[0], 2000)
+        reader.commit()
+        self.assertEqual(reader.execute("SELECT COUNT(*) FROM stationboard").fetchone()[0], 2500)
+        self.assertEqual(reader.execute("PRAGMA integrity_check").fetchone()[0], "ok")
+        reader.close()
+        self.assertEqual(writer.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        self.assertEqual(writer.execute("SELECT COUNT(*) FROM stationboard").fetchone()[0], 2500)
+
+    def test_deltas_from_the_local_high_water_mark(self):
+        self.publish()
+        snapshot_sync.pull_snapshot(self.url, self.mirror, self.session)
+        add_rows(self.source, 250, start=2000)
+        snapshot_sync.publish_deltas(self.source, self.dist, batch_rows=100)
+        self.assertEqual(snapshot_sync.pull_deltas(self.url, self.mirror, self.session), 250)
+
+        add_rows(self.source, 30, start=2250)
+        snapshot_sync.publish_deltas(self.source, self.dist, batch_rows=100)
+        self.server.requests.clear()
+        self.assertEqual(snapshot_sync.pull_deltas(self.url, self.mirror, self.session), 30)
+        fetched = [p for p, _ in self.server.requests if p.endswith(".json.gz")]
+        self.assertEqual(len(fetched), 1)  # batches at or below the high-water mark are skipped
+        self.assertEqual(row_count(self.mirror), 2280)
+        self.assertEqual(rows(self.mirror), rows(self.source))
+
+    def test_deltas_need_a_local_database(self):
+        self.publish()
+        self.assertIsNone(snapshot_sync.pull_deltas(self.url, self.mirror, self.session))
+        self.assertEqual(snapshot_sync.sync(self.url, self.mirror, delta=True, session=self.session),
+                         "snapshot installed")
+
+
+if __name__ == "__main__":
+    unittest.main()
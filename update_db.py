@@ -1,50 +1,53 @@
+import argparse
 import sqlite3
 import pandas as pd
 import requests
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime
 import os
 
+from data_access import DB_DB
+from retention import Policy, apply_xml
+from snapshot_sync import sync
+
 # -----------------------------
 # Config
 # -----------------------------
+# Published with `snapshot_sync.py publish` (db_data.db + .sha256 + .deltas/)
 GITHUB_URL = "https://github.com/yourusername/yourrepo/raw/main/db_data.db"
-LOCAL_DB_PATH = Path("db_data.db")
+LOCAL_DB_PATH = Path(DB_DB)
 XML_FOLDER = Path("data")  # Папка с XML файлами
 KEEP_DAYS = 7  # Сколько дней XML хранить
 
 # -----------------------------
 # Update DB
 # -----------------------------
-def update_db():
-    response = requests.get(GITHUB_URL)
-    if response.status_code == 200:
-        with open(LOCAL_DB_PATH, "wb") as f:
-            f.write(response.content)
-        print(f"{datetime.now()}: DB updated successfully!")
-    else:
-        print(f"{datetime.now()}: Failed to download DB, status code {response.status_code}")
+def update_db(url=GITHUB_URL, delta=False):
+    # Streamed to a temp file, checked against the published sha256, resumed if interrupted,
+    # swapped in atomically; with delta=True only rows newer than ours (see snapshot_sync.py)
+    try:
+        result = sync(url, str(LOCAL_DB_PATH), delta=delta)
+    except (requests.RequestException, ValueError, OSError, sqlite3.Error) as e:
+        print(f"{datetime.now()}: Failed to update DB: {e}")
+        return
+    print(f"{datetime.now()}: DB updated successfully! ({result})")
 
 # -----------------------------
 # Cleanup old XMLs
 # -----------------------------
 def cleanup_xml():
-    cutoff_date = datetime.now() - timedelta(days=KEEP_DAYS)
-    if not XML_FOLDER.exists():
-        print(f"{XML_FOLDER} does not exist, skipping XML cleanup.")
-        return
-
-    removed = 0
-    for file in XML_FOLDER.glob("*.xml"):
-        if datetime.fromtimestamp(file.stat().st_mtime) < cutoff_date:
-            file.unlink()
-            removed += 1
-    print(f"{datetime.now()}: Removed {removed} old XML files.")
+    # files outside YYYY-MM-DD folders are aged by mtime
+    policy = Policy("update-db-xml", railway="db", older_than_days=KEEP_DAYS, scope=("xml",))
+    apply_xml([policy], xml_dirs=(str(XML_FOLDER),))
 
 # -----------------------------
 # Main
 # -----------------------------
 if __name__ == "__main__":
-    update_db()
+    parser = argparse.ArgumentParser(description="Update the local DB from its published copy and clean up old XMLs")
+    parser.add_argument("--url", default=GITHUB_URL, help="URL of the published db_data.db")
+    parser.add_argument("--delta", action="store_true", help="Fetch only rows added since the local copy")
+    args = parser.parse_args()
+    update_db(args.url, delta=args.delta)
     cleanup_xml()
 
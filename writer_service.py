@@ -0,0 +1,288 @@
+# writer_service.py
+# One process owns the SQLite write connection; ingest producers send it row batches
+#
+#     python writer_service.py --db sbb_data.db serve      # run the service (foreground)
+#     python writer_service.py --db sbb_data.db status     # queue and throughput counters
+#
+# While the service runs, ingest_sbb.py (any number of copies) and the dashboard's
+# background fetcher send their rows to it instead of writing themselves, so they no
+# longer compete for the database lock. They find it through a local socket next to the
+# database file (<db>.writer; a named pipe on Windows).
+#
+# A batch is a list of (sql, rows, raw_column) groups that belong in one transaction.
+# Handler threads (one per producer) put batches on a queue that is bounded by the number
+# of queued rows: when it is full, producers block in write() (backpressure). One writer
+# thread drains the queue and commits every batch that is waiting in a single transaction
+# (group commit), so more producers mean larger, not more, transactions. write() returns
+# once its batch is committed. A batch that fails is retried alone, so it can't take the
+# other producers' rows down with it.
+
+import argparse
+import hashlib
+import os
+import queue
+import signal
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+from data_access import SBB_DB, write_connection
+from db_schema import migrate
+from raw_store import RawStore
+
+DEFAULT_MAX_ROWS = 50_000          # rows per group-commit transaction
+DEFAULT_MAX_QUEUED_ROWS = 200_000  # producers block above this
+
+
+class WriterError(Exception):
+    """A batch the service could not commit (the message carries the SQLite error)"""
+
+
+def writer_address(db):
+    """Socket the service for `db` listens on"""
+    path = os.path.abspath(db)
+    if os.name == "nt":
+        return r"\\.\pipe\stationboard-writer-" + hashlib.blake2b(path.encode(), digest_size=8).hexdigest()
+    return path + ".writer"
+
+
+# ------------------------
+# Producer side
+# ------------------------
+class WriterClient:
+    """Connection of one producer to the service; safe to share between threads"""
+
+    def __init__(self, address):
+        self.address = address
+        self._conn = Client(address)
+        self._lock = threading.Lock()
+
+    def _call(self, message):
+        with self._lock:
+            self._conn.send(message)
+            status, value = self._conn.recv()
+        if status == "error":
+            raise WriterError(value)
+        return value
+
+    def write(self, groups):
+        """
+        Commit [(sql, rows, raw_column), ...] in one transaction; returns the number of rows.
+        raw_column is the index of a raw_json/raw_xml value to move into the raw payload
+        store (see raw_store.py), or None. Blocks while the service's queue is full.
+        """
+        groups = [(sql, list(rows), raw) for sql, rows, raw in groups]
+        groups = [g for g in groups if g[1]]
+        if not groups:
+            return 0
+        return self._call(("write", groups))
+
+    def stats(self):
+        return self._call(("stats",))
+
+    def close(self):
+        self._conn.close()
+
+
+def connect_writer(db, address=None):
+    """A WriterClient if a service for `db` is running, else None (write directly)"""
+    address = address or writer_address(db)
+    if os.name != "nt" and not os.path.exists(address):
+        return None
+    try:
+        return WriterClient(address)
+    except OSError:
+        return None
+
+
+# ------------------------
+# Service side
+# ------------------------
+class _Batch:
+    def __init__(self, groups):
+        self.groups = groups
+        self.rows = sum(len(rows) for _, rows, _ in groups)
+        self.done = threading.Event()
+        self.error = None
+
+
+class WriterService:
+    """Accepts batches from producers and commits them from a single connection"""
+
+    def __init__(self, db, address=None, max_rows=DEFAULT_MAX_ROWS, max_queued_rows=DEFAULT_MAX_QUEUED_ROWS):
+        self.db = db
+        self.address = address or writer_address(db)
+        self.max_rows = max_rows
+        self.max_queued_rows = max_queued_rows
+        self._queue = queue.Queue()
+        self._space = threading.Condition()
+        self._queued_rows = 0
+        self._raw_stores = {}  # raw column index -> RawStore
+        self.counters = {"batches": 0, "rows": 0, "transactions": 0, "failed_batches": 0, "blocked": 0}
+        self.started = time.time()
+
+    # --- writer thread ---
+    def _apply(self, conn, batches):
+        """executemany per statement over all groups of `batches` (order kept per statement)"""
+        pending = {}
+        for batch in batches:
+            for sql, rows, raw in batch.groups:
+                if raw is not None:
+                    store = self._raw_stores.get(raw)
+                    if store is None:
+                        store = self._raw_stores[raw] = RawStore(column=raw)
+                        store.create_table(conn)
+                    split = [store.split(tuple(row)) for row in rows]
+                    rows = [r for r, _ in split]
+                    payloads = [p for _, p in split if p is not None]
+                    if payloads:
+                        pending.setdefault(store.sql, []).extend(payloads)
+                pending.setdefault(sql, []).extend(rows)
+        conn.execute("BEGIN")
+        try:
+            for sql, rows in pending.items():
+                conn.executemany(sql, rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            for store in self._raw_stores.values():
+                store.forget()  # payloads of this attempt were not stored
+            raise
+        for store in self._raw_stores.values():
+            store.commit()
+
+    def _drain(self):
+        conn = write_connection(self.db)
+        migrate(conn)
+        RawStore().create_table(conn)
+        conn.commit()
+        while True:
+            batches = [self._queue.get()]
+            rows = batches[0].rows
+            while rows < self.max_rows:
+                try:
+                    batch = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batches.append(batch)
+                rows += batch.rows
+            try:
+                self._apply(conn, batches)
+                self.counters["transactions"] += 1
+            except Exception:
+                # find the bad batch: commit the others one by one
+                for batch in batches:
+                    try:
+                        self._apply(conn, [batch])
+                        self.counters["transactions"] += 1
+                    except Exception as e:
+                        batch.error = f"{type(e).__name__}: {e}"
+                        self.counters["failed_batches"] += 1
+            with self._space:
+                self._queued_rows -= rows
+                self._space.notify_all()
+            for batch in batches:
+                if batch.error is None:
+                    self.counters["batches"] += 1
+                    self.counters["rows"] += batch.rows
+                batch.done.set()
+
+    # --- producer handlers ---
+    def _submit(self, groups):
+        for sql, _, _ in groups:
+            if not sql.lstrip().upper().startswith("INSERT"):
+                raise WriterError("only INSERT / upsert statements are accepted")
+        batch = _Batch(groups)
+        with self._space:
+            if self._queued_rows and self._queued_rows + batch.rows > self.max_queued_rows:
+                self.counters["blocked"] += 1
+                while self._queued_rows and self._queued_rows + batch.rows > self.max_queued_rows:
+                    self._space.wait()
+            self._queued_rows += batch.rows
+        self._queue.put(batch)
+        batch.done.wait()
+        if batch.error is not None:
+            raise WriterError(batch.error)
+        return batch.rows
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    if message[0] == "write":
+                        reply = ("ok", self._submit(message[1]))
+                    elif message[0] == "stats":
+                        reply = ("ok", self.stats())
+                    else:
+                        reply = ("error", f"unknown request {message[0]!r}")
+                except WriterError as e:
+                    reply = ("error", str(e))
+                conn.send(reply)
+
+    def stats(self):
+        elapsed = time.time() - self.started
+        return dict(self.counters, queued_rows=self._queued_rows, uptime_s=round(elapsed),
+                    rows_per_s=round(self.counters["rows"] / elapsed) if elapsed else 0)
+
+    def serve_forever(self):
+        if os.name != "nt" and os.path.exists(self.address):
+            probe = connect_writer(self.db, self.address)
+            if probe is not None:
+                probe.close()
+                raise SystemExit(f"A writer service is already running on {self.address}")
+            os.remove(self.address)  # left over from a service that died
+        threading.Thread(target=self._drain, name="writer", daemon=True).start()
+        listener = Listener(self.address)
+        if os.name != "nt":
+            os.chmod(self.address, 0o600)  # messages are pickles: only this user may connect
+        print(f"Writer service for {self.db} listening on {self.address}")
+        try:
+            while True:
+                conn = listener.accept()
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()  # also removes the Unix socket file
+            self.wait_idle()
+
+    def wait_idle(self, timeout=30):
+        """Wait until every queued batch is committed (on shutdown)"""
+        deadline = time.monotonic() + timeout
+        with self._space:
+            while self._queued_rows and time.monotonic() < deadline:
+                self._space.wait(max(0.0, deadline - time.monotonic()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Single-writer service for concurrent ingest producers")
+    parser.add_argument("--db", default=SBB_DB, help="SQLite DB filename")
+    parser.add_argument("--address", help="Socket path / pipe name (default: <db>.writer)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_serve = sub.add_parser("serve", help="Run the service in the foreground")
+    p_serve.add_argument("--max-rows", type=int, default=DEFAULT_MAX_ROWS, help="Rows per transaction")
+    p_serve.add_argument("--max-queued-rows", type=int, default=DEFAULT_MAX_QUEUED_ROWS,
+                         help="Producers block while this many rows wait")
+    sub.add_parser("status", help="Print the counters of a running service")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        signal.signal(signal.SIGTERM, signal.default_int_handler)  # stop like Ctrl+C: drain, remove the socket
+        service = WriterService(args.db, args.address, max_rows=args.max_rows, max_queued_rows=args.max_queued_rows)
+        try:
+            service.serve_forever()
+        except KeyboardInterrupt:
+            print(f"Stopped: {service.stats()}")
+    else:
+        client = connect_writer(args.db, args.address)
+        if client is None:
+            print(f"No writer service running for {args.db}")
+            return
+        print(client.stats())
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+# xml_stream.py
+# Streaming reader for Deutsche Bahn timetable XML (plan / fchg files)
+#
+# ET.parse() builds the whole tree before we can look at the first stop.
+# iter_elements() uses iterparse instead: each <s> element is handed to the caller
+# as soon as it is complete and then freed, so memory stays flat for any file size.
+
+import xml.etree.ElementTree as ET
+
+
+def iter_elements(filepath, tag="s"):
+    """
+    Yield (station_name, element) for every completed <tag> element in the file.
+    `station_name` is the `station` attribute of the document root.
+    The element is only valid until the next iteration: it is cleared and detached afterwards.
+    """
+    station_name = "Unknown"
+    stack = []  # currently open elements, root first
+
+    for event, elem in ET.iterparse(filepath, events=("start", "end")):
+        if event == "start":
+            if not stack:
+                station_name = elem.attrib.get("station", "Unknown")
+            stack.append(elem)
+            continue
+
+        stack.pop()
+        if elem.tag != tag:
+            continue
+
+        yield station_name, elem
+
+        # Free the element and drop the parent's reference to it
+        elem.clear()
+        if stack:
+            stack[-1].remove(elem)
+